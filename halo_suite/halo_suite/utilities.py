@@ -222,40 +222,50 @@ def scan_file_compiler(mode: str,
     return os.path.join(save_path,save_name)
         
         
-def read_hpl(file,config):
+def read_hpl(file,config,save_index=True):
     '''
     Read kinematic from hlp lidar file
     '''
     
+    #ray headers from sidecar index
+    index=index_hpl(file,config,save=save_index)
+    
     #read ranges
-    with open(file, "r") as fid:
-        Nr=int(fid.readlines()[config['hpl_Nr']].split(':')[1].strip())
-        fid.seek(0)
-        dr=np.float64(fid.readlines()[config['hpl_dr']].split(':')[1].strip())
-        fid.seek(0)
-        ppr=int(fid.readlines()[config['hpl_ppr']].split(':')[1].strip())
-        fid.seek(0)
-        mode=fid.readlines()[config['hpl_mode']].split(' - ')[1].strip().upper()
-        if mode=='STEPPED':
-            mode='SSM'
-        fid.seek(0)
-        data=fid.readlines()[config['hpl_header']::Nr+1]
-       
+    header=str(index['header']).splitlines()
+    Nr=int(header[config['hpl_Nr']].split(':')[1].strip())
+    dr=np.float64(header[config['hpl_dr']].split(':')[1].strip())
+    ppr=int(header[config['hpl_ppr']].split(':')[1].strip())
+    mode=header[config['hpl_mode']].split(' - ')[1].strip().upper()
+    if mode=='STEPPED':
+        mode='SSM'
+    
+    #first gate info (time, angles)
+    tnum=index['time']*3600
+    azi=index['azimuth']
+    ele=index['elevation']
+            
+    return tnum, azi, ele, Nr, dr, ppr, mode
 
-        #zeroing (specific file)
-        tnum=[]
-        azi=[]
-        ele=[]
-         
-        #read only first gate info (time, angles)
-        for d in np.array(data):
-            d_split=np.array(d.split(' '))
-            d_split=d_split[d_split!='']
-            tnum=np.append(tnum,np.float64(d_split[config['hpl_index_time']])*3600)
-            azi=np.append(azi,np.float64(d_split[config['hpl_index_azi']]))
-            ele=np.append(ele,np.float64(d_split[config['hpl_index_ele']]))
-                
-        return tnum, azi, ele, Nr, dr, ppr, mode
+def index_hpl(file,config,save=True,chunk_size=2**24):
+    '''
+    Build (or load if up to date) the sidecar index <file>.idx.npz of hpl lidar file, with the byte offset, 
+    time (decimal hours), azimuth and elevation of each ray header. Offsets are followed by the end of the last complete ray.
+    The index is shared with lidargo (index_halo) and rebuilt if made with different header lines or ray header fields.
+    '''
+    #line scan and index schema shared with lidargo
+    from lidargo.format import load_halo_index, save_halo_index, scan_halo_rays
+    
+    fields=np.array([config['hpl_index_time'],config['hpl_index_azi'],config['hpl_index_ele']])
+    index=load_halo_index(file,config['hpl_header'],fields)
+    if index is not None:
+        return index
+    
+    with open(file, 'rb') as fid:
+        header=[fid.readline().decode().replace('\r\n','\n') for i in range(config['hpl_header'])]
+        Nr=int(header[config['hpl_Nr']].split(':')[1].strip())
+        offset,info=scan_halo_rays(fid,Nr,fields,chunk_size)
+        
+    return save_halo_index(file,''.join(header),Nr,config['hpl_header'],fields,offset,info,save)
         
 def angular_error(params,ang_range,dang,ppr,Dt_p,Dt_a,Dt_d,ppd,ang_tol=10**-10):
     '''
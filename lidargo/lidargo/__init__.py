@@ -1,7 +1,8 @@
 # lidargo/__init__.py
 from .format import Format
-from .standardize import Standardize
+from .standardize import Standardize, StandardizeStream
 from .statistics import Statistics
+from .watch import Watcher
 # from .qcReport import QCReport
 from .logger import SingletonLogger
 from . import utilities
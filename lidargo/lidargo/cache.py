@@ -0,0 +1,153 @@
+'''
+Opt-in cache of the arrays parsed from raw lidar files.
+
+Each entry is a directory of .npy arrays plus a JSON file of metadata, keyed by the path, size and
+modification time of the raw file. Arrays are loaded back as read-only memory maps, so reprocessing
+a cached file does not parse (or copy) the raw data again.
+'''
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import xarray as xr
+
+
+class ParseCache:
+    def __init__(self, path: str, max_size: float = 10 * 2**30):
+        """
+        Initialize the cache of parsed raw files.
+
+        Args:
+            path (str): Directory of the cache. Created if missing.
+            max_size (float, optional): Maximum size of the cache in bytes. Least recently used entries are evicted above it. Defaults to 10 GiB.
+        """
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, source: str, kind: str) -> str:
+        """Cache key of a raw file, based on parser kind, absolute path, size and modification time."""
+        stat = os.stat(source)
+        string = f"{kind}|{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(string.encode()).hexdigest()
+
+    def load(self, source: str, kind: str):
+        """
+        Load the parsed arrays of a raw file.
+
+        Returns:
+            (dict, dict) or None: memory-mapped arrays and metadata, or None if the file is not cached
+        """
+        entry = os.path.join(self.path, self.key(source, kind))
+        try:
+            with open(os.path.join(entry, "meta.json"), "r") as f:
+                meta = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(entry, name + ".npy"), mmap_mode="r")
+                for name in meta["arrays"]
+            }
+        except (OSError, ValueError):
+            return None
+
+        # mark entry as recently used
+        os.utime(os.path.join(entry, "meta.json"))
+        return arrays, meta["meta"]
+
+    def save(self, source: str, kind: str, arrays: dict, meta: dict):
+        """Store the parsed arrays and JSON-serializable metadata of a raw file, then enforce the size cap."""
+        entry = os.path.join(self.path, self.key(source, kind))
+        if os.path.isdir(entry):
+            return
+
+        # write in a temporary directory and move it in place, so readers never see partial entries
+        temp = tempfile.mkdtemp(dir=self.path, prefix=".tmp")
+        try:
+            for name, values in arrays.items():
+                np.save(os.path.join(temp, name + ".npy"), np.asarray(values), allow_pickle=False)
+            with open(os.path.join(temp, "meta.json"), "w") as f:
+                json.dump({"source": os.path.abspath(source), "arrays": list(arrays), "meta": meta}, f, default=_to_json)
+            os.rename(temp, entry)
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def size(self) -> int:
+        """Total size of the cache in bytes."""
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits within max_size."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for _, entry, _ in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def _entries(self):
+        """List of (last access time, directory, size) of the cache entries."""
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                last_access = os.path.getmtime(os.path.join(entry, "meta.json"))
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+            except OSError:
+                continue
+            entries.append((last_access, entry, size))
+        return entries
+
+
+def get_cache(cache) -> ParseCache:
+    """Utility function to get a cache from either a ParseCache, a directory, or None."""
+    if cache is None or isinstance(cache, ParseCache):
+        return cache
+    return ParseCache(cache)
+
+
+def dataset_to_arrays(ds: xr.Dataset):
+    """Split a dataset into a dictionary of arrays and the JSON-serializable metadata needed to rebuild it."""
+    arrays = {}
+    meta = {"attrs": ds.attrs, "coords": list(ds.coords), "variables": {}}
+    for i, (name, var) in enumerate(ds.variables.items()):
+        values = var.values
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f"v{i}"] = values
+        meta["variables"][name] = {
+            "array": f"v{i}",
+            "dims": list(var.dims),
+            "attrs": var.attrs,
+            "encoding": {k: v for k, v in var.encoding.items() if k not in ["source", "original_shape"]},
+        }
+    return arrays, meta
+
+
+def arrays_to_dataset(arrays: dict, meta: dict) -> xr.Dataset:
+    """Rebuild a dataset split by dataset_to_arrays."""
+    variables = {}
+    for name, v in meta["variables"].items():
+        variables[name] = xr.Variable(v["dims"], arrays[v["array"]], attrs=v["attrs"], encoding=v["encoding"])
+    coords = {name: variables.pop(name) for name in meta["coords"]}
+    return xr.Dataset(variables, coords=coords, attrs=meta["attrs"])
+
+
+def _to_json(value):
+    """JSON fallback for numpy values in attributes and encodings."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
@@ -0,0 +1,295 @@
+'''
+Command line interface of LiDARGO.
+
+The format, standardize and statistics commands process the files selected by glob patterns and an optional time
+range on a pool of worker processes. Configurations and output names are resolved before any input is opened, so
+that files whose outputs already exist are skipped at no cost, and the status and timing of every file are written
+to a JSON manifest. The watch command formats and standardizes raw files as they land (see watch.py).
+'''
+import os
+import re
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lidargo.format import Format
+from lidargo.standardize import Standardize
+from lidargo.statistics import Statistics
+from lidargo.logger import SingletonLogger
+from lidargo.utilities import get_logger, _load_configuration, output_exists, zarr_store_name
+from lidargo import watch
+
+
+def select_files(patterns, start=None, end=None):
+    """
+    Files matching the glob patterns, optionally limited to the time stamps in their names within [start, end]
+
+    Inputs:
+    ------
+    patterns: list
+        glob patterns (recursive)
+    start, end: str
+        first and last time stamp as YYYYMMDD or YYYYMMDD.HHMMSS (optional)
+
+    Outputs:
+    -------
+    files: list
+        sorted file names
+    """
+    files = sorted(set(f for p in patterns for f in glob.glob(p, recursive=True) if os.path.isfile(f)))
+    if start is None and end is None:
+        return files
+
+    start = re.sub(r"\D", "", start or "").ljust(14, "0")
+    end = re.sub(r"\D", "", end or "99999999").ljust(14, "9")
+    selected = []
+    for f in files:
+        # time stamp as in 20240301.010203 (formatted), 20240301_010203 (Halo), 20240301_01 (hourly Halo Stare)
+        # or 2024-03-01_01-00-00 (WindCube)
+        match = re.search(r"(\d{4})-?(\d{2})-?(\d{2})(?:[._](\d{2})(?:-?(\d{2}))?(?:-?(\d{2}))?)?", os.path.basename(f))
+        if match is None:
+            continue
+        stamp = "".join(g or "00" for g in match.groups())
+        if start <= stamp <= end:
+            selected.append(f)
+    return selected
+
+
+def resolve(step, source, config, save_path=None):
+    """
+    Configuration and output name of a file, without opening it
+
+    Outputs:
+    -------
+    config: LidarConfigFormat, LidarConfigStand or str
+        configuration of the file (None if not available)
+    save_filename: str
+        name of the output file (None if not available)
+    key: str
+        output the file is written to (its Zarr store for Zarr output, files sharing a store are processed in series)
+    message: str
+        reason why the configuration or output name are not available
+    """
+    # configuration and naming messages are not relevant to the batch log
+    quiet = SingletonLogger(verbose=False, logger=logging.getLogger("lidargo.cli.resolve"))
+
+    if step == "statistics":
+        lproc = Statistics(source, config, verbose=False, load=False)
+        if "config" not in dir(lproc):
+            return None, None, None, "No configuration matching the file name"
+        save_filename = lproc.output_filename(save_path)
+        return config, save_filename, save_filename, ""
+
+    config, message = _load_configuration(config, source, step)
+    if config is None:
+        return None, None, None, message
+    if step == "format":
+        lproc = Format(source, config=config, logger=quiet)
+    else:
+        lproc = Standardize(source, config=config, logger=quiet, load=False)
+    save_filename = lproc.output_filename(save_path)
+    if save_filename is None:
+        return None, None, None, "File not supported"
+
+    if config.output_format == "zarr":
+        return config, save_filename, zarr_store_name(save_filename, config.zarr_grouping), ""
+    return config, save_filename, save_filename, ""
+
+
+def process_files(step, items, save_path=None, make_figures=False, verbose=False, logfile=None):
+    """
+    Run a processing step on a list of files in series (in the worker processes)
+
+    Inputs:
+    ------
+    step: str
+        format, standardize or statistics
+    items: list
+        (source, config, save_filename) of each file
+
+    Outputs:
+    -------
+    results: list
+        status, output, duration in seconds and message of each file
+    """
+    results = []
+    for source, config, save_filename in items:
+        start = time.time()
+        try:
+            if step == "format":
+                lproc = Format(source, config=config, verbose=verbose, logfile=logfile)
+                lproc.process_scan(save_path=save_path, make_figures=make_figures)
+            elif step == "standardize":
+                lproc = Standardize(source, config=config, verbose=verbose, logfile=logfile, load=False)
+                lproc.process_scan(save_path=save_path, make_figures=make_figures)
+            else:
+                lproc = Statistics(source, config, verbose=verbose, load=False)
+                lproc.process_scan(save_file=True, save_path=save_path, make_figures=make_figures)
+
+            output_format = getattr(config, "output_format", "netcdf")
+            grouping = getattr(config, "zarr_grouping", "daily")
+            status = "done" if output_exists(save_filename, output_format, grouping) else "no output"
+            message = ""
+        except Exception as e:
+            status = "failed"
+            message = str(e)
+        results.append({"status": status, "seconds": time.time() - start, "message": message})
+    return results
+
+
+def run(
+    step, patterns, config, save_path=None, start=None, end=None, jobs=1, replace=False, manifest=None,
+    make_figures=False, verbose=False, logfile=None,
+):
+    """
+    Process the selected files on a pool of worker processes and write the manifest
+
+    Outputs:
+    -------
+    entries: list
+        source, output, status, duration in seconds and message of each file
+    """
+    logger = get_logger(verbose=True, filename=logfile)
+    started = time.time()
+    if manifest is None:
+        manifest = f"lidargo.{step}.{time.strftime('%Y%m%d.%H%M%S')}.manifest.json"
+
+    # resolve configurations and output names, and skip existing outputs, before opening any input
+    files = select_files(patterns, start, end)
+    entries = []
+    groups = OrderedDict()
+    for source in files:
+        entry = {"source": source, "output": None, "status": "", "seconds": 0.0, "message": ""}
+        entries.append(entry)
+        try:
+            config_file, save_filename, key, message = resolve(step, source, config, save_path)
+        except Exception as e:
+            config_file, message = None, str(e)
+            entry["status"] = "failed"
+        if config_file is None:
+            entry["status"] = entry["status"] or "no configuration"
+            entry["message"] = message
+            continue
+        entry["output"] = save_filename
+        output_format = getattr(config_file, "output_format", "netcdf")
+        grouping = getattr(config_file, "zarr_grouping", "daily")
+        if not replace and output_exists(save_filename, output_format, grouping):
+            entry["status"] = "skipped"
+            continue
+        entry["status"] = "queued"
+        groups.setdefault(key, []).append((entry, (source, config_file, save_filename)))
+
+    logger.log(
+        f"{len(files)} files selected for {step}, {sum(len(g) for g in groups.values())} to process "
+        + f"({sum(e['status'] == 'skipped' for e in entries)} already processed) with {jobs} jobs"
+    )
+
+    def write_manifest():
+        temp = manifest + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(
+                {
+                    "step": step,
+                    "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+                    "seconds": time.time() - started,
+                    "jobs": jobs,
+                    "files": entries,
+                },
+                f,
+                indent=1,
+            )
+        os.replace(temp, manifest)
+
+    def record(group, results):
+        for (entry, _), result in zip(group, results):
+            entry.update(result)
+            logger.log(
+                f"{os.path.basename(entry['source'])}: {entry['status']} in {entry['seconds']:.1f} s"
+                + (f" ({entry['message']})" if entry["message"] else "")
+            )
+        write_manifest()
+
+    write_manifest()
+    tasks = [(group, [item for _, item in group]) for group in groups.values()]
+    if jobs == 1:
+        for group, items in tasks:
+            record(group, process_files(step, items, save_path, make_figures, verbose, logfile))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(process_files, step, items, save_path, make_figures, verbose, logfile): group
+                for group, items in tasks
+            }
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [{"status": "failed", "seconds": 0.0, "message": str(e)}] * len(group)
+                record(group, results)
+
+    write_manifest()
+    counts = {}
+    for entry in entries:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    logger.log(
+        f"{step} completed in {time.time() - started:.1f} s: "
+        + ", ".join(f"{n} {status}" for status, n in counts.items())
+        + f", manifest saved as {manifest}"
+    )
+    return entries
+
+
+def main(args=None):
+    """
+    Entry point of the lidargo command.
+    """
+    args = sys.argv[1:] if args is None else args
+    if len(args) > 0 and args[0] == "watch":
+        return watch.main(args[1:])
+
+    parser = argparse.ArgumentParser(prog="lidargo", description="Format, standardize, and compute statistics of lidar data.")
+    commands = parser.add_subparsers(dest="step", required=True)
+    commands.add_parser("watch", help="format and standardize raw files as they land in a directory (see lidargo watch -h)")
+    for step, description in [
+        ("format", "format raw files into a0-level netCDF files"),
+        ("standardize", "standardize formatted files (quality control and scan geometry)"),
+        ("statistics", "compute LiSBOA statistics of standardized files"),
+    ]:
+        command = commands.add_parser(step, help=description, description=description)
+        command.add_argument("source", nargs="+", help="glob patterns of the input files (quoted, ** matches subdirectories)")
+        command.add_argument("--config", required=True, help="Excel configuration file")
+        command.add_argument("--save-path", help="directory of the output files (defaults to next to the inputs)")
+        command.add_argument("--start", help="first time stamp in the file names, as YYYYMMDD or YYYYMMDD.HHMMSS")
+        command.add_argument("--end", help="last time stamp in the file names, as YYYYMMDD or YYYYMMDD.HHMMSS")
+        command.add_argument("--jobs", "-j", type=int, default=1, help="number of worker processes")
+        command.add_argument("--replace", action="store_true", help="reprocess files whose outputs already exist")
+        command.add_argument("--manifest", help="JSON manifest of the status and timing of each file")
+        command.add_argument("--make-figures", action="store_true", help="save the QC figures")
+        command.add_argument("--verbose", action="store_true", help="print the processing log of each file")
+        command.add_argument("--logfile", help="log file")
+    args = parser.parse_args(args)
+
+    entries = run(
+        args.step,
+        args.source,
+        args.config,
+        save_path=args.save_path,
+        start=args.start,
+        end=args.end,
+        jobs=args.jobs,
+        replace=args.replace,
+        manifest=args.manifest,
+        make_figures=args.make_figures,
+        verbose=args.verbose,
+        logfile=args.logfile,
+    )
+    return 1 if any(entry["status"] == "failed" for entry in entries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,41 @@ from dataclasses import dataclass
 from datetime import datetime
 import re
 
+# Named netCDF encoding profiles of the output files:
+#   compression: encoding keys of compressed variables
+#   chunks: chunk size along each dimension (full length if not listed), so that a chunk holds whole scans
+#   float32: store floating point data variables in single precision
+#   integers: integer dtype of flags and IDs (qc_wind_speed is stored as uint16 in every profile)
+#   packing: scale/offset packing of selected variables
+ENCODING_PROFILES = {
+    "default": {},
+    "zlib": {
+        "compression": {"zlib": True, "complevel": 4, "shuffle": True},
+        "chunks": {"time": 1000, "scanID": 1},
+    },
+    "zstd": {
+        "compression": {"compression": "zstd", "complevel": 4, "shuffle": True},
+        "chunks": {"time": 1000, "scanID": 1},
+    },
+    "compact": {
+        "compression": {"zlib": True, "complevel": 4, "shuffle": True},
+        "chunks": {"time": 1000, "scanID": 1},
+        "float32": True,
+        "integers": {"qc_wind_speed": "uint16", "beamID": "int32", "scanID": "int32", "range_gate": "int32"},
+    },
+    "packed": {
+        "compression": {"zlib": True, "complevel": 4, "shuffle": True},
+        "chunks": {"time": 1000, "scanID": 1},
+        "float32": True,
+        "integers": {"qc_wind_speed": "uint16", "beamID": "int32", "scanID": "int32", "range_gate": "int32"},
+        "packing": {
+            "wind_speed": {"dtype": "int16", "scale_factor": 0.002, "add_offset": 0.0, "_FillValue": -32768},
+            "SNR": {"dtype": "int16", "scale_factor": 0.01, "add_offset": 0.0, "_FillValue": -32768},
+        },
+    },
+}
+
+
 @dataclass
 class LidarConfigFormat:
     """Configuration parameters for LIDAR formatting."""
@@ -10,17 +45,45 @@ class LidarConfigFormat:
     site: str = 'sc1'
     instrument_id: int = 1
     data_level_out: str='a0'
+    rename_mode: str = 'copy'
+    encoding_profile: str = 'default'
+    output_format: str = 'netcdf'
+    zarr_grouping: str = 'daily'
+    precision: str = 'float64'
 
     def _validate_model(self, model: str, field_name: str) -> None:
         """Validate lidal model."""
         if model != 'halo' and model !='windcube':
             raise ValueError(f"Lidar model {model} not supported")
             
+    def _validate_rename_mode(self, rename_mode: str, field_name: str) -> None:
+        """Validate strategy to create the 00-level file."""
+        valid_rename_modes = ['copy', 'hardlink', 'symlink', 'virtual']
+        if rename_mode not in valid_rename_modes:
+            raise ValueError(f"{field_name} must be one of {valid_rename_modes}")
+            
     def _validate_z_id(self, instrument_id: str, field_name: str) -> None:
         """Validate instrument ID."""
         if instrument_id<0 or instrument_id>99:
             raise ValueError("Instrument ID must be within 0 and 99")
-        
+
+    def _validate_encoding_profile(self, encoding_profile: str, field_name: str) -> None:
+        """Validate netCDF encoding profile."""
+        if encoding_profile not in ENCODING_PROFILES:
+            raise ValueError(f"{field_name} must be one of {list(ENCODING_PROFILES)}")
+
+    def _validate_output_format(self, output_format: str, zarr_grouping: str) -> None:
+        """Validate output backend and grouping of Zarr stores."""
+        if output_format not in ["netcdf", "zarr"]:
+            raise ValueError("output_format must be one of ['netcdf', 'zarr']")
+        if zarr_grouping not in ["daily", "instrument"]:
+            raise ValueError("zarr_grouping must be one of ['daily', 'instrument']")
+
+    def _validate_precision(self, precision: str, field_name: str) -> None:
+        """Validate floating-point precision of the processed arrays."""
+        if precision not in ["float64", "float32"]:
+            raise ValueError(f"{field_name} must be one of ['float64', 'float32']")
+
     #Validate data levels
     valid_data_levels = ["a"+str(i) for i in range(10)]
     if data_level_out not in valid_data_levels:
@@ -31,6 +94,10 @@ class LidarConfigFormat:
         # Validate dates
         self._validate_model(self.model, "start_date")
         self._validate_z_id(self.instrument_id, "end_date")
+        self._validate_rename_mode(self.rename_mode, "rename_mode")
+        self._validate_encoding_profile(self.encoding_profile, "encoding_profile")
+        self._validate_output_format(self.output_format, self.zarr_grouping)
+        self._validate_precision(self.precision, "precision")
         self.z_id=f"z{self.instrument_id:02}"
 
 @dataclass
@@ -77,6 +144,11 @@ class LidarConfigStand:
     rename_vars: str = ""
     rename_attrs: str = ""
     range_name: str="distance"
+    encoding_profile: str = "default"
+    output_format: str = "netcdf"
+    zarr_grouping: str = "daily"
+    precision: str = "float64"
+    block_duration: float = 0.0
     
     def _validate_date_format(self, date: int, field_name: str) -> None:
         """Validate date format (YYYYMMDD)."""
@@ -114,6 +186,23 @@ class LidarConfigStand:
         if not re.match(pattern, value):
             raise ValueError(f"{field_name} format is invalid: {value}")
 
+    def _validate_encoding_profile(self, encoding_profile: str, field_name: str) -> None:
+        """Validate netCDF encoding profile."""
+        if encoding_profile not in ENCODING_PROFILES:
+            raise ValueError(f"{field_name} must be one of {list(ENCODING_PROFILES)}")
+
+    def _validate_output_format(self, output_format: str, zarr_grouping: str) -> None:
+        """Validate output backend and grouping of Zarr stores."""
+        if output_format not in ["netcdf", "zarr"]:
+            raise ValueError("output_format must be one of ['netcdf', 'zarr']")
+        if zarr_grouping not in ["daily", "instrument"]:
+            raise ValueError("zarr_grouping must be one of ['daily', 'instrument']")
+
+    def _validate_precision(self, precision: str, field_name: str) -> None:
+        """Validate floating-point precision of the processed arrays."""
+        if precision not in ["float64", "float32"]:
+            raise ValueError(f"{field_name} must be one of ['float64', 'float32']")
+
     def validate(self) -> None:
         """Validate all configuration parameters."""
         # Validate dates
@@ -191,5 +280,11 @@ class LidarConfigStand:
             self.local_scattering_min_limit, 0, 1, "local_scattering_min_limit"
         )
         self._validate_positive(self.max_resonance_rmse, "max_resonance_rmse")
+        self._validate_non_negative(self.block_duration, "block_duration")
+
+        # Validate output encoding, backend and precision
+        self._validate_encoding_profile(self.encoding_profile, "encoding_profile")
+        self._validate_output_format(self.output_format, self.zarr_grouping)
+        self._validate_precision(self.precision, "precision")
         
                 
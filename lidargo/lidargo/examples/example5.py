@@ -67,7 +67,8 @@ plt.close('all')
 plt.figure(figsize=(18,10))
 for qc_sel in range(12):
     ax=plt.subplot(4,3,qc_sel+1)  
-    sel=~np.isnan(X_all+Y_all+qc)*(qc==qc_sel)
+    qc_bits=np.nan_to_num(qc).astype(int)
+    sel=~np.isnan(X_all+Y_all+qc)*((qc_bits==0) if qc_sel==0 else (qc_bits>>(qc_sel-1))%2==1)
     if qc_sel==0:
         sc=ax.scatter(X_all[sel],Y_all[sel],s=5,c='g',alpha=0.1)
         plt.title('good')
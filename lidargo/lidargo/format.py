@@ -9,10 +9,13 @@ import numpy as np
 import re
 from typing import Union, Optional
 import matplotlib.pyplot as plt
-from datetime import datetime
 import shutil
-from lidargo.utilities import get_logger, with_logging, format_time_xticks,_load_configuration
+import itertools
+import mmap
+import netCDF4
+from lidargo.utilities import get_logger, with_logging, format_time_xticks, get_encoding, _load_configuration, zarr_store_name, append_to_zarr, output_exists, set_precision
 from lidargo.config import LidarConfigFormat
+from lidargo.cache import ParseCache, get_cache, dataset_to_arrays, arrays_to_dataset
 
 class Format:
     def __init__(
@@ -22,6 +25,7 @@ class Format:
         verbose: bool = True,
         logger: Optional[object] = None,
         logfile=None,
+        cache: Union[str, ParseCache, None] = None,
     ):
         """
         Initialize the LIDAR data processor with configuration parameters.
@@ -31,9 +35,11 @@ class Format:
             config (str, dict, or LidarConfig): Either a path to an Excel config file, a dictionary of configuration parameters, or a LidarConfig object
             verbose (bool, optional): Whether to print QC-related information. Defaults to True.
             logger (Logger, optional): Logger instance for logging messages. Defaults to None.
+            cache (str or ParseCache, optional): Cache (or cache directory) of parsed raw files. Defaults to None (no caching).
         """
         self.logger = get_logger(verbose=verbose, logger=logger,filename=logfile)
         self.source = source
+        self.cache = get_cache(cache)
 
         self.logger.log(
             f"Initializing formatting of {os.path.basename(self.source)}"
@@ -48,7 +54,7 @@ class Format:
             LidarConfigFormat.validate(self.config)
     
     @with_logging
-    def process_scan(self, save_file=True, save_path=None, replace=True,make_figures=True,save_figures=True):
+    def process_scan(self, save_file=True, save_path=None, replace=True,make_figures=True,save_figures=True,chunk_size=None):
         
         '''
         Format the raw scan file into WDH-compatible netCDF file
@@ -65,55 +71,95 @@ class Format:
             data. Creates the necessary intermediate directories
         replace: bool
             Whether or not to replace processed scan if one already exists
+        chunk_size: int
+            Number of rays parsed and appended to the output file at once (Halo only, requires save_file).
+            Optional, defaults to None (whole file loaded in memory)
         
         '''
         
-        #rename raw file
-        if self.config.model=='halo':
-            source00=self.rename_halo_xr(self.source,self.config.site,self.config.z_id,save_path,replace)
-        elif self.config.model=='windcube':
-            source00=self.rename_windcube_200s(self.source,self.config.site,self.config.z_id,save_path,replace)
-        else:
-            self.logger.log(f"Lidar model {self.config.model} not supported")
+        #compose filename (before renaming, so that existing outputs are skipped without touching the raw file)
+        save_filename=self.output_filename(save_path)
+        if save_filename is None:
             return
-            
-        #format renamed raw file
-        save_filename = ('.'+self.config.data_level_out+'.').join(source00.split('.00.')).replace('.hpl','.nc')
-        if save_path is not None:
-            save_filename=os.path.join(save_path.replace('.00','.'+self.config.data_level_out),os.path.basename(save_filename))
-        
-        os.makedirs(os.path.dirname(save_filename),exist_ok=True)
-        
         self.save_filename=save_filename
         
-        if save_file and not replace and os.path.isfile(save_filename):
+        if save_file and not replace and output_exists(save_filename,self.config.output_format,self.config.zarr_grouping):
             self.logger.log(f'Processed file {save_filename} already exists, skipping it')
             return
         else:
             self.logger.log(f'Generating formatted file {os.path.basename(save_filename)}')
             
+            #rename raw file
             if self.config.model=='halo':
-                outputData=self.read_halo_xr(source00)
+                source00=self.rename_halo_xr(self.source,self.config.site,self.config.z_id,save_path,replace)
+            else:
+                source00=self.rename_windcube_200s(self.source,self.config.site,self.config.z_id,save_path,replace)
+            
+            # file to parse (the raw file itself if renamed virtually)
+            source_read = self.source if self.config.rename_mode=='virtual' else source00
+            
+            if chunk_size is not None and self.config.output_format=='zarr':
+                self.logger.log('chunk_size is not supported with Zarr output, loading the whole file')
+            elif chunk_size is not None and save_file and self.config.model=='halo':
+                if self.stream_halo_xr(source_read,save_filename,chunk_size,name=source00):
+                    self.logger.log(f'Formatted file saved as {save_filename}')
+                    if make_figures:
+                        with xr.open_dataset(save_filename) as outputData:
+                            self.plot_raw_data(outputData,save_figures)
+                    return
+                self.logger.log('Loading the whole file to sort the rays by time')
+            
+            if self.config.model=='halo':
+                outputData=self.read_halo_xr(source_read,name=source00)
             elif self.config.model=='windcube':
-                outputData=self.read_windcube_200s(source00)
+                outputData=self.read_windcube_200s(source_read)
             else:
                 self.logger.log(f"Lidar model {self.config.model} not supported")
                 return
                 
-            if save_file:
-                outputData.to_netcdf(save_filename)
+            if save_file and self.config.output_format=='zarr':
+                store=zarr_store_name(save_filename,self.config.zarr_grouping)
+                encoding=get_encoding(outputData, self.config.encoding_profile, engine='zarr')
+                if append_to_zarr(outputData,store,'time',save_filename,encoding):
+                    self.logger.log(f'Formatted data appended to {store}')
+                else:
+                    self.logger.log(f'{os.path.basename(save_filename)} already in {store}, skipping it')
+            elif save_file:
+                outputData.to_netcdf(save_filename, encoding=get_encoding(outputData, self.config.encoding_profile))
                 self.logger.log(f'Formatted file saved as {save_filename}')
                 
             if make_figures:
                 self.plot_raw_data(outputData,save_figures)
         
-    @with_logging
-    def rename_halo_xr(self,source,site,z_id,save_path=None,replace=False):
-                
-        if save_path is None:
-            save_path=os.path.dirname(source)
-        os.makedirs(save_path,exist_ok=True)
+    def output_filename(self,save_path=None):
+        '''
+        Name of the formatted file, analogous to the 00-level name of the raw file with the output data level, in
+        save_path (with 00 replaced by the output data level) if given. Creates the necessary intermediate directories
+        '''
+        if self.config.model=='halo':
+            source00=self.halo_filename(self.source,self.config.site,self.config.z_id)
+            if source00 is None:
+                return
+        elif self.config.model=='windcube':
+            source00=self.source
+        else:
+            self.logger.log(f"Lidar model {self.config.model} not supported")
+            return
+            
+        save_filename = ('.'+self.config.data_level_out+'.').join(source00.split('.00.')).replace('.hpl','.nc')
+        if save_path is not None:
+            save_filename=os.path.join(save_path.replace('.00','.'+self.config.data_level_out),os.path.basename(save_filename))
+        elif self.config.model=='halo':
+            save_filename=os.path.join(os.path.dirname(self.source),save_filename)
         
+        os.makedirs(os.path.dirname(save_filename),exist_ok=True)
+        
+        return save_filename
+    
+    def halo_filename(self,source,site,z_id):
+        '''
+        00-level name of a raw Halo file (the header is read only for stare files named by hour)
+        '''
         if 'Stare' in os.path.basename(source):
             pattern = r"Stare_\d+_(\d{8})_(\d{2})\.hpl"
             scan_type='stare'
@@ -131,20 +177,29 @@ class Format:
                 lines = []
                 for line_num in range(11):
                     lines.append(f.readline())
-                metadata={}
-                for line in lines:
-                    metaline = line.split(":")
-                    if "Start time" in metaline:
-                        metadata["Start time"] = metaline[1:]
-                    else:
-                        metadata[metaline[0]] = metaline[1]  # type: ignore
+                metadata = _parse_halo_metadata(lines)
                 time_part = match.group(2)+metadata["Start time"] [1]+metadata["Start time"] [2].split('.')[0]
         else:
             time_part = match.group(2)
             
-        save_filename=site+'.lidar.'+z_id+'.'+'00'+'.'+date_part+'.'+time_part+'.'+scan_type+os.path.splitext(source)[1]
-        if os.path.exists(os.path.join(save_path,save_filename))==False or replace==True:
-            shutil.copyfile(source, os.path.join(save_path,save_filename))
+        return site+'.lidar.'+z_id+'.'+'00'+'.'+date_part+'.'+time_part+'.'+scan_type+os.path.splitext(source)[1]
+    
+    @with_logging
+    def rename_halo_xr(self,source,site,z_id,save_path=None,replace=False):
+                
+        if save_path is None:
+            save_path=os.path.dirname(source)
+        os.makedirs(save_path,exist_ok=True)
+        
+        save_filename=self.halo_filename(source,site,z_id)
+        if save_filename is None:
+            return
+        if self.config.rename_mode=='virtual':
+            self.logger.log(f"Reading {os.path.basename(source)} as {save_filename}")
+        elif os.path.exists(os.path.join(save_path,save_filename))==False or replace==True:
+            rename_mode=_link_file(source, os.path.join(save_path,save_filename), self.config.rename_mode)
+            if rename_mode!=self.config.rename_mode:
+                self.logger.log(f"{self.config.rename_mode} of {os.path.basename(source)} not supported, using {rename_mode}")
 
         return os.path.join(os.path.join(save_path,save_filename))
     
@@ -153,7 +208,7 @@ class Format:
         return source
     
     @with_logging
-    def read_halo_xr(self,source,overlapping_distance=1.5):
+    def read_halo_xr(self,source,overlapping_distance=1.5,time_range=None,beams=None,ang_tol=0.25,name=None):
         
         '''
         Format raw Halo XR data file into WDH-compatible netCDF
@@ -165,84 +220,243 @@ class Format:
             overlapping_distance: float
                 distance between gates in overlapping mode in meters
                 
+            time_range: tuple
+                (start, end) times of the rays to read (inclusive). Optional, uses the sidecar ray index
+                
+            beams: list
+                (azimuth, elevation) pairs of the rays to read. Optional, uses the sidecar ray index
+                
+            ang_tol: float
+                angular tolerance in degrees to match the beams
+                
+            name: str
+                00-level file name reported in the formatted data. Optional, defaults to source
+                
         Outputs:
             outputData: netDFC
                 formatted data structure
         '''
         
-        with open(source, "r") as f:
-            lines = []
-            for line_num in range(11):
-                lines.append(f.readline())
-    
-            # read metadata into strings
-            metadata = {}
-            for line in lines:
-                metaline = line.split(":")
-                if "Start time" in metaline:
-                    metadata["Start time"] = metaline[1:]
-                else:
-                    metadata[metaline[0]] = metaline[1]  # type: ignore
+        if time_range is not None or beams is not None:
+            return self.read_halo_rays_xr(source,overlapping_distance,time_range,beams,ang_tol,name)
+        
+        # parsed arrays are cached separately for each precision
+        dtype = self.config.precision
+        kind = "halo" if dtype == "float64" else f"halo_{dtype}"
+        cached = self.cache.load(source, kind) if self.cache is not None else None
+        if cached is not None:
+            self.logger.log(f"Loading parsed {os.path.basename(source)} from cache")
+            arrays, metadata = cached
+            ray_info, doppler, intensity, beta = arrays["ray_info"], arrays["doppler"], arrays["intensity"], arrays["beta"]
+        else:
+            with open(source, "rb") as f:
+                metadata = _read_halo_header(f)
     
-            # convert some metadata
-            num_gates = int(metadata["Number of gates"])  # type: ignore
+                # convert some metadata
+                num_gates = int(metadata["Number of gates"])  # type: ignore
     
-            # Read some of the label lines
-            for line_num in range(6):
-                f.readline()
-    
-            # initialize arrays
-            time = []
-            azimuth = []
-            elevation = []
-            pitch = []
-            roll = []
-            doppler = []
-            intensity = []
-            beta = []
-    
-            while True:
-                a = f.readline().split()
-                if not len(a):  # is empty
-                    break
-    
-                time.append(float(a[0]))
-                azimuth.append(float(a[1]))
-                elevation.append(float(a[2]))
-                pitch.append(float(a[3]))
-                roll.append(float(a[4]))
-    
-                doppler.append([0] * num_gates)
-                intensity.append([0] * num_gates)
-                beta.append([0] * num_gates)
-    
-                for _ in range(num_gates):
-                    b = f.readline().split()
-                    range_gate = int(b[0])
-                    doppler[-1:][0][range_gate] = float(b[1])
-                    intensity[-1:][0][range_gate] = float(b[2])
-                    beta[-1:][0][range_gate] = float(b[3])
+                # preallocate arrays (each ray is one header line plus one line per gate)
+                n_rays = _count_lines(f) // (num_gates + 1)
+                ray_info = np.zeros((n_rays, 5))
+                doppler = np.zeros((n_rays, num_gates), dtype=dtype)
+                intensity = np.zeros((n_rays, num_gates), dtype=dtype)
+                beta = np.zeros((n_rays, num_gates), dtype=dtype)
     
-        # convert date to np.datetime64
-        start_time_string = "{}-{}-{}T{}:{}:{}".format(
-            metadata["Start time"][0][1:5],  # year
-            metadata["Start time"][0][5:7],  # month
-            metadata["Start time"][0][7:9],  # day
-            "00",  # hour
-            "00",  # minute
-            "00.00",  # second
-        )
+                # block-wise parsing of rays
+                i_ray = 0
+                for info, gates in _halo_ray_blocks(f, num_gates):
+                    n = min(len(info), n_rays - i_ray)
+                    ray_info[i_ray : i_ray + n] = info[:n]
+                    (
+                        doppler[i_ray : i_ray + n],
+                        intensity[i_ray : i_ray + n],
+                        beta[i_ray : i_ray + n],
+                    ) = _scatter_gates(gates[:n], num_gates, dtype)
+                    i_ray += n
+    
+                if i_ray < n_rays:
+                    self.logger.log(f"Incomplete rays at the end of {os.path.basename(source)}, reading {i_ray} rays")
     
+            # find times where it wraps from 24 -> 0, add 24 to all indices after
+            time = ray_info[:i_ray, 0]
+            ray_info[:i_ray, 0] = time + 24.0 * np.append(0, np.cumsum(np.diff(time) < -23))
+            ray_info, doppler, intensity, beta = ray_info[:i_ray], doppler[:i_ray], intensity[:i_ray], beta[:i_ray]
+            if self.cache is not None:
+                self.cache.save(
+                    source, kind, {"ray_info": ray_info, "doppler": doppler, "intensity": intensity, "beta": beta}, metadata
+                )
+    
+        outputData = self._build_halo_xr(name or source, metadata, ray_info, doppler, intensity, beta, overlapping_distance)
+            
+        #sort data
+        outputData=outputData.sortby('time')
+        return outputData
+    
+    @with_logging
+    def read_halo_rays_xr(self,source,overlapping_distance=1.5,time_range=None,beams=None,ang_tol=0.25,name=None):
+        
+        '''
+        Format a subset of the rays of a raw Halo XR data file, seeking to them through the sidecar ray index
+        
+        Inputs:
+            source: str
+                source of the 00-level file
+            overlapping_distance: float
+                distance between gates in overlapping mode in meters
+            time_range: tuple
+                (start, end) times of the rays to read (inclusive)
+            beams: list
+                (azimuth, elevation) pairs of the rays to read
+            ang_tol: float
+                angular tolerance in degrees to match the beams
+            name: str
+                00-level file name reported in the formatted data. Optional, defaults to source
+                
+        Outputs:
+            outputData: netDFC
+                formatted data structure
+        '''
+        
+        index = index_halo(source)
+        num_gates = int(index["num_gates"])
+        
         # find times where it wraps from 24 -> 0, add 24 to all indices after
-        time=np.array(time)
-        new_day_indices = np.where(np.diff(time) < -23)
-        for new_day_index in new_day_indices[0]:
-            time[new_day_index + 1 :] += 24.0
+        time = index["time"] + 24.0 * np.append(0, np.cumsum(np.diff(index["time"]) < -23))
+        
+        # select rays
+        sel = np.ones(len(time), dtype=bool)
+        if time_range is not None:
+            start_time = _halo_start_time(_parse_halo_metadata(str(index["header"]).splitlines(True)[:11]))
+            datetimes = start_time + (3600 * 1e9 * time).astype(np.int64).astype("timedelta64[ns]")
+            sel &= (datetimes >= np.datetime64(time_range[0])) & (datetimes <= np.datetime64(time_range[1]))
+        if beams is not None:
+            sel_beams = np.zeros(len(time), dtype=bool)
+            for a, e in beams:
+                sel_beams |= ((index["azimuth"] - a + 180) % 360 - 180) ** 2 + (index["elevation"] - e) ** 2 <= ang_tol**2
+            sel &= sel_beams
+        rays = np.flatnonzero(sel)
+        self.logger.log(f"Reading {len(rays)} of {len(time)} rays of {os.path.basename(source)}")
+        
+        dtype = self.config.precision
+        ray_info = np.zeros((len(rays), 5))
+        doppler = np.zeros((len(rays), num_gates), dtype=dtype)
+        intensity = np.zeros((len(rays), num_gates), dtype=dtype)
+        beta = np.zeros((len(rays), num_gates), dtype=dtype)
+        with open(source, "rb") as f:
+            metadata = _read_halo_header(f)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                i_ray = 0
+                for info, gates in _indexed_ray_blocks(mm, index["offset"], rays, num_gates):
+                    n = len(info)
+                    ray_info[i_ray : i_ray + n] = info
+                    (
+                        doppler[i_ray : i_ray + n],
+                        intensity[i_ray : i_ray + n],
+                        beta[i_ray : i_ray + n],
+                    ) = _scatter_gates(gates, num_gates, dtype)
+                    i_ray += n
+        ray_info[:, 0] = time[rays]
+        
+        outputData = self._build_halo_xr(name or source, metadata, ray_info, doppler, intensity, beta, overlapping_distance)
+        
+        #sort data
+        outputData=outputData.sortby('time')
+        return outputData
     
-        start_time = np.datetime64(start_time_string)
-        datetimes = [
-            start_time + np.timedelta64(int(3600 * 1e9 * dtime), "ns") for dtime in time
-        ]
+    @with_logging
+    def stream_halo_xr(self,source,save_filename,chunk_size=10000,overlapping_distance=1.5,name=None):
+        
+        '''
+        Format raw Halo XR data file into WDH-compatible netCDF by streaming chunks of rays to disk.
+        Peak memory depends on the chunk size and not on the file length.
+        
+        Inputs:
+            source: str
+                source of the 00-level file
+            save_filename: str
+                destination netCDF file, with unlimited time dimension
+            chunk_size: int
+                number of rays parsed and written at once
+            overlapping_distance: float
+                distance between gates in overlapping mode in meters
+            name: str
+                00-level file name reported in the formatted data. Optional, defaults to source
+                
+        Outputs:
+            sorted: bool
+                whether the rays are in time order. Streaming stops at the first ray out of order, since the
+                appended file cannot be sorted by time as in read_halo_xr, and the file must be formatted in memory
+        '''
+        
+        with open(source, "rb") as f:
+            metadata = _read_halo_header(f)
+            num_gates = int(metadata["Number of gates"])  # type: ignore
+            start_time = _halo_start_time(metadata)
+            n_total = max(1, int(metadata.get("No. of rays in file", chunk_size)))
+            
+            n_rays = 0
+            n_wraps = 0
+            last_time = None
+            last_unwrapped = -np.inf
+            nc = None
+            try:
+                for info, gates in _halo_ray_blocks(f, num_gates, rays_per_block=chunk_size):
+                    doppler, intensity, beta = _scatter_gates(gates, num_gates, self.config.precision)
+                    
+                    # find times where it wraps from 24 -> 0, including the previous chunk
+                    time = info[:, 0]
+                    if last_time is None:
+                        last_time = time[0]
+                    wraps = n_wraps + np.cumsum(np.diff(np.append(last_time, time)) < -23)
+                    last_time = time[-1]
+                    n_wraps = wraps[-1]
+                    info[:, 0] = time + 24.0 * wraps
+                    
+                    # rays out of order within the chunk or with respect to the previous one
+                    if np.any(np.diff(np.append(last_unwrapped, info[:, 0])) < 0):
+                        self.logger.log(f"Rays of {os.path.basename(source)} are not in time order, stopped streaming after {n_rays} rays")
+                        return False
+                    last_unwrapped = info[-1, 0]
+                    
+                    chunk = self._build_halo_xr(name or source, metadata, info, doppler, intensity, beta, overlapping_distance)
+                    
+                    if nc is None:
+                        # chunks of the whole file as in the in-memory path (the netCDF default of the unlimited
+                        # dimension is one ray per chunk), or chunk_size rays where the profile does not chunk
+                        encoding = get_encoding(chunk, self.config.encoding_profile, sizes={"time": n_total})
+                        encoding["time"] = {"units": f"nanoseconds since {start_time}", "dtype": "int64"}
+                        for v in list(chunk.data_vars) + ["time"]:
+                            if "time" in chunk[v].dims and "chunksizes" not in encoding.get(v, {}):
+                                encoding.setdefault(v, {})["chunksizes"] = tuple(
+                                    min(chunk_size, n_total) if d == "time" else size for d, size in zip(chunk[v].dims, chunk[v].shape)
+                                )
+                        chunk.to_netcdf(save_filename, unlimited_dims=["time"], encoding=encoding)
+                        nc = netCDF4.Dataset(save_filename, "a")
+                    else:
+                        i = nc.dimensions["time"].size
+                        nc.variables["time"][i:] = (chunk.time.values - start_time) // np.timedelta64(1, "ns")
+                        for v in chunk.data_vars:
+                            if "time" in chunk[v].dims:
+                                nc.variables[v][i:] = chunk[v].values
+                    n_rays += len(info)
+            finally:
+                if nc is not None:
+                    nc.close()
+                    
+        self.logger.log(f"Streamed {n_rays} rays in chunks of {chunk_size}")
+        return True
+    
+    def _build_halo_xr(self,source,metadata,ray_info,doppler,intensity,beta,overlapping_distance=1.5):
+        '''
+        Build the formatted dataset from parsed Halo rays (time already unwrapped, in decimal hours).
+        The source name is only used for metadata.
+        '''
+        num_gates = int(metadata["Number of gates"])  # type: ignore
+        time, azimuth, elevation, pitch, roll = ray_info.T
+        
+        # convert date to np.datetime64
+        start_time = _halo_start_time(metadata)
+        datetimes = start_time + (3600 * 1e9 * time).astype(np.int64).astype("timedelta64[ns]")
     
         outputData = xr.Dataset(
             {
@@ -255,7 +469,7 @@ class Format:
                 "intensity": (("time", "range_gate"), intensity),
                 "beta": (("time", "range_gate"), beta),
             },
-            coords={"time": np.array(datetimes), "range_gate": np.arange(num_gates)},
+            coords={"time": datetimes, "range_gate": np.arange(num_gates)},
             attrs={"Range gate length (m)": float(metadata["Range gate length (m)"])},  # type: ignore
         )
     
@@ -285,7 +499,7 @@ class Format:
         )
         intensity = outputData.intensity.data.copy()
         intensity[intensity <= 1] = np.nan
-        outputData['SNR']=xr.DataArray(data=10 * np.log10(intensity - 1),coords={"time": np.array(datetimes), "range_gate": np.arange(num_gates)})
+        outputData['SNR']=xr.DataArray(data=10 * np.log10(intensity - 1),coords={"time": datetimes, "range_gate": np.arange(num_gates)})
     
         # Dynamically add scan type and z-id (z02, z03, etc) to outputData metadata
         # loc_id, instrument, z02/z03, data '00', date, time, scan type, extension
@@ -312,21 +526,50 @@ class Format:
     
         outputData.attrs["scan_type"] = scan_type
         outputData.attrs["z_id"] = z_id
-            
-        #sort data
-        outputData=outputData.sortby('time')
         return outputData
     
     @with_logging
     def read_windcube_200s(self, source):
+        
+        '''
+        Format raw WindCube 200S data file. The file is opened once, all the sweep groups are opened
+        lazily on it and concatenated along time, and the result is loaded once before the file is closed
+        (concatenating backend arrays loads them anyway, since dask is not used).
+        
+        Inputs:
+            source: str
+                source of the 00-level file
+                
+        Outputs:
+            outputData: netDFC
+                formatted data structure
+        '''
        
         #load data
-        temp = xr.load_dataset(source)
-        group_name = temp["sweep_group_name"].data[0]
-        outputData = xr.load_dataset(source, group=group_name, decode_times=False)
+        cached = self.cache.load(source, "windcube") if self.cache is not None else None
+        if cached is not None:
+            self.logger.log(f"Loading parsed {os.path.basename(source)} from cache")
+            outputData = arrays_to_dataset(*cached)
+        else:
+            with netCDF4.Dataset(source) as nc:
+                group_names = nc.variables["sweep_group_name"][:]
+                sweeps = [
+                    xr.open_dataset(xr.backends.NetCDF4DataStore(nc.groups[g]), decode_times=False)
+                    for g in group_names
+                ]
+                _check_sweeps(sweeps, group_names)
+                # single eager load, the sweeps are read from the open file handle
+                outputData = xr.concat(
+                    sweeps, dim="time", data_vars="minimal", coords="minimal", compat="override"
+                ).load()
+            self.logger.log(f"Read {len(group_names)} sweep groups")
+            if self.cache is not None:
+                self.cache.save(source, "windcube", *dataset_to_arrays(outputData))
 
-        #format time
-        outputData = outputData.assign_coords(time=np.array([datetime.utcfromtimestamp(t) for t in outputData.time.data]))
+        #format time (Unix seconds to microseconds, rounded as in datetime.utcfromtimestamp)
+        seconds = np.floor(outputData.time.data)
+        microseconds = seconds.astype(np.int64) * 10**6 + np.round((outputData.time.data - seconds) * 10**6).astype(np.int64)
+        outputData = outputData.assign_coords(time=microseconds.astype("datetime64[us]"))
 
         #rename variables
         outputData=outputData.rename({'radial_wind_speed':'wind_speed','cnr':'SNR','gate_index':'range_gate'})
@@ -367,7 +610,7 @@ class Format:
                 if e in outputData[var].encoding:
                     del outputData[var].encoding[e]
 
-        return outputData
+        return set_precision(outputData, self.config.precision)
 
     def plot_raw_data(self,data,save_figures=True):
         
@@ -424,4 +667,389 @@ class Format:
 
 
     
-    
\ No newline at end of file
+    
+
+
+def _check_sweeps(sweeps, group_names):
+    '''
+    Check that the sweeps of a WindCube file share range and the other variables not depending on time, which are
+    taken from the first sweep when the sweeps are concatenated along time
+    
+    Inputs:
+        sweeps: list
+            datasets of the sweep groups
+        group_names: list
+            names of the sweep groups
+    '''
+    names = {v for v in sweeps[0].variables if "time" not in sweeps[0][v].dims}
+    for sweep, group_name in zip(sweeps[1:], group_names[1:]):
+        sweep_names = {v for v in sweep.variables if "time" not in sweep[v].dims}
+        if sweep_names != names:
+            raise ValueError(
+                f"Sweep {group_name} has different static variables than sweep {group_names[0]}: "
+                + ", ".join(sorted(sweep_names ^ names))
+            )
+        for v in sorted(names):
+            if not sweep[v].equals(sweeps[0][v]):
+                raise ValueError(f"Variable {v} of sweep {group_name} differs from sweep {group_names[0]}, sweeps cannot be concatenated")
+
+
+def _link_file(source, target, mode="copy"):
+    '''
+    Create target from source as a hard link, symbolic link or copy. Links fall back to a copy
+    where not supported (e.g. across file systems). Returns the mode actually used.
+    '''
+    if os.path.lexists(target):
+        if mode == "hardlink" and not os.path.islink(target) and os.path.samefile(source, target):
+            return mode
+        os.remove(target)
+        
+    if mode == "hardlink":
+        try:
+            os.link(source, target)
+            return mode
+        except OSError:
+            pass
+    elif mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(source), target)
+            return mode
+        except OSError:
+            pass
+        
+    shutil.copy2(source, target)
+    return "copy"
+
+
+def _parse_halo_metadata(lines):
+    '''
+    Parse the header lines of a Halo .hpl file into a dictionary of strings
+    '''
+    metadata = {}
+    for line in lines:
+        metaline = line.split(":")
+        if "Start time" in metaline:
+            metadata["Start time"] = metaline[1:]
+        else:
+            metadata[metaline[0]] = metaline[1]  # type: ignore
+    return metadata
+
+
+def _read_halo_header(f):
+    '''
+    Read the metadata of a Halo .hpl file opened in binary mode, leaving it positioned at the first ray
+    '''
+    lines = []
+    for line_num in range(11):
+        lines.append(f.readline().decode().replace("\r\n", "\n"))
+    metadata = _parse_halo_metadata(lines)
+    
+    # skip the label lines
+    for line_num in range(6):
+        f.readline()
+    return metadata
+
+
+def _halo_start_time(metadata):
+    '''
+    Midnight of the acquisition day of a Halo .hpl file as np.datetime64
+    '''
+    start_time_string = "{}-{}-{}T{}:{}:{}".format(
+        metadata["Start time"][0][1:5],  # year
+        metadata["Start time"][0][5:7],  # month
+        metadata["Start time"][0][7:9],  # day
+        "00",  # hour
+        "00",  # minute
+        "00.00",  # second
+    )
+    return np.datetime64(start_time_string)
+
+
+def _scatter_gates(gates, num_gates, dtype="float64"):
+    '''
+    Place doppler, intensity and beta of a block of rays into (n_rays, num_gates) arrays of the given dtype by range gate index
+    '''
+    n = len(gates)
+    doppler = np.zeros((n, num_gates), dtype=dtype)
+    intensity = np.zeros((n, num_gates), dtype=dtype)
+    beta = np.zeros((n, num_gates), dtype=dtype)
+    rows = np.arange(n)[:, None]
+    range_gate = gates[:, :, 0].astype(int)
+    doppler[rows, range_gate] = gates[:, :, 1]
+    intensity[rows, range_gate] = gates[:, :, 2]
+    beta[rows, range_gate] = gates[:, :, 3]
+    return doppler, intensity, beta
+
+
+def _count_lines(f, chunk_size=2**24):
+    '''
+    Count the remaining lines of a binary file object without moving its position
+    '''
+    position = f.tell()
+    n_lines = 0
+    last = b"\n"
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        n_lines += chunk.count(b"\n")
+        last = chunk[-1:]
+    if last != b"\n":
+        n_lines += 1
+    f.seek(position)
+    return n_lines
+
+
+def _parse_rays(data, num_gates):
+    '''
+    Parse a buffer of complete Halo rays into numeric arrays. The number of fields of the ray and gate lines is
+    taken from the first ray, so that additional fields written by some firmware versions are skipped. Buffers
+    whose lines do not all have these numbers of fields are parsed line by line.
+    
+    Inputs:
+        data: bytes
+            text of one or more rays
+        num_gates: int
+            number of range gates per ray
+    
+    Outputs:
+        info: array of floats
+            (n_rays, 5) decimal time, azimuth, elevation, pitch and roll
+        gates: array of floats
+            (n_rays, num_gates, 4) range gate, doppler, intensity and beta
+        complete: bool
+            whether the buffer only contained complete rays
+    '''
+    lines_per_ray = num_gates + 1
+    data = data.rstrip()
+    n_lines = data.count(b"\n") + 1 if len(data) > 0 else 0
+    n = n_lines // lines_per_ray
+    complete = n * lines_per_ray == n_lines
+    if n == 0:
+        return np.zeros((0, 5)), np.zeros((0, num_gates, 4)), complete
+    if not complete:
+        data = b"\n".join(data.split(b"\n", n * lines_per_ray)[:-1])
+    
+    # fields of the ray and gate lines
+    first = data.split(b"\n", 2)
+    n_info = len(first[0].split())
+    n_gate = len(first[1].split())
+    ray_size = n_info + n_gate * num_gates
+    
+    values = np.fromstring(data, sep=" ")
+    if n_info >= 5 and n_gate >= 4 and len(values) == n * ray_size:
+        values = values.reshape(n, ray_size)
+        return values[:, :5], values[:, n_info:].reshape(n, num_gates, n_gate)[:, :, :4], complete
+    
+    info, gates = _parse_ray_lines(data.split(b"\n"), num_gates)
+    return info, gates, complete
+
+
+def _parse_ray_lines(lines, num_gates):
+    '''
+    Parse complete Halo rays line by line, keeping the first 5 fields of the ray lines and the first 4 fields of the
+    gate lines (see _parse_rays)
+    '''
+    lines_per_ray = num_gates + 1
+    n = len(lines) // lines_per_ray
+    info = np.zeros((n, 5))
+    gates = np.zeros((n, num_gates, 4))
+    for i in range(n):
+        info[i] = lines[i * lines_per_ray].split()[:5]
+        for j in range(num_gates):
+            gates[i, j] = lines[i * lines_per_ray + 1 + j].split()[:4]
+    return info, gates
+
+
+def _halo_ray_blocks(f, num_gates, rays_per_block=1000):
+    '''
+    Parse the rays of a Halo .hpl file in blocks of numeric arrays
+    
+    Inputs:
+        f: file object
+            binary file object positioned at the first ray
+        num_gates: int
+            number of range gates per ray
+        rays_per_block: int
+            number of rays parsed at once
+    
+    Outputs (yielded per block):
+        info: array of floats
+            (n_rays, 5) decimal time, azimuth, elevation, pitch and roll
+        gates: array of floats
+            (n_rays, num_gates, 4) range gate, doppler, intensity and beta
+    '''
+    lines_per_block = rays_per_block * (num_gates + 1)
+    while True:
+        lines = list(itertools.islice(f, lines_per_block))
+        if not lines:
+            break
+        info, gates, complete = _parse_rays(b"".join(lines), num_gates)
+        if len(info) > 0:
+            yield info, gates
+        if not complete or len(lines) < lines_per_block:
+            # incomplete ray or end of file
+            break
+
+
+def _indexed_ray_blocks(mm, offset, rays, num_gates, rays_per_block=1000):
+    '''
+    Parse selected rays of a memory-mapped Halo .hpl file in blocks, reading contiguous rays with a single slice
+    
+    Inputs:
+        mm: mmap
+            memory map of the .hpl file
+        offset: array of ints
+            byte offsets of the ray headers, followed by the end of the last complete ray
+        rays: array of ints
+            sorted indices of the rays to read
+        num_gates: int
+            number of range gates per ray
+        rays_per_block: int
+            number of rays parsed at once
+    
+    Outputs (yielded per block):
+        info, gates: see _parse_rays
+    '''
+    for i in range(0, len(rays), rays_per_block):
+        sel = rays[i : i + rays_per_block]
+        breaks = np.flatnonzero(np.diff(sel) != 1) + 1
+        run_start = sel[np.append(0, breaks)]
+        run_end = sel[np.append(breaks - 1, len(sel) - 1)] + 1
+        data = b"".join(mm[offset[a] : offset[b]] for a, b in zip(run_start, run_end))
+        info, gates, complete = _parse_rays(data, num_gates)
+        yield info, gates
+
+
+def index_halo(source, save=True, chunk_size=2**24):
+    '''
+    Build, or load if up to date, the sidecar index of the rays of a Halo .hpl file.
+    The index is saved as <source>.idx.npz and is invalidated when the size or modification time of the file change,
+    or when it was built with a different number of header lines or different ray header fields (as halo_suite
+    can be configured to do).
+    
+    Inputs:
+        source: str
+            source of the .hpl file
+        save: bool
+            whether to save the index next to the file
+        chunk_size: int
+            number of bytes scanned at once when building the index
+    
+    Outputs:
+        index: dict
+            size, mtime, header lines and num_gates of the file, number of header lines and indices of the ray
+            header fields of the index, byte offset of each ray header (followed by the end of the last complete ray),
+            decimal time, azimuth and elevation of each ray
+    '''
+    header_lines = 17
+    fields = np.array([0, 1, 2])
+    index = load_halo_index(source, header_lines, fields)
+    if index is not None:
+        return index
+    
+    with open(source, "rb") as f:
+        lines = []
+        for line_num in range(header_lines):
+            lines.append(f.readline().decode().replace("\r\n", "\n"))
+        num_gates = int(_parse_halo_metadata(lines[:11])["Number of gates"])
+        offset, info = scan_halo_rays(f, num_gates, fields, chunk_size)
+    
+    return save_halo_index(source, "".join(lines), num_gates, header_lines, fields, offset, info, save)
+
+
+def load_halo_index(source, header_lines, fields):
+    '''
+    Load the sidecar index of a Halo .hpl file (see index_halo), or None if missing, out of date, or built with a
+    different number of header lines or ray header fields
+    '''
+    index_file = source + ".idx.npz"
+    if not os.path.isfile(index_file):
+        return None
+    stat = os.stat(source)
+    with np.load(index_file) as data:
+        index = {k: data[k] for k in data.files}
+    if (
+        index["size"] == stat.st_size
+        and index["mtime"] == stat.st_mtime_ns
+        and index.get("header_lines", -1) == header_lines
+        and np.array_equal(index.get("fields", []), fields)
+    ):
+        return index
+    return None
+
+
+def save_halo_index(source, header, num_gates, header_lines, fields, offset, info, save=True):
+    '''
+    Compose, and save next to the file if save, the sidecar index of a Halo .hpl file (see index_halo)
+    '''
+    stat = os.stat(source)
+    index = {
+        "size": np.int64(stat.st_size),
+        "mtime": np.int64(stat.st_mtime_ns),
+        "header": np.array(header),
+        "num_gates": np.int64(num_gates),
+        "header_lines": np.int64(header_lines),
+        "fields": np.array(fields, dtype=np.int64),
+        "offset": offset.astype(np.int64),
+        "time": info[:, 0],
+        "azimuth": info[:, 1],
+        "elevation": info[:, 2],
+    }
+    if save:
+        try:
+            np.savez(source + ".idx.npz", **index)
+        except OSError:
+            pass
+    return index
+
+
+def scan_halo_rays(f, num_gates, fields=(0, 1, 2), chunk_size=2**24):
+    '''
+    Find the byte offsets of the rays of a Halo .hpl file by scanning it for line breaks, and parse the
+    requested fields of the ray headers, without parsing the gates
+    
+    Inputs:
+        f: file object
+            binary file object positioned at the first ray
+        num_gates: int
+            number of range gates per ray
+        fields: list
+            indices of the fields of the ray headers to parse
+        chunk_size: int
+            number of bytes scanned at once
+    
+    Outputs:
+        offset: array of ints
+            byte offset of each complete ray, followed by the end of the last complete ray
+        info: array of floats
+            (n_rays, len(fields)) fields of the ray headers
+    '''
+    lines_per_ray = num_gates + 1
+    first = f.tell()
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # start offset of every (num_gates + 1)-th line
+        size = len(mm)
+        starts = [np.array([first])]
+        n_lines = 1
+        for pos in range(first, size, chunk_size):
+            buffer = np.frombuffer(mm, dtype=np.uint8, count=min(chunk_size, size - pos), offset=pos)
+            line_start = np.flatnonzero(buffer == 10) + pos + 1
+            del buffer
+            line_number = np.arange(n_lines, n_lines + len(line_start))
+            starts.append(line_start[line_number % lines_per_ray == 0])
+            n_lines += len(line_start)
+        if mm[size - 1 : size] == b"\n":
+            n_lines -= 1
+        starts = np.concatenate(starts)
+        
+        # keep complete rays only
+        n_rays = n_lines // lines_per_ray
+        offset = np.append(starts[:n_rays], starts[n_rays] if len(starts) > n_rays else size)
+        
+        # ray headers
+        fields = list(fields)
+        headers = [mm[o : mm.find(b"\n", o)] for o in offset[:-1]]
+        info = np.fromstring(b"\n".join(headers), sep=" ")
+        if n_rays > 0 and len(info) == n_rays * len(headers[0].split()):
+            info = info.reshape(n_rays, -1)[:, fields]
+        else:
+            info = np.array([[h.split()[i] for i in fields] for h in headers], dtype=float).reshape(n_rays, len(fields))
+    return offset, info
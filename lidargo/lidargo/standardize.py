@@ -4,7 +4,9 @@ import numpy as np
 import pandas as pd
 import re
 import json
+from collections import deque
 from scipy.optimize import curve_fit
+from scipy.spatial import cKDTree
 from typing import Union, Optional
 from dataclasses import asdict
 import matplotlib.pyplot as plt
@@ -26,6 +28,8 @@ class Standardize:
         verbose: bool = True,
         logger: Optional[object] = None,
         logfile=None,
+        data: Optional[xr.Dataset] = None,
+        load: bool = True,
     ):
         """
         Initialize the LIDAR data processor with configuration parameters.
@@ -35,6 +39,8 @@ class Standardize:
             config (str, dict, or LidarConfig): Either a path to an Excel config file, a dictionary of configuration parameters, or a LidarConfig object
             verbose (bool, optional): Whether to print QC-related information. Defaults to True.
             logger (Logger, optional): Logger instance for logging messages. Defaults to None.
+            data (xarray.Dataset, optional): Input-level data already in memory, processed instead of reading the source (which is then only used for configuration and naming). Defaults to None.
+            load (bool, optional): Whether to load the input data at initialization. If False, they are loaded by process_scan, after checking whether the output already exists. Defaults to True.
         """
         self.logger = get_logger(verbose=verbose, logger=logger,filename=logfile)
         self.source = source
@@ -51,12 +57,29 @@ class Standardize:
         else:
             LidarConfigStand.validate(self.config)
 
-        # Load input data
+        if load or data is not None:
+            self.load_input(data)
+
+    def load_input(self, data=None):
+        """
+        Load the input data (lazily and without caching in block mode, blocks are read and cast when filtering)
+
+        Outputs:
+        -------
+        bool
+            Whether the input data were loaded
+        """
         try:
-            self.inputData = xr.open_dataset(self.source)
+            if data is not None:
+                self.inputData = utilities.set_precision(data, self.config.precision)
+            elif self.config.block_duration > 0:
+                self.inputData = xr.open_dataset(self.source, cache=False)
+            else:
+                self.inputData = utilities.set_precision(xr.open_dataset(self.source), self.config.precision)
         except Exception as e:
             self.logger.log(f"Error loading input data: {str(e)}")
-            return
+            return False
+        return True
 
     @with_logging
     def check_data(self):
@@ -73,10 +96,11 @@ class Standardize:
             )
             return False
 
-        # Check for valid radial wind speed values
-        if (
-            self.inputData["wind_speed"].isnull().sum()
-            == self.inputData["wind_speed"].size
+        # Check for valid radial wind speed values (one block of times at a time)
+        tnum = utilities.dt64_to_num(self.inputData["time"].values)
+        if not any(
+            self.inputData["wind_speed"].isel(time=times).notnull().any()
+            for times in self.time_blocks(tnum - tnum.min())
         ):
             # All wind speeds are NaNs. Skipping
             self.logger.log(
@@ -154,19 +178,12 @@ class Standardize:
             return
 
         # Compose filename
-        save_filename = (
-            ("." + self.config.data_level_out)
-            .join(self.source.split("." + self.config.data_level_in))
-            .replace(self.source.split(".")[-1], self.config.name + ".nc")
-        )
-        if save_path is not None:
-            save_filename = os.path.join(save_path, os.path.basename(save_filename))
-
-        os.makedirs(os.path.dirname(save_filename),exist_ok=True)
-        
+        save_filename = self.output_filename(save_path)
         self.save_filename = save_filename
 
-        if save_file and not replace and os.path.isfile(save_filename):
+        if save_file and not replace and utilities.output_exists(
+            save_filename, self.config.output_format, self.config.zarr_grouping
+        ):
             self.logger.log(
                 f"Processed file {save_filename} already exists, skipping it"
             )
@@ -176,15 +193,11 @@ class Standardize:
                 f"Generating standardized file {os.path.basename(save_filename)}"
             )
 
-        #rename variables
-        if isinstance(self.config.rename_vars, str):
-            self.inputData=self.inputData.rename(json.loads(self.config.rename_vars))
-            
-        #rename attributes
-        if isinstance(self.config.rename_vars, str):
-            for old_key, new_key in json.loads(self.config.rename_attrs).items():
-                if old_key in self.inputData.attrs:
-                    self.inputData.attrs[new_key] = self.inputData.attrs.pop(old_key)
+        # Load input data, if not loaded at initialization
+        if "inputData" not in dir(self) and not self.load_input():
+            return
+
+        self.rename_input()
             
         # Check data
         if not self.check_data():
@@ -209,8 +222,55 @@ class Standardize:
             self.qc_report(save_figures)
 
         if save_file:
-            self.outputData.to_netcdf(save_filename)
-            self.logger.log(f"Standardized file saved as {save_filename}")
+            self.save_output()
+
+    def output_filename(self, save_path=None):
+        """
+        Name of the output file, analogous to the input replacing input-level with output-level data, in save_path
+        if given. Creates the necessary intermediate directories
+        """
+        save_filename = (
+            ("." + self.config.data_level_out)
+            .join(self.source.split("." + self.config.data_level_in))
+            .replace(self.source.split(".")[-1], self.config.name + ".nc")
+        )
+        if save_path is not None:
+            save_filename = os.path.join(save_path, os.path.basename(save_filename))
+
+        os.makedirs(os.path.dirname(save_filename),exist_ok=True)
+
+        return save_filename
+
+    def rename_input(self):
+        """
+        Rename variables and attributes of the input data as set in the configuration
+        """
+        #rename variables
+        if isinstance(self.config.rename_vars, str):
+            self.inputData=self.inputData.rename(json.loads(self.config.rename_vars))
+            
+        #rename attributes
+        if isinstance(self.config.rename_vars, str):
+            for old_key, new_key in json.loads(self.config.rename_attrs).items():
+                if old_key in self.inputData.attrs:
+                    self.inputData.attrs[new_key] = self.inputData.attrs.pop(old_key)
+
+    def save_output(self):
+        """
+        Save the standardized data as save_filename, or append them to a Zarr store
+        """
+        if self.config.output_format == "zarr":
+            store = utilities.zarr_store_name(self.save_filename, self.config.zarr_grouping)
+            encoding = utilities.get_encoding(self.outputData, self.config.encoding_profile, engine="zarr")
+            if utilities.append_to_zarr(self.outputData, store, "scanID", self.save_filename, encoding):
+                self.logger.log(f"Standardized data appended to {store}")
+            else:
+                self.logger.log(f"{os.path.basename(self.save_filename)} already in {store}, skipping it")
+        else:
+            self.outputData.to_netcdf(
+                self.save_filename, encoding=utilities.get_encoding(self.outputData, self.config.encoding_profile)
+            )
+            self.logger.log(f"Standardized file saved as {self.save_filename}")
 
     @with_logging
     def remove_back_swipe(self):
@@ -224,63 +284,45 @@ class Standardize:
         self.inputData["azimuth"]=np.round(self.inputData["azimuth"]/(self.config.ang_tol/10))*self.config.ang_tol/10%360
         self.inputData["elevation"]=np.round(self.inputData["elevation"]/(self.config.ang_tol/10))*self.config.ang_tol/10
 
-        # Angular difference (forward difference)
-        diff_azi_fw = self.inputData["azimuth"].diff(dim="time", label="lower")
-        diff_azi_fw[diff_azi_fw > 180] = diff_azi_fw[diff_azi_fw > 180] - 360
-        diff_azi_fw[diff_azi_fw < -180] = diff_azi_fw[diff_azi_fw < -180] + 360
+        azimuth = self.inputData["azimuth"].values
+        elevation = self.inputData["elevation"].values
 
-        diff_ele_fw = self.inputData["elevation"].diff(dim="time", label="lower")
-        diff_ele_fw[diff_ele_fw > 180] = diff_ele_fw[diff_ele_fw > 180] - 360
-        diff_ele_fw[diff_ele_fw < -180] = diff_ele_fw[diff_ele_fw < -180] + 360
+        # Angular steps between consecutive samples, wrapped to [-180, 180]
+        diff_azi = np.diff(azimuth)
+        diff_azi[diff_azi > 180] -= 360
+        diff_azi[diff_azi < -180] += 360
 
-        forward_swipe_condition_fw = (
-            (diff_azi_fw >= self.config.min_azi_step)
-            * (diff_azi_fw <= self.config.max_azi_step)
-            * (diff_ele_fw >= self.config.min_ele_step)
-            * (diff_ele_fw <= self.config.max_ele_step)
-        )
+        diff_ele = np.diff(elevation)
+        diff_ele[diff_ele > 180] -= 360
+        diff_ele[diff_ele < -180] += 360
 
-        # Angular difference (backward difference)
-        diff_azi_bw = self.inputData["azimuth"].diff(dim="time", label="upper")
-        diff_azi_bw[diff_azi_bw > 180] = diff_azi_bw[diff_azi_bw > 180] - 360
-        diff_azi_bw[diff_azi_bw < -180] = diff_azi_bw[diff_azi_bw < -180] + 360
-
-        diff_ele_bw = self.inputData["elevation"].diff(dim="time", label="upper")
-        diff_ele_bw[diff_ele_bw > 180] = diff_ele_bw[diff_ele_bw > 180] - 360
-        diff_ele_bw[diff_ele_bw < -180] = diff_ele_bw[diff_ele_bw < -180] + 360
-
-        forward_swipe_condition_bw = (
-            (diff_azi_bw >= self.config.min_azi_step)
-            * (diff_azi_bw <= self.config.max_azi_step)
-            * (diff_ele_bw >= self.config.min_ele_step)
-            * (diff_ele_bw <= self.config.max_ele_step)
+        forward_step = (
+            (diff_azi >= self.config.min_azi_step)
+            & (diff_azi <= self.config.max_azi_step)
+            & (diff_ele >= self.config.min_ele_step)
+            & (diff_ele <= self.config.max_ele_step)
         )
 
-        # Contatenate swipe conditions
-        forward_swipe_condition = xr.concat(
-            [
-                forward_swipe_condition_fw[0],
-                forward_swipe_condition_fw | forward_swipe_condition_bw,
-                forward_swipe_condition_bw[-1],
-            ],
-            dim="time",
-        )
+        # A sample is a forward swipe if the step before (backward difference) or after (forward difference) it is
+        forward_swipe_condition = np.zeros(len(azimuth), dtype=bool)
+        forward_swipe_condition[:-1] |= forward_step
+        forward_swipe_condition[1:] |= forward_step
 
-        # Remove beams in the deceleration phase of the scanning head
-        azi_sel = self.inputData["azimuth"].where(forward_swipe_condition)
-        ele_sel = self.inputData["elevation"].where(forward_swipe_condition)
-        first = (azi_sel - azi_sel[0]) ** 2 + (
-            ele_sel - ele_sel[0]
-        ) ** 2 < self.config.ang_tol**2
-        first_forward = xr.concat(
-            [first[0], (forward_swipe_condition + 0).diff(dim="time") == 1], dim="time"
+        # Remove beams in the deceleration phase of the scanning head (start of a forward swipe away from the first beam)
+        first = forward_swipe_condition[0] & (
+            (azimuth - azimuth[0]) ** 2 + (elevation - elevation[0]) ** 2 < self.config.ang_tol**2
         )
-        forward_swipe_condition[(first_forward == True) * (first == False)] = False
+        first_forward = np.empty_like(forward_swipe_condition)
+        first_forward[:1] = first[:1]
+        first_forward[1:] = forward_swipe_condition[1:] & ~forward_swipe_condition[:-1]
+        forward_swipe_condition[first_forward & ~first] = False
 
-        self.outputData = self.inputData.where(forward_swipe_condition)
+        # Rejected samples are tracked by a validity mask instead of being masked in every variable
+        self.outputData = self.inputData.copy(deep=False)
+        self.valid_time = forward_swipe_condition
 
         self.logger.log(
-            f"Back-swipe removal: {np.round(np.sum(forward_swipe_condition).values/len(self.inputData.azimuth)*100,2)}% retained"
+            f"Back-swipe removal: {np.round(np.sum(forward_swipe_condition)/len(azimuth)*100,2)}% retained"
         )
 
     # @with_logging ## <------- no logging in this method
@@ -288,12 +330,13 @@ class Standardize:
         """
         Perform binning and counting of scan data to identify most probable angles.
         """
-        from scipy import stats
+        azimuth = self.outputData.azimuth.values[self.valid_time]
+        elevation = self.outputData.elevation.values[self.valid_time]
 
         llimit_azi = (
-            utilities.floor(self.outputData.azimuth.min(), self.config.ang_tol))
+            utilities.floor(np.nanmin(azimuth), self.config.ang_tol))
         ulimit_azi = (
-            utilities.ceil(self.outputData.azimuth.max(), self.config.ang_tol)
+            utilities.ceil(np.nanmax(azimuth), self.config.ang_tol)
             + self.config.ang_tol
         )
         azi_bins = np.arange(llimit_azi, ulimit_azi, self.config.ang_tol)
@@ -301,38 +344,48 @@ class Standardize:
             azi_bins=np.array([azi_bins[0]-self.config.ang_tol/2,azi_bins[0]+self.config.ang_tol/2])
 
         llimit_ele = (
-            utilities.floor(self.outputData.elevation.min(), self.config.ang_tol))
+            utilities.floor(np.nanmin(elevation), self.config.ang_tol))
         ulimit_ele = (
-            utilities.ceil(self.outputData.elevation.max(), self.config.ang_tol)
+            utilities.ceil(np.nanmax(elevation), self.config.ang_tol)
             + self.config.ang_tol
         )
         ele_bins = np.arange(llimit_ele, ulimit_ele, self.config.ang_tol)
         if len(ele_bins)==1:
             ele_bins=np.array([ele_bins[0]-self.config.ang_tol/2,ele_bins[0]+self.config.ang_tol/2])
 
-    
-        #2D hisotgram of angles
-        counts = stats.binned_statistic_2d(self.outputData.azimuth,self.outputData.elevation,
-            None,"count", bins=[azi_bins, ele_bins])[0]
+
+        #2D hisotgram of angles, as counts and medians of the occupied bins (in row-major bin order)
+        azi_index = utilities.bin_index(azimuth, azi_bins)
+        ele_index = utilities.bin_index(elevation, ele_bins)
+        valid = (azi_index >= 0) & (ele_index >= 0)
+        bin_code = azi_index[valid] * (len(ele_bins) - 1) + ele_index[valid]
+
+        _, counts, azi_avg = utilities.grouped_median(bin_code, azimuth[valid])
+        _, _, ele_avg = utilities.grouped_median(bin_code, elevation[valid])
+        counts = counts.astype(float)
         counts_condition = counts / counts.max() > self.config.count_threshold
-        
-        azi_avg = stats.binned_statistic_2d(self.outputData.azimuth,self.outputData.elevation,
-            self.outputData.azimuth,"median", bins=[azi_bins, ele_bins])[0]
-        ele_avg = stats.binned_statistic_2d(self.outputData.azimuth,self.outputData.elevation,
-            self.outputData.elevation,"median", bins=[azi_bins, ele_bins])[0]
-        
-        azi=azi_avg[counts_condition]
-        ele=ele_avg[counts_condition]
-
-        #condensate adjacent angles
-        diff_ang = (np.abs(azi[:, None] - azi[None, :]) ** 2
-                  + np.abs(ele[:, None] - ele[None, :]) ** 2) ** 0.5
-        diff_ang[(diff_ang==0)+np.isnan(diff_ang)]=360
-        minind1=np.arange(len(azi))
-        minind2=np.argmin(diff_ang,axis=1) 
-        mindiff=np.nanmin(diff_ang,axis=1) 
-        adjacent_condition=mindiff<self.config.ang_tol
-        
+
+        azi = azi_avg[counts_condition]
+        ele = ele_avg[counts_condition]
+
+        #condensate adjacent angles (nearest distinct angle closer than the tolerance, lowest index on ties)
+        pairs = cKDTree(np.column_stack((azi, ele))).query_pairs(self.config.ang_tol, output_type="ndarray")
+        ind1 = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        ind2 = np.concatenate((pairs[:, 1], pairs[:, 0]))
+        diff_ang = (np.abs(azi[ind1] - azi[ind2]) ** 2 + np.abs(ele[ind1] - ele[ind2]) ** 2) ** 0.5
+        sel = (diff_ang > 0) & (diff_ang < self.config.ang_tol)
+        ind1, ind2, diff_ang = ind1[sel], ind2[sel], diff_ang[sel]
+        order = np.lexsort((ind2, diff_ang, ind1))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ind1[order][1:] != ind1[order][:-1]
+        nearest = order[first]
+
+        minind1 = np.arange(len(azi))
+        minind2 = minind1.copy()
+        minind2[ind1[nearest]] = ind2[nearest]
+        adjacent_condition = np.zeros(len(azi), dtype=bool)
+        adjacent_condition[ind1[nearest]] = True
+
         azi_cond=azi.copy()
         azi_cond[adjacent_condition]=(azi[minind1[adjacent_condition]]+azi[minind2[adjacent_condition]])/2
         
@@ -366,36 +419,43 @@ class Standardize:
             ele = self.outputData["elevation"].values
             elevation_bin_centers = self.elevation_detected
 
-            # Calculate the absolute difference between azimuth values and bin centers
+            # Nearest bin center of each sample within the tolerance (lowest index on ties), from a spatial index of the centers
+            valid = np.where(self.valid_time & ~np.isnan(azi + ele))[0]
+            candidates = min(4, len(azimuth_bin_centers))
+            _, ind = cKDTree(np.column_stack((azimuth_bin_centers, elevation_bin_centers))).query(
+                np.column_stack((azi[valid], ele[valid])), k=candidates,
+                distance_upper_bound=self.config.ang_tol * (1 + 10**-6)
+            )
+            ind = np.sort(ind.reshape(len(valid), candidates), axis=1)  # missing neighbors (index=number of centers) last
+            found = ind < len(azimuth_bin_centers)
+            ind[~found] = 0
             diff_ang = (
-                np.abs(azi[:, None] - azimuth_bin_centers[None, :]) ** 2
-                + np.abs(ele[:, None] - elevation_bin_centers[None, :]) ** 2
+                np.abs(azi[valid, None] - azimuth_bin_centers[ind]) ** 2
+                + np.abs(ele[valid, None] - elevation_bin_centers[ind]) ** 2
             ) ** 0.5
-            mindiff = xr.DataArray(
-                data=diff_ang.min(axis=1), coords={"time": self.outputData.time}
-            )
-            mindiff[mindiff > self.config.ang_tol] = np.nan
-            minind = np.argmin(diff_ang, axis=1)
+            diff_ang[~found] = np.inf
+            nearest = np.argmin(diff_ang, axis=1)
+            rows = np.arange(len(valid))
+
+            minind = np.zeros(len(azi), dtype=int)
+            minind[valid] = ind[rows, nearest]
+            assigned = np.zeros(len(azi), dtype=bool)
+            assigned[valid] = diff_ang[rows, nearest] <= self.config.ang_tol
             
             self.outputData["azimuth"].values = azimuth_bin_centers[minind]
             self.outputData["elevation"].values = elevation_bin_centers[minind]
             
-            self.outputData = self.outputData.where(~np.isnan(mindiff))
-            self.azimuth_regularized = self.outputData["azimuth"].copy()
-            self.elevation_regularized = self.outputData["elevation"].copy()
+            self.valid_time = self.valid_time & assigned
+            self.azimuth_regularized = self.outputData["azimuth"].where(xr.DataArray(self.valid_time, dims="time"))
+            self.elevation_regularized = self.outputData["elevation"].where(xr.DataArray(self.valid_time, dims="time"))
             
-            #recount and discard low occurences
-            recounts=np.zeros(len(self.outputData["azimuth"].values))
-            ctr=0
-            for a, e in zip(self.azimuth_detected, self.elevation_detected):
-                sel = (self.outputData.azimuth.values == a)*(self.outputData.elevation.values == e)
-                recounts[sel]=np.sum(sel)
-                ctr += 1
+            #recount (occurrences of the assigned bin center) and discard low occurences
+            recounts = np.zeros(len(azi))
+            recounts[assigned] = np.bincount(minind[assigned], minlength=len(azimuth_bin_centers))[minind[assigned]]
             
-            recounts_condition = xr.DataArray(recounts/recounts.max() > self.config.count_threshold,
-                                              coords={'time':self.outputData.time})
+            recounts_condition = recounts/recounts.max() > self.config.count_threshold
 
-            self.outputData = self.outputData.where(recounts_condition)
+            self.valid_time = self.valid_time & recounts_condition
 
             self.logger.log(
                 f"Relevant angles detection: {np.round(np.sum(~np.isnan(self.azimuth_regularized.values+self.elevation_regularized.values))/len(self.inputData.azimuth)*100,2)}% retained"
@@ -413,44 +473,60 @@ class Standardize:
         QC lidar data
 
         """
+        if self.config.block_duration > 0:
+            self.filter_scan_blocks()
+            return
+
+        data, valid = self.scan_to_columns()
 
-        df = self.scan_to_dataframe()
+        # Bit-packed qc flags (each criterion sets its own bit, 0 is good data)
+        qc_wind_speed = np.zeros(len(data["wind_speed"]), dtype=np.uint16)
+        self.qc_flag = {}
 
         # Apply prefiltering
-        filterdf1 = self.pre_filter(df)
-        df_temp = df.where(filterdf1.sum(axis=1) == len(filterdf1.columns))
+        self.pre_filter(data, qc_wind_speed)
+        prefiltered = qc_wind_speed == 0
+        data_temp = {
+            c: np.where(prefiltered, data[c], np.nan)
+            for c in ["x", "y", "z", "deltaTime", "wind_speed", "SNR"]
+        }
 
         # Apply dynamic filter
-        filterdf2, rws_norm, snr_norm, probability = self.dynamic_filter(df_temp)
+        rws_norm, snr_norm, probability = self.dynamic_filter(data_temp, qc_wind_speed)
 
-        # Save qc flags
-        filterdf = pd.concat([filterdf1, filterdf2], axis=1)
-        df["qc_wind_speed"] = 0
-        self.qc_flag = {}
-        ctr = 1
-        for c in filterdf.columns:
-            self.qc_flag[c] = ctr
-            if np.sum(filterdf[c] == False) > 0:
-                mask = ~filterdf[c] & (df["qc_wind_speed"] == 0)
-                df.loc[mask, "qc_wind_speed"] = ctr
-            ctr += 1
-
-        # Reorganize output dataframe
-        df["rws_norm"] = rws_norm
-        df["snr_norm"] = snr_norm
-        df["probability"] = probability
-        df = df.drop(["deltaTime"], axis=1)
-        df = df[~df.index.duplicated(keep="first")]
-        df = df.set_index(["time", "range"])
-
-        # Back to xarray
-        ds = xr.Dataset.from_dataframe(df)
+        # Output columns (Cartesian coordinates are added per beam when reindexing)
+        columns = {
+            c: data[c]
+            for c in ["wind_speed", "SNR", "azimuth", "elevation", "pitch", "roll"]
+        }
+        columns["qc_wind_speed"] = qc_wind_speed
+        columns["rws_norm"] = rws_norm
+        columns["snr_norm"] = snr_norm
+        columns["probability"] = probability
+
+        # Scatter back to the grid, keeping only times and ranges with valid samples (empty cells are NaN, so 
+        # integer flags stay integer only if the grid is full)
+        keep = {
+            d: valid.any(dim=[other for other in valid.dims if other != d]).values
+            for d in valid.dims
+        }
+        valid_kept = valid.values[np.ix_(*[keep[d] for d in valid.dims])]
+        ds = xr.Dataset(coords={d: valid[d].values[keep[d]] for d in valid.dims})
+        for c, values in columns.items():
+            if valid_kept.all():
+                grid = np.empty(valid_kept.shape, dtype=values.dtype)
+            else:
+                dtype, fill_value = utilities.nullable_dtype(values.dtype)
+                grid = np.full(valid_kept.shape, fill_value, dtype=dtype)
+            grid[valid_kept] = values
+            ds[c] = xr.DataArray(grid, dims=valid.dims)
+        ds = ds.transpose("time", "range")
 
         # Drop range dimension from beam properties
-        ds["azimuth"] = ds["azimuth"].sel(range=ds["range"][0]).drop("range")
-        ds["elevation"] = ds["elevation"].sel(range=ds["range"][0]).drop("range")
-        ds["pitch"] = ds["pitch"].sel(range=ds["range"][0]).drop("range")
-        ds["roll"] = ds["roll"].sel(range=ds["range"][0]).drop("range")
+        ds["azimuth"] = ds["azimuth"].isel(range=0, drop=True)
+        ds["elevation"] = ds["elevation"].isel(range=0, drop=True)
+        ds["pitch"] = ds["pitch"].isel(range=0, drop=True)
+        ds["roll"] = ds["roll"].isel(range=0, drop=True)
 
         # Inherit attributes
         ds.attrs = self.outputData.attrs
@@ -459,126 +535,326 @@ class Standardize:
             if v in ds.data_vars:
                 ds[v].attrs = self.outputData[v].attrs
 
-        # Save filtered data
+        # Save filtered data (rejected samples are now NaN, so all the samples of the new grid are retained)
         self.outputData = ds
+        self.valid_time = np.ones(ds.time.size, dtype=bool)
+
+    def filter_scan_blocks(self):
+        """
+        QC lidar data one time block at a time (block_duration), so that only a block of the input and of the
+        QC working arrays is in memory besides the (range, time) grids of the output channels. Global quantities
+        (resonance threshold, edges of the dynamic filter bins and probability threshold) are reduced over all the
+        blocks before being applied, and the blocks of the dynamic filter hold whole time bins, so the QC is the
+        same as for the whole scan.
+        """
+        time = self.outputData["time"].values
+        tnum = utilities.dt64_to_num(time)
+        deltaTime = tnum - tnum.min()
+        distance = np.unique(self.inputData[self.config.range_name])
+        shape = (len(distance), len(time))  # samples sorted by range, then time, as in scan_to_columns
+
+        valid = np.zeros(shape, dtype=bool)
+        grids = {
+            c: np.full(shape, np.nan, dtype=self.config.precision)
+            for c in ["wind_speed", "SNR", "rws_norm", "snr_norm", "probability"]
+        }
+        grids["qc_wind_speed"] = np.zeros(shape, dtype=np.uint16)
+        self.qc_flag = {}
+
+        def block_columns(times):
+            """Column arrays of the valid samples of a block of the grids, with 3D coordinates and time"""
+            block = valid[:, times]
+            data = {c: grid[:, times][block] for c, grid in grids.items()}
+            data["range"] = np.broadcast_to(distance[:, None], block.shape)[block]
+            data["deltaTime"] = np.broadcast_to(deltaTime[times], block.shape)[block]
+            for v in ["azimuth", "elevation"]:
+                data[v] = np.broadcast_to(self.outputData[v].values[times], block.shape)[block]
+            self.add_xyz(data)
+            return data, block
+
+        # Read the input and apply the static limits, block by block
+        blocks = self.time_blocks(deltaTime)
+        rejected_max = []
+        for times in blocks:
+            data, block = self.scan_to_columns(times)
+            block = block.values
+            qc = np.zeros(len(data["wind_speed"]), dtype=np.uint16)
+            self.limit_filter(data, qc)
+            valid[:, times] = block
+            utilities.set_block(grids["wind_speed"], times, block, data["wind_speed"])
+            utilities.set_block(grids["SNR"], times, block, data["SNR"])
+            utilities.set_block(grids["qc_wind_speed"], times, block, qc)
+            if np.any(qc != 0):
+                rejected_max.append(np.nanmax(data["wind_speed"][qc != 0]))
+
+        # Resonance detection on the summed histograms of the rejected RWS of all the blocks
+        wind_speed_max = np.nanmax(rejected_max) if len(rejected_max) > 0 else np.nan
+        count = 0
+        for times in blocks:
+            block = valid[:, times]
+            rejected = grids["qc_wind_speed"][:, times][block] != 0
+            count = count + self.resonance_histogram(grids["wind_speed"][:, times][block][rejected], wind_speed_max)
+        self.rws_min = self.fit_resonance(count, wind_speed_max)
+
+        # Wind speed min limit and extent of the pre-filtered data
+        limits = {c: [] for c in ["x", "y", "z", "deltaTime"]}
+        for times in blocks:
+            data, block = block_columns(times)
+            qc = data["qc_wind_speed"]
+            self.set_qc_flag(qc, "rws_min", np.abs(data["wind_speed"]) >= self.rws_min)
+            utilities.set_block(grids["qc_wind_speed"], times, block, qc)
+            for c in limits:
+                limits[c] += [np.nanmin(data[c][qc == 0]), np.nanmax(data[c][qc == 0])] if np.any(qc == 0) else []
+        prefilter_bits = np.uint16(sum(1 << (bit - 1) for bit in self.qc_flag.values()))
+
+        # Local criteria of the dynamic filter, on blocks of whole x, y, z, time bins
+        edges = utilities.local_bin_edges({c: np.array(values) for c, values in limits.items()}, self.config)
+        blocks = self.time_blocks(deltaTime, edges[3])
+        for times in blocks:
+            data, block = block_columns(times)
+            qc = data["qc_wind_speed"]
+            data_temp = {
+                c: np.where(qc == 0, data[c], np.nan)
+                for c in ["x", "y", "z", "deltaTime", "wind_speed", "SNR"]
+            }
+            self.local_filter(data_temp, qc, utilities.local_bin_id(data_temp, self.config, edges))
+            utilities.set_block(grids["qc_wind_speed"], times, block, qc)
+            utilities.set_block(grids["rws_norm"], times, block, data_temp["rws_norm"])
+            utilities.set_block(grids["snr_norm"], times, block, data_temp["snr_norm"])
+
+        # Probability conditions on the samples retained so far in all the blocks
+        retained = valid & (grids["qc_wind_speed"] == 0)
+        df = {
+            "rws_norm": grids["rws_norm"][retained],
+            "snr_norm": grids["snr_norm"][retained],
+            "filtered_temp": np.ones(retained.sum(), dtype=bool),
+        }
+        _, df, self.qc_rws_range, self.qc_probability_threshold = local_probability(df, self.config)
+        grids["probability"][retained] = df["probability"]
+        del df, retained
+
+        # Probability limit and local scattering filter, on blocks of whole x, y, z, time bins
+        for times in blocks:
+            data, block = block_columns(times)
+            qc = data["qc_wind_speed"]
+            self.set_qc_flag(qc, "probability_limit", data["probability"] > self.qc_probability_threshold, qc == 0)
+            prefiltered = qc & prefilter_bits == 0
+            data_temp = {c: np.where(prefiltered, data[c], np.nan) for c in ["x", "y", "z", "deltaTime"]}
+            self.scattering_filter(qc, utilities.local_bin_id(data_temp, self.config, edges), prefiltered)
+            utilities.set_block(grids["qc_wind_speed"], times, block, qc)
+
+        self.logger.log(
+            f"Retained {np.round(100*np.sum(valid & (grids['qc_wind_speed'] == 0))/valid.sum(),2)}% of data after QC"
+        )
+
+        # Output grid, keeping only times and ranges with valid samples (empty cells are NaN, so integer flags stay
+        # integer only if the grid is full) and beam properties from the first range, as in filter_scan_data
+        keep_range = valid.any(axis=1)
+        keep_time = valid.any(axis=0)
+        valid_kept = valid[np.ix_(keep_range, keep_time)]
+        ds = xr.Dataset(coords={"range": distance[keep_range], "time": time[keep_time]})
+        for c in ["wind_speed", "SNR", "azimuth", "elevation", "pitch", "roll", "qc_wind_speed", "rws_norm", "snr_norm", "probability"]:
+            if c in grids:
+                values, mask, dims = grids.pop(c)[np.ix_(keep_range, keep_time)], valid_kept, ["range", "time"]
+            else:
+                values, mask, dims = self.outputData[c].values[keep_time], valid_kept[0], ["time"]
+            if not valid_kept.all():
+                dtype, fill_value = utilities.nullable_dtype(values.dtype)
+                values = np.where(mask, values, fill_value).astype(dtype)
+            ds[c] = xr.DataArray(values, dims=dims)
+        ds = ds.transpose("time", "range")
+
+        # Inherit attributes
+        ds.attrs = self.outputData.attrs
+
+        for v in self.outputData.data_vars:
+            if v in ds.data_vars:
+                ds[v].attrs = self.outputData[v].attrs
+
+        # Save filtered data (rejected samples are now NaN, so all the samples of the new grid are retained)
+        self.outputData = ds
+        self.valid_time = np.ones(ds.time.size, dtype=bool)
+
+    def time_blocks(self, deltaTime, edges=None):
+        """
+        Split the times into blocks of whole time bins of the dynamic filter spanning about block_duration
 
-    def scan_to_dataframe(self):
+        Inputs:
+        ------
+        deltaTime: array of floats
+            time in seconds from the start of the scan
+        edges: array of floats
+            edges of the time bins of the dynamic filter (times outside go to the first or last block).
+            Optional, defaults to bins starting at the first time
+
+        Outputs:
+        ------
+        blocks: list of arrays of ints
+            indices of the times of each block, or a single slice of all the times if block_duration is 0
+        """
+        if self.config.block_duration == 0:
+            return [slice(None)]
+        if edges is None:
+            edges = np.arange(np.nanmin(deltaTime), np.nanmax(deltaTime) + self.config.dtime, self.config.dtime)
+
+        size = max(1, int(np.round(self.config.block_duration / self.config.dtime)))
+        bins = np.clip(np.searchsorted(edges, deltaTime, side="left") - 1, 0, max(len(edges) - 2, 0))
+        block = bins // size
+        order = np.argsort(block, kind="stable")
+        return np.split(order, np.flatnonzero(np.diff(block[order])) + 1)
+
+    def scan_to_columns(self, times=None):
         """
-        Make a pandas dataframe to simplify filtering
+        Flatten the scan into flat column arrays (one value per valid time-range sample) to simplify filtering
+
+        Inputs:
+        ------
+        times: array of ints
+            indices of the times of a block to flatten (read from the input and cast to the processing precision).
+            Optional, defaults to all the times
 
+        Outputs:
+        ------
+        data: dict
+            column arrays of range, wind_speed, SNR, deltaTime, azimuth, elevation, pitch, roll, x, y, and z
+        valid: xarray.DataArray
+            boolean mask of the valid samples (retained time and no missing column) on the time-range grid
         """
 
+        if times is None:
+            scan = self.outputData
+            valid_time = self.valid_time
+        else:
+            scan = utilities.set_precision(self.outputData.isel(time=times), self.config.precision)
+            valid_time = self.valid_time[times]
+
         # Add SNR floor
-        if "SNR" not in self.outputData.data_vars:
-            self.outputData["SNR"]=np.log10(self.outputData["intensity"]-1)*10
-        self.outputData["SNR"] = self.outputData["SNR"].fillna(self.config.snr_min - 1)
+        if "SNR" not in scan.data_vars:
+            scan["SNR"]=np.log10(scan["intensity"]-1)*10
+        scan["SNR"] = scan["SNR"].fillna(self.config.snr_min - 1)
 
         # Add time in seconds from start of the scan
         tnum = (
-            self.outputData["time"] - np.datetime64("1970-01-01T00:00:00")
+            scan["time"] - np.datetime64("1970-01-01T00:00:00")
         ) / np.timedelta64(1, "s")
-        self.outputData["deltaTime"] = tnum - tnum.min()
+        scan["deltaTime"] = tnum - utilities.dt64_to_num(self.outputData["time"].values).min()
 
         # Swap range index with physical range
         distance = np.unique(self.inputData[self.config.range_name])
-        self.outputData = self.outputData.rename({"range_gate": "range"})
-        self.outputData = self.outputData.assign_coords({"range": distance})
-
-        # Add 3D coordinates
-        self.outputData["x"], self.outputData["y"], self.outputData["z"] = (
-            utilities.lidar_xyz(
-                self.outputData["range"],
-                self.outputData["elevation"],
-                self.outputData["azimuth"],
-            )
-        )
+        scan = scan.rename({"range_gate": "range"})
+        scan = scan.assign_coords({"range": distance})
 
-        df = (
-            self.outputData[
-                [
-                    "x",
-                    "y",
-                    "z",
-                    "wind_speed",
-                    "SNR",
-                    "deltaTime",
-                    "azimuth",
-                    "elevation",
-                    "pitch",
-                    "roll",
-                ]
-            ]
-            .to_dataframe()
-            .dropna(how="any")
-        )
-        df = df.reset_index()
+        scan = scan[
+            ["wind_speed", "SNR", "deltaTime", "azimuth", "elevation", "pitch", "roll"]
+        ]
+        dims = ["range", "time"]  # samples sorted by range, then time
 
-        return df
+        # Valid samples are retained and have no missing column
+        valid = xr.DataArray(valid_time, dims="time") & scan["range"].notnull()
+        for v in scan.data_vars:
+            valid = valid & scan[v].notnull()
+        valid = valid.transpose(*dims)
+
+        data = {"range": valid["range"].broadcast_like(valid).transpose(*dims).values[valid.values]}
+        for v in scan.data_vars:
+            data[v] = scan[v].broadcast_like(valid).transpose(*dims).values[valid.values]
+
+        self.add_xyz(data)
+
+        return data, valid
+
+    def add_xyz(self, data):
+        """
+        Add 3D coordinates (in the processing precision) to column arrays of range, azimuth, and elevation, from a
+        table of the direction cosines of the distinct beams
+        """
+        dtype = self.config.precision
+        angles = np.column_stack((data["azimuth"], data["elevation"]))
+        beams, beam = np.unique(angles, axis=0, return_inverse=True)
+        table = utilities.direction_cosines(beams[:, 1].astype(dtype), beams[:, 0].astype(dtype))
+        data["x"], data["y"], data["z"] = utilities.beam_xyz(data["range"].astype(dtype), beam.ravel(), table)
+
+    def set_qc_flag(self, qc, name, filt, evaluated=None):
+        """
+        Set the bit of a QC criterion where it rejects data
+
+        Inputs:
+        ------
+        qc: array of uint16
+            bit-packed QC flags, updated in place
+        name: str
+            name of the QC criterion, assigned the next free bit (bit k has value 2**(k-1))
+        filt: array of bool
+            True where data pass the criterion
+        evaluated: array of bool
+            True where the criterion is evaluated. Optional, defaults to all the data. Data outside it (e.g.
+            rejected by the pre-filter before a dynamic criterion) do not get the bit
+        """
+        if name not in self.qc_flag:
+            self.qc_flag[name] = len(self.qc_flag) + 1
+        self.logger.log(
+            f"{name} filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
+        )
+        rejected = ~filt if evaluated is None else ~filt & evaluated
+        qc[rejected] |= np.uint16(1 << (self.qc_flag[name] - 1))
 
     @with_logging
-    def pre_filter(self, df):
+    def pre_filter(self, df, qc):
         """
         Pre-filter of lidar data based on location and static rws and snr limits
 
         Inputs:
         ------
-        df: dataframe
-            dataframe of lidar data
+        df: dict
+            column arrays of lidar data
+        qc: array of uint16
+            bit-packed QC flags, updated in place
 
         Outputs:
         ------
-        filterdf: dataframe
-            dataframe of QC flags
-        df['rws_norm']: array of floats
-            normalized radial wind speed
-        df['snr_norm']: array of floats
-            normalized SNR
-        df['probability']: arrays of floats
-            probability of rws-SNR histogram
+        qc: array of uint16
+            bit-packed QC flags
+        """
+        self.limit_filter(df, qc)
+
+        # Wind speed min limit
+        rejected = qc != 0
+        self.rws_min = self.detect_resonance({"wind_speed": np.where(rejected, df["wind_speed"], np.nan)})
+
+        filt = np.abs(df["wind_speed"]) >= self.rws_min
+        self.set_qc_flag(qc, "rws_min", filt)
+
+        return qc
+
+    def limit_filter(self, df, qc):
+        """
+        Static limits on location, SNR and maximum rws (pre-filter criteria independent of the rest of the data)
+
+        Inputs:
+        ------
+        df: dict
+            column arrays of lidar data
+        qc: array of uint16
+            bit-packed QC flags, updated in place
         """
-        filterdf = pd.DataFrame()
 
         # Range limits
         filt = (df["range"] >= self.config.range_min) & (
             df["range"] <= self.config.range_max
         )
-        self.logger.log(
-            f"range_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["range_limit"] = filt.values
+        self.set_qc_flag(qc, "range_limit", filt)
 
         # Ground rejection
         filt = df["z"] > self.config.ground_level
-        self.logger.log(
-            f"ground_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["ground_limit"] = filt.values
+        self.set_qc_flag(qc, "ground_limit", filt)
 
         # SNR limit
         filt = df["SNR"] >= self.config.snr_min
-        self.logger.log(
-            f"snr_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["snr_limit"] = filt
+        self.set_qc_flag(qc, "snr_limit", filt)
 
         # Wind speed max limit
         filt = np.abs(df["wind_speed"]) <= self.config.rws_max
-        self.logger.log(
-            f"rws_max filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["rws_max"] = filt
-
-        # Wind speed min limit
-        df_temp = df.where(filterdf.sum(axis=1) < len(filterdf.columns))
-        self.rws_min = self.detect_resonance(df_temp)
-
-        filt = np.abs(df["wind_speed"]) >= self.rws_min
-        self.logger.log(
-            f"rws_min filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["rws_min"] = filt
-
-        return filterdf
+        self.set_qc_flag(qc, "rws_max", filt)
 
     def detect_resonance(self, df):
         """
@@ -586,8 +862,8 @@ class Standardize:
 
         Inputs:
         -----
-        df: dataframe
-            Dataframe of current data (bad data only)
+        df: dict
+            column arrays of current data (bad data only)
 
         Outputs
         -----
@@ -595,30 +871,50 @@ class Standardize:
             Lower threshold to be applied to absolute value of RWS. Detection is based on Gaussian fitting of histogram.
 
         """
+        wind_speed = np.asarray(df["wind_speed"])
+        wind_speed_max = np.nanmax(wind_speed)
 
-        # build histogram if RWS normalized by maximum value
-        df["rws_bins"] = pd.cut(
-            df["wind_speed"] / df["wind_speed"].max(),
-            bins=np.linspace(-1, 1, self.config.N_resonance_bins),
-        )
-        groups = df.groupby(by="rws_bins", group_keys=False, observed=True)
-        H = groups["wind_speed"].count()
+        return self.fit_resonance(self.resonance_histogram(wind_speed, wind_speed_max), wind_speed_max)
 
-        # Normalize histogram by subtracting min and dividing by value in 0 (makes it more Gaussian)
-        H = (H - H.min()) / H.iloc[int(self.config.N_resonance_bins / 2 - 1)]
+    def resonance_histogram(self, wind_speed, wind_speed_max):
+        """
+        Histogram of RWS normalized by its maximum value (right-closed bins, as pd.cut). Histograms of different
+        parts of the data with the same maximum can be summed.
+        """
+        bins = np.linspace(-1, 1, self.config.N_resonance_bins)
+        index = utilities.cut_index(wind_speed / wind_speed_max, bins)
+        return np.bincount(index[index >= 0], minlength=len(bins) - 1)
 
-        # Single-parameter Gaussian fit
-        H_x = np.array([x.mid for x in H.index])
-        try:
-            sigma = curve_fit(utilities.gaussian, H_x, H, p0=[0.1], bounds=[0, 1])[0][0]
-        except:
-            self.logger.log("Resonance detection failed, assuming no resonance")
+    def fit_resonance(self, count, wind_speed_max):
+        """
+        Gaussian fit of the histogram of bad RWS (from resonance_histogram) and resulting threshold on absolute RWS
+        """
+        bins = np.linspace(-1, 1, self.config.N_resonance_bins)
+        H = count[count > 0].astype(float)
+
+        # Too few rejected data (e.g. a short scan) to populate the histogram up to its center
+        center = int(self.config.N_resonance_bins / 2 - 1)
+        if len(H) <= center:
+            self.logger.log("Too few rejected data for resonance detection, assuming no resonance")
             return 0
 
+        # Normalize histogram by subtracting min and dividing by value in 0 (makes it more Gaussian)
+        H = (H - H.min()) / H[center]
+
+        # Single-parameter Gaussian fit (closed-form iterations, curve_fit only if they do not converge)
+        H_x = ((bins[:-1] + bins[1:]) / 2)[count > 0]
+        sigma = utilities.fit_gaussian(H_x, H)
+        if sigma is None:
+            try:
+                sigma = curve_fit(utilities.gaussian, H_x, H, p0=[0.1], bounds=[0, 1])[0][0]
+            except:
+                self.logger.log("Resonance detection failed, assuming no resonance")
+                return 0
+
         # Check Gaussiainity and possibly calculate rws_min
         rmse = np.nanmean((utilities.gaussian(H_x, sigma) - H) ** 2) ** 0.5
         if rmse <= self.config.max_resonance_rmse:
-            rws_min = 2 * sigma * df["wind_speed"].max()
+            rws_min = 2 * sigma * wind_speed_max
             self.logger.log("Detected resonance")
         else:
             rws_min = 0
@@ -628,121 +924,136 @@ class Standardize:
         return rws_min
 
     @with_logging
-    def dynamic_filter(self, df):
+    def dynamic_filter(self, df, qc):
         """
         Dynamic filter of lidar data based on normalized rws and snr based on Beck and Kuhn, Remote Sensing, 2017
 
         Inputs:
         -----
-        df: dataframe
-            dataframe of lidar data
+        df: dict
+            column arrays of lidar data (NaN where rejected by the pre-filter)
+        qc: array of uint16
+            bit-packed QC flags, updated in place (dynamic criteria only flag data retained by the pre-filter,
+            and the probability limit only data retained by the local criteria)
 
         Outputs:
         -----
-        filterdf: dataframe
-            dataframe of QC flags
+        rws_norm, snr_norm, probability: arrays of floats
+            normalized radial wind speed, normalized SNR, and probability of rws-SNR histogram
 
         """
-        filterdf = pd.DataFrame()
 
-        # Group df by x, y, z, time bins
-        df = utilities.defineLocalBins(df, self.config)
-        groups = df.groupby(
-            ["xbins", "ybins", "zbins", "timebins"], group_keys=False, observed=True
+        # Integer id of the x, y, z, time bin of each sample (-1 if outside the bins)
+        group = utilities.local_bin_id(df, self.config)
+        prefiltered = qc == 0
+        self.local_filter(df, qc, group)
+
+        # Probability conditions (applies actual dynamic filter)
+        df["filtered_temp"] = qc == 0  # points retained in previous steps
+        filt, df, rws_range, probability_threshold = local_probability(df, self.config)
+        self.set_qc_flag(qc, "probability_limit", filt, df["filtered_temp"])
+        self.qc_rws_range = rws_range
+        self.qc_probability_threshold = probability_threshold
+        df.pop("filtered_temp")
+
+        self.scattering_filter(qc, group, prefiltered)
+
+        retained = qc == 0
+        self.logger.log(
+            f"Retained {np.round(100*retained.sum()/len(retained),2)}% of data after QC"
         )
 
+        return df["rws_norm"], df["snr_norm"], df["probability"]
+
+    def local_filter(self, df, qc, group):
+        """
+        Normalize rws and snr by their median in the x, y, z, time bins and apply the local criteria of the dynamic
+        filter (normalized rws limit, minimum population, and standard error on the medians)
+
+        Inputs:
+        -----
+        df: dict
+            column arrays of lidar data (NaN where rejected by the pre-filter), normalized rws and snr are added
+        qc: array of uint16
+            bit-packed QC flags (pre-filter only), updated in place where data were retained by the pre-filter
+        group: array of ints
+            id of the x, y, z, time bin of each sample (-1 if outside the bins)
+        """
+        n_groups = max(group.max() + 1, 1)
+        ingroup = group >= 0
+        prefiltered = qc == 0
+
         # Normalized wind speed and SNR data channels
-        df["rws_norm"] = groups["wind_speed"].apply(lambda x: x - x.median())
-        df["snr_norm"] = groups["SNR"].apply(lambda x: x - x.median())
+        for v, v_norm in zip(["wind_speed", "SNR"], ["rws_norm", "snr_norm"]):
+            values = np.asarray(df[v])
+            median = np.zeros(n_groups) + np.nan
+            codes, _, median_valid = utilities.grouped_median(group[ingroup], values[ingroup])
+            median[codes] = median_valid
+            norm = np.full(len(values), np.nan, dtype=values.dtype)
+            norm[ingroup] = values[ingroup] - median[group[ingroup]]
+            df[v_norm] = norm
 
         # Normalized wind speed limit
         filt = np.abs(df["rws_norm"]) <= self.config.rws_norm_limit
-        self.logger.log(
-            f"rws_norm_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["rws_norm_limit"] = filt
+        self.set_qc_flag(qc, "rws_norm_limit", filt, prefiltered)
 
         # Minimum population
-        filt = groups["rws_norm"].count() >= self.config.local_population_min_limit
-        temp = df.set_index(["xbins", "ybins", "zbins", "timebins"]).copy()
-        temp["local_population_min_limit"] = filt
-        filt = temp["local_population_min_limit"].reset_index(drop=True)
-        self.logger.log(
-            f"local_population_min_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["local_population_min_limit"] = filt
+        rws_count, _, rws_std = utilities.grouped_std(group, df["rws_norm"], n_groups)
+        filt = ingroup & (rws_count[group] >= self.config.local_population_min_limit)
+        self.set_qc_flag(qc, "local_population_min_limit", filt, prefiltered)
 
         # Standard error on the median filter
-        filt = groups["rws_norm"].apply(
-            lambda x: ((np.pi / 2) ** 0.5 * x.std()) / x.count() ** 0.5
+        filt = ingroup & (
+            ((np.pi / 2) ** 0.5 * rws_std[group]) / rws_count[group] ** 0.5
             <= self.config.rws_standard_error_limit
         )
-        temp = df.set_index(["xbins", "ybins", "zbins", "timebins"]).copy()
-        temp["rws_standard_error_limit"] = filt
-        filt = temp["rws_standard_error_limit"].reset_index(drop=True)
-        self.logger.log(
-            f"rws_standard_error_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["rws_standard_error_limit"] = filt
+        self.set_qc_flag(qc, "rws_standard_error_limit", filt, prefiltered)
 
-        filt = groups["snr_norm"].apply(
-            lambda x: ((np.pi / 2) ** 0.5 * x.std()) / x.count() ** 0.5
+        snr_count, _, snr_std = utilities.grouped_std(group, df["snr_norm"], n_groups)
+        filt = ingroup & (
+            ((np.pi / 2) ** 0.5 * snr_std[group]) / snr_count[group] ** 0.5
             <= self.config.snr_standard_error_limit
         )
-        temp = df.set_index(["xbins", "ybins", "zbins", "timebins"]).copy()
-        temp["snr_standard_error_limit"] = filt
-        filt = temp["snr_standard_error_limit"].reset_index(drop=True)
-        self.logger.log(
-            f"snr_standard_error_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["snr_standard_error_limit"] = filt
-
-        # Probability conditions (applies actual dynamic filter)
-        df["filtered_temp"] = filterdf.sum(axis=1) == len(
-            filterdf.columns
-        )  # points retained in previous steps
-        filt, df, rws_range, probability_threshold = local_probability(df, self.config)
-        self.logger.log(
-            f"probability_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["probability_limit"] = filt
-        self.qc_rws_range = rws_range
-        self.qc_probability_threshold = probability_threshold
+        self.set_qc_flag(qc, "snr_standard_error_limit", filt, prefiltered)
 
-        # Local scattering filter (removes isolated points)
-        df["filtered_temp"] = filterdf.sum(axis=1) == len(
-            filterdf.columns
-        )  # points retained in previous steps
-        filt = groups["filtered_temp"].mean() > self.config.local_scattering_min_limit
-        temp = df.set_index(["xbins", "ybins", "zbins", "timebins"]).copy()
-        temp["local_scattering_min_limit"] = filt
-        filt = temp["local_scattering_min_limit"].reset_index(drop=True)
-        filt = filt.reset_index(drop=True)
-        self.logger.log(
-            f"local_scattering_min_limit filter: {np.round(filt.sum()/len(filt)*100,2)}% retained"
-        )
-        filterdf["local_scattering_min_limit"] = filt
-        df = df.drop("filtered_temp", axis=1)
+    def scattering_filter(self, qc, group, prefiltered):
+        """
+        Local scattering filter of the dynamic filter (removes isolated points)
 
-        filterdf = filterdf.replace(np.nan, False)
-        filterdf = filterdf.astype(np.int8)
-        self.logger.log(
-            f"Retained {np.round(100*filterdf.all(axis=1).sum()/len(filterdf),2)}% of data after QC"
-        )
+        Inputs:
+        -----
+        qc: array of uint16
+            bit-packed QC flags, updated in place
+        group: array of ints
+            id of the x, y, z, time bin of each sample (-1 if outside the bins)
+        prefiltered: array of bool
+            True where data were retained by the pre-filter (the only data the criterion can flag)
+        """
+        n_groups = max(group.max() + 1, 1)
+        ingroup = group >= 0
 
-        return filterdf, df["rws_norm"], df["snr_norm"], df["probability"]
+        retained = qc == 0  # points retained in previous steps
+        _, retained_fraction, _ = utilities.grouped_std(group, retained + 0.0, n_groups)
+        filt = ingroup & (retained_fraction[group] > self.config.local_scattering_min_limit)
+        self.set_qc_flag(qc, "local_scattering_min_limit", filt, prefiltered)
 
     @with_logging
-    def calculate_repetition_number(self):
+    def calculate_repetition_number(self, first_beam=None):
         """
         Calculate the repetition number of the scan
+
+        Inputs:
+        ------
+        first_beam: tuple of floats
+            azimuth and elevation of the beam starting each scan. Optional, defaults to the first sample
         """
         azi = self.outputData.azimuth.values
         ele = self.outputData.elevation.values
         time = self.outputData.time.values
 
         # Find scans' start
-        scan_start = time[(azi == azi[0]) * (ele == ele[0])]
+        self.first_beam = (azi[0], ele[0]) if first_beam is None else first_beam
+        scan_start = time[(azi == self.first_beam[0]) * (ele == self.first_beam[1])]
 
         # remove short scans (idling beam)
         scan_duration = np.diff(np.append(scan_start, time[-1]))
@@ -770,7 +1081,7 @@ class Standardize:
         self.outputData["scan_start_time"].values = self.outputData[
             "scan_start_time"
         ].ffill(dim="time")
-        self.outputData = self.outputData.where(self.outputData["scanID"] >= 0)
+        self.valid_time = self.valid_time & (self.outputData["scanID"].values >= 0)
     
     @with_logging
     def calculate_beam_number(self):
@@ -780,22 +1091,33 @@ class Standardize:
         self.outputData["deltaTime"] = (
             self.outputData.time - self.outputData.scan_start_time
         ) / np.timedelta64(1, "s")
-        deltaTime_regularized = np.zeros(len(self.outputData.time)) + np.nan
-        deltaTime_median = np.zeros(len(self.azimuth_detected))
-        ctr = 0
-        for a, e in zip(self.azimuth_detected, self.elevation_detected):
-            sel = (self.outputData.azimuth.values == a) * (
-                self.outputData.elevation.values == e
-            )
-            deltaTime_median[ctr] = np.nanmean(self.outputData.deltaTime[sel])
-            deltaTime_regularized[sel] = np.nanmean(self.outputData.deltaTime[sel])
-            ctr += 1
-        
+        deltaTime = self.outputData.deltaTime.values
+
+        # index of the detected angle of each sample (-1 if none)
+        angles = np.column_stack((self.azimuth_detected, self.elevation_detected))
+        valid = np.where(self.valid_time & ~np.isnan(self.outputData.azimuth.values + self.outputData.elevation.values))[0]
+        samples = np.column_stack((self.outputData.azimuth.values[valid], self.outputData.elevation.values[valid]))
+        _, inverse = np.unique(np.concatenate((angles, samples)), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        angle_index = np.zeros(len(inverse), dtype=int) - 1
+        angle_index[inverse[: len(angles)]] = np.arange(len(angles))
+        beam = np.zeros(len(deltaTime), dtype=int) - 1
+        beam[valid] = angle_index[inverse[len(angles) :]]
+
+        # mean time after scan start of each angle
+        sel = (beam >= 0) & ~np.isnan(deltaTime)
+        deltaTime_sum = np.bincount(beam[sel], weights=deltaTime[sel], minlength=len(angles))
+        deltaTime_count = np.bincount(beam[sel], minlength=len(angles))
+        deltaTime_median = np.zeros(len(angles)) + np.nan
+        np.divide(deltaTime_sum, deltaTime_count, out=deltaTime_median, where=deltaTime_count > 0)
+        deltaTime_regularized = np.zeros(len(deltaTime)) + np.nan
+        deltaTime_regularized[beam >= 0] = deltaTime_median[beam[beam >= 0]]
+
+        # beams numbered by increasing mean time after scan start
         sort_angles = np.argsort(deltaTime_median[~np.isnan(deltaTime_median)])
         beamID = np.zeros(len(deltaTime_regularized)) + np.nan
-        beamID[~np.isnan(deltaTime_regularized)] = np.where(
-            (deltaTime_regularized[:, None] - np.unique(deltaTime_regularized)[None, :])
-            == 0
+        beamID[~np.isnan(deltaTime_regularized)] = np.unique(
+            deltaTime_regularized[~np.isnan(deltaTime_regularized)], return_inverse=True
         )[1]
 
         self.azimuth_detected = self.azimuth_detected[~np.isnan(deltaTime_median)][
@@ -818,26 +1140,57 @@ class Standardize:
         """
         try:  # self.outputData is not None:
 
-            # Copy time information
-            self.outputData["time_temp"] = xr.DataArray(
-                self.outputData.time.values,
-                coords={"time": self.outputData.time.values},
-            )
-
-            # Reindex
-            self.outputData = self.outputData.where(
-                ~np.isnan(self.outputData.beamID + self.outputData.scanID), drop=True
-            )
-            self.outputData = self.outputData.set_index(time=["beamID", "scanID"])
-            self.outputData = self.outputData.drop_duplicates("time").unstack()
-
-            # Finalize dataset
-            self.outputData = self.outputData.rename_vars({"time_temp": "time"})
-            self.outputData = self.outputData.drop_vars(
-                ["scan_start_time", "deltaTime"]
+            # Position of each sample on the beamID-scanID grid
+            beamID = self.outputData.beamID.values
+            scanID = self.outputData.scanID.values
+            sel = np.where(self.valid_time & ~np.isnan(beamID + scanID))[0]
+            beams, beam_index = np.unique(beamID[sel], return_inverse=True)
+            scans, scan_index = np.unique(scanID[sel], return_inverse=True)
+
+            # Keep the first sample of duplicated beamID-scanID pairs
+            _, first = np.unique(beam_index * len(scans) + scan_index, return_index=True)
+            sel, beam_index, scan_index = sel[first], beam_index[first], scan_index[first]
+
+            # Reindex (time dimension scattered into beamID and scanID, time information kept as a variable)
+            ds = xr.Dataset(coords={"beamID": beams, "scanID": scans}, attrs=self.outputData.attrs)
+            for c in self.outputData.coords:
+                if "time" not in self.outputData[c].dims:
+                    ds.coords[c] = self.outputData[c]
+            variables = {v: self.outputData[v] for v in self.outputData.data_vars}
+            variables["time"] = self.outputData["time"].reset_coords(drop=True)
+            for v, var in variables.items():
+                if v in ["beamID", "scanID", "scan_start_time", "deltaTime"]:
+                    continue
+                if "time" not in var.dims:
+                    ds[v] = var
+                    continue
+                dims = [d for d in var.dims if d != "time"]
+                values = var.transpose(*dims, "time").values
+                dtype, fill_value = utilities.nullable_dtype(values.dtype)
+                grid = np.full(values.shape[:-1] + (len(beams), len(scans)), fill_value, dtype=dtype)
+                grid[..., beam_index, scan_index] = values[..., sel]
+                ds[v] = xr.DataArray(grid, dims=dims + ["beamID", "scanID"], attrs=var.attrs)
+
+            # Cartesian coordinates, per beam as (range, beamID) if the beams repeat across scans
+            dtype = self.config.precision
+            distance = ds["range"].values.astype(dtype)
+            azimuth = ds["azimuth"].values.astype(dtype)
+            elevation = ds["elevation"].values.astype(dtype)
+            repeated = np.all(np.nanmax(azimuth, axis=1) == np.nanmin(azimuth, axis=1)) and np.all(
+                np.nanmax(elevation, axis=1) == np.nanmin(elevation, axis=1)
             )
-
-            self.outputData = utilities.dropDuplicatedCoords(self.outputData)
+            if repeated:
+                xyz = utilities.lidar_xyz(
+                    distance[:, None], np.nanmax(elevation, axis=1)[None, :], np.nanmax(azimuth, axis=1)[None, :]
+                )
+                dims = ["range", "beamID"]
+            else:
+                xyz = utilities.lidar_xyz(distance[:, None, None], elevation[None], azimuth[None])
+                dims = ["range", "beamID", "scanID"]
+            for v, values in zip(["x", "y", "z"], xyz):
+                ds[v] = xr.DataArray(values, dims=dims)
+
+            self.outputData = utilities.dropDuplicatedCoords(ds)
 
         except ValueError as e:
             self.logger.log(f"Dataset is not initialized: {str(e)}", level="error")
@@ -847,8 +1200,8 @@ class Standardize:
         """
         Identify the type of scan, which is useful for plotting
         """
-        azi = self.outputData["azimuth"].values
-        ele = self.outputData["elevation"].values
+        azi = self.outputData["azimuth"].values[self.valid_time]
+        ele = self.outputData["elevation"].values[self.valid_time]
 
         azimuth_variation = np.abs(np.nanmax(np.tan(azi)) - np.nanmin(np.tan(azi)))
         elevation_variation = np.abs(np.nanmax(np.cos(ele)) - np.nanmin(np.cos(ele)))
@@ -908,6 +1261,183 @@ class Standardize:
             if anghist_fig is not None:
                 anghist_fig.savefig(self.save_filename[:-2]+"angHist." + filetype)
                 plt.close(anghist_fig)
+
+
+class StandardizeStream:
+    def __init__(
+        self,
+        config: Union[str, dict, LidarConfigStand],
+        verbose: bool = True,
+        logger: Optional[object] = None,
+        logfile=None,
+        history: int = 24,
+    ):
+        """
+        Initialize the standardization of a stream of consecutive input-level files of the same scan.
+
+        State is carried from one file to the next: the detected beams, the beam starting each scan, the scan
+        counter, the raw samples of the scan still open at the end of the last file, and rolling QC statistics.
+        Each file emits the scans that closed in it (including the one started in the previous file), so scans
+        are neither lost nor split at file boundaries and earlier files are never reopened.
+
+        Args:
+            config (str, dict, or LidarConfig): Either a path to an Excel config file, a dictionary of configuration parameters, or a LidarConfig object
+            verbose (bool, optional): Whether to print QC-related information. Defaults to True.
+            logger (Logger, optional): Logger instance for logging messages. Defaults to None.
+            history (int, optional): Number of files in the rolling QC statistics. Defaults to 24.
+        """
+        self.logger = get_logger(verbose=verbose, logger=logger, filename=logfile)
+        self.config = config
+        self.verbose = verbose
+
+        # State carried between files
+        self.azimuth_detected = None
+        self.elevation_detected = None
+        self.counts = None
+        self.first_beam = None
+        self.scan_counter = 0
+        self.open_scan = None
+        self.source = None
+        self.qc_history = deque(maxlen=history)
+
+    @with_logging
+    def process_file(
+        self, source: str, save_file=True, save_path=None, make_figures=False, save_figures=True
+    ):
+        """
+        Standardize the next file of the stream, emitting the scans closed in it.
+
+        Inputs:
+        -------
+        source: str
+            input-level file, following the previous one in time
+        save_file: bool
+            Whether or not save the processed scans
+        save_path: str
+            String with the directory the destination of the processed files.
+            Optional, defaults to analogous input, replacing input-level with output-level
+            data. Creates the necessary intermediate directories
+        make_figures: bool
+            Whether or not generate QC figures
+        save_figures: bool
+            Whether or not save QC figures
+
+        Outputs:
+        -------
+        outputData: xarray.Dataset
+            standardized data of the closed scans, or None if no scan closed
+        """
+        lproc = Standardize(source, config=self.config, verbose=self.verbose, logger=self.logger)
+        if "inputData" not in dir(lproc):
+            self.logger.log(f"No data available. Skipping file {os.path.basename(source)}")
+            return None
+        lproc.rename_input()
+
+        # Prepend the samples of the open scan (kept only if the file follows it)
+        if self.open_scan is not None:
+            if lproc.inputData.time.values[0] > self.open_scan.time.values[-1]:
+                lproc.inputData = xr.concat(
+                    [self.open_scan, lproc.inputData], dim="time", data_vars="minimal", coords="minimal", compat="override"
+                )
+            else:
+                self.logger.log(f"WARNING: {os.path.basename(source)} does not follow the open scan, dropping it")
+            self.open_scan = None
+        self.source = source
+
+        return self.process(lproc, final=False, save_file=save_file, save_path=save_path,
+                            make_figures=make_figures, save_figures=save_figures)
+
+    @with_logging
+    def close(self, save_file=True, save_path=None, make_figures=False, save_figures=True):
+        """
+        End the stream, emitting the scan still open as it is. Same inputs and outputs as process_file.
+
+        The output file is named after the last file of the stream with the time stamp of the start of the open scan.
+        """
+        if self.open_scan is None:
+            return None
+        start = pd.Timestamp(self.open_scan.time.values[0]).strftime("%Y%m%d.%H%M%S")
+        source = re.sub(r"\d{8}\.\d{6}", start, self.source)
+        lproc = Standardize(source, config=self.config, verbose=self.verbose, logger=self.logger, data=self.open_scan)
+        self.open_scan = None
+
+        return self.process(lproc, final=True, save_file=save_file, save_path=save_path,
+                            make_figures=make_figures, save_figures=save_figures)
+
+    def process(self, lproc, final, save_file, save_path, make_figures, save_figures):
+        """
+        Run the standardization of the data of a Standardize instance with the state of the stream, then update the
+        state. Unless final, the last scan is held as open scan.
+        """
+        raw_vars = list(lproc.inputData.data_vars)
+        raw_angles = {v: lproc.inputData[v].values.copy() for v in ["azimuth", "elevation"]}
+
+        if not lproc.check_data():
+            return None
+        lproc.remove_back_swipe()
+        if self.azimuth_detected is None:
+            lproc.bin_and_count_angles()
+            self.azimuth_detected = lproc.azimuth_detected.copy()
+            self.elevation_detected = lproc.elevation_detected.copy()
+            self.counts = lproc.counts.copy()
+        else:
+            lproc.azimuth_detected = self.azimuth_detected.copy()
+            lproc.elevation_detected = self.elevation_detected.copy()
+            lproc.counts = self.counts.copy()
+        lproc.update_angles_to_nominal()
+        lproc.filter_scan_data()
+        lproc.calculate_repetition_number(first_beam=self.first_beam)
+        self.first_beam = lproc.first_beam
+
+        # Hold the last scan, which may continue in the next file (from its first sample, since scan_start_time
+        # is rounded through floats)
+        scanID = lproc.outputData["scanID"].values
+        if not final and np.any(scanID >= 0):
+            last_start = lproc.outputData.time.values[scanID == np.max(scanID)].min()
+            held = np.where(lproc.inputData.time.values >= last_start)[0]
+            self.open_scan = lproc.inputData[raw_vars].isel(time=held).load()
+            for v in ["azimuth", "elevation"]:
+                self.open_scan[v].values = raw_angles[v][held]
+            lproc.valid_time = lproc.valid_time & (lproc.outputData.time.values < last_start)
+
+        # Continue the scan numbering of the previous files
+        emitted = lproc.valid_time & (scanID >= 0)
+        lproc.outputData["scanID"].values = np.where(scanID >= 0, scanID + self.scan_counter, scanID)
+        if emitted.any():
+            self.scan_counter += int(np.max(scanID[emitted])) + 1
+
+        # Rolling QC statistics
+        qc = lproc.outputData["qc_wind_speed"].values
+        self.qc_history.append(
+            {
+                "source": os.path.basename(lproc.source),
+                "rws_min": lproc.rws_min,
+                "probability_threshold": lproc.qc_probability_threshold,
+                "retained": np.sum(qc == 0) / np.sum(~np.isnan(qc)),
+            }
+        )
+        self.logger.log(
+            f"Rolling QC: {np.round(100*np.mean([h['retained'] for h in self.qc_history]),2)}% retained over the last {len(self.qc_history)} files"
+        )
+
+        if not emitted.any():
+            self.logger.log(f"No scan closed in {os.path.basename(lproc.source)}")
+            return None
+
+        lproc.save_filename = lproc.output_filename(save_path)
+        lproc.calculate_beam_number()
+        lproc.identify_scan_mode()
+        lproc.reindex_scan()
+        lproc.add_attributes()
+
+        if make_figures:
+            lproc.qc_report(save_figures)
+
+        if save_file:
+            lproc.save_output()
+
+        return lproc.outputData
+
                 
 if __name__ == "__main__":
     """
@@ -8,10 +8,11 @@ from matplotlib.patches import Circle
 from matplotlib import pyplot as plt
 
 from . import utilities
+from .config import ENCODING_PROFILES
 
 
 class Statistics:
-    def __init__(self, source, config_file, verbose=True, logger=None):
+    def __init__(self, source, config_file, verbose=True, logger=None, load=True):
         """
         Initialize the LIDAR data processor with configuration parameters.
 
@@ -23,6 +24,9 @@ class Statistics:
             The configuration file
         verbose: bool
             Whether or not print LiSBOA output
+        load: bool
+            Whether or not load the input data at initialization. If False, they are loaded by process_scan,
+            after checking whether the output already exists
         """
 
         plt.close("all")
@@ -51,6 +55,13 @@ class Statistics:
             return
 
         config = configs[matches[0]].to_dict()
+
+        # validate the output settings, which are only used when saving
+        encoding_profile = config.get("encoding_profile", "default")
+        if encoding_profile not in ENCODING_PROFILES:
+            raise ValueError(f"encoding_profile must be one of {list(ENCODING_PROFILES)}, got {encoding_profile}")
+        if config.get("precision", "float64") not in ["float64", "float32"]:
+            raise ValueError(f"precision must be one of ['float64', 'float32'], got {config['precision']}")
         self.config = config
 
         # Dynamically assign attributes from the dictionary
@@ -58,6 +69,13 @@ class Statistics:
             setattr(self, key, value)
 
         # load data
+        if load:
+            self.load_input()
+
+    def load_input(self):
+        """
+        Load the input data
+        """
         self.inputData = xr.open_dataset(self.source)
 
     def print_and_log(self, message):
@@ -100,18 +118,9 @@ class Statistics:
             return False
 
         # Compose filename
-        save_filename = ("." + self.data_level_out + ".").join(
-            self.source.split("." + self.data_level_in + ".")
-        )
-
-        if save_path is not None:
-            save_filename = os.path.join(save_path, os.path.basename(save_filename))
-
+        save_filename = self.output_filename(save_path)
         self.save_filename = save_filename
 
-        if os.path.exists(os.path.dirname(save_filename)) == False:
-            os.makedirs(os.path.dirname(save_filename))
-
         if save_file and not replace and os.path.isfile(save_filename):
             self.print_and_log(f"Processed file {save_filename} exists, skipping it")
             return False
@@ -120,15 +129,39 @@ class Statistics:
                 f"Generating statistics file {os.path.basename(save_filename)}"
             )
 
+        # Load data, if not loaded at initialization
+        if "inputData" not in dir(self):
+            self.load_input()
+
         self.statistics()
 
         if make_figures:
             self.plots()
 
         if save_file:
-            self.outputData.to_netcdf(save_filename)
+            self.outputData.to_netcdf(
+                save_filename,
+                encoding=utilities.get_encoding(self.outputData, self.config.get("encoding_profile", "default")),
+            )
             self.print_and_log(f"Statistics file saved as {save_filename}")
 
+    def output_filename(self, save_path=None):
+        """
+        Name of the output file, analogous to the input replacing input-level with output-level data, in save_path
+        if given. Creates the necessary intermediate directories
+        """
+        save_filename = ("." + self.data_level_out + ".").join(
+            self.source.split("." + self.data_level_in + ".")
+        )
+
+        if save_path is not None:
+            save_filename = os.path.join(save_path, os.path.basename(save_filename))
+
+        if os.path.exists(os.path.dirname(save_filename)) == False:
+            os.makedirs(os.path.dirname(save_filename))
+
+        return save_filename
+
     def statistics(self):
         """
         Calculate mean and standard deviation of de-projected wind speed through LiSBOA (Letizia et al., AMT, 2021)
@@ -181,6 +214,7 @@ class Statistics:
             tol_dist=0.1,
             max_Dd=1,
             verbose=self.verbose,
+            dtype=self.config.get("precision", "float64"),
         )
 
         # Extract statistics
@@ -808,6 +842,7 @@ def LiSBOA(
     tol_dist=0.1,
     max_Dd=1,
     verbose=True,
+    dtype="float64",
 ):
     """
     Lidar Statistical Barnes Objective Analysis (Letizia et al., AMT, 2021)
@@ -842,6 +877,8 @@ def LiSBOA(
         maximum non-dimensional local spacing of points
     verbose: bool
         whether to print debug information
+    dtype: str
+        precision of the normalized coordinates and stored weights (weighted sums are always accumulated in float64)
 
     Outputs:
     -----
@@ -883,7 +920,7 @@ def LiSBOA(
     n_eff = np.sum(Dn0 > 0)
     Dn0[Dn0 == 0] = 10**99
     N = len(x_exp[0])
-    x = np.zeros((n, N))
+    x = np.zeros((n, N), dtype=dtype)
     xc = np.zeros(n)
     X_bin = []
     X_vec = []
@@ -897,7 +934,7 @@ def LiSBOA(
     V = np.pi ** (n_eff / 2) / gamma(n_eff / 2 + 1) * R_max**n_eff
 
     for j in range(n):
-        xc[j] = np.nanmean(x_exp[j])
+        xc[j] = np.nanmean(x_exp[j], dtype=np.float64)
         x[j] = (x_exp[j] - xc[j]) / Dn0[j]
         X_bin.append(
             (
@@ -935,7 +972,7 @@ def LiSBOA(
             distSq += (x[j] - X[j][i]) ** 2
         s = np.where(distSq < R_max**2)
         if len(s) > 0:
-            w[i] = np.exp(-distSq[s] / (2 * sigma**2))
+            w[i] = np.exp(-distSq[s] / (2 * sigma**2)).astype(dtype, copy=False)
 
         # local spacing
         if Dd[i] != 10:
@@ -998,7 +1035,7 @@ def LiSBOA(
                 val[i] = f[s]
                 if not excl[i]:
                     fs = np.array(df[sel[i]])
-                    ws = np.array(w[i])
+                    ws = np.array(w[i], dtype=np.float64)
                     reals = ~np.isnan(fs + ws)
                     if sum(reals) > 0:
                         fs = fs[reals]
@@ -1030,17 +1067,17 @@ def local_probability(df, config):
 
     Inputs:
     -----
-    df: dataframe
-        dataframe of data and current QC flag
+    df: dict or dataframe
+        column arrays of data and current QC flag
 
     config: dict
         configuration
 
     Outputs:
     -----
-    filt: dataframe
+    filt: array of bools
         QC flag
-    df: dataframe
+    df: dict or dataframe
         data
     rws_range: series
         normalized radial wind speed range vs. probability
@@ -1049,53 +1086,65 @@ def local_probability(df, config):
     """
 
     # Set up bin sizes
-    df["rws_filt"] = df["rws_norm"].where(df["filtered_temp"])
-    df["snr_filt"] = df["snr_norm"].where(df["filtered_temp"])
+    df["rws_filt"] = np.where(df["filtered_temp"], df["rws_norm"], np.nan)
+    df["snr_filt"] = np.where(df["filtered_temp"], df["snr_norm"], np.nan)
+    rws_filt = np.asarray(df["rws_filt"])
+    snr_filt = np.asarray(df["snr_filt"])
     delta_rws = (
         3.49
-        * df["rws_filt"].std()
-        / np.sum(~np.isnan(df["rws_filt"].unique())) ** (1 / 3)
+        * pd.Series(rws_filt, dtype=np.float64).std()
+        / len(np.unique(rws_filt[~np.isnan(rws_filt)])) ** (1 / 3)
     )
     eps = 10**-10
 
     rws_bins = np.arange(
-        np.floor(df["rws_filt"].min() / delta_rws) * delta_rws,
-        np.ceil(df["rws_filt"].max() / delta_rws) * delta_rws + eps,
+        np.floor(np.nanmin(rws_filt) / delta_rws) * delta_rws,
+        np.ceil(np.nanmax(rws_filt) / delta_rws) * delta_rws + eps,
         delta_rws,
     )
 
     delta_snr = (
         3.49
-        * df["snr_filt"].std()
-        / np.sum(~np.isnan(df["snr_filt"].unique())) ** (1 / 3)
+        * pd.Series(snr_filt, dtype=np.float64).std()
+        / len(np.unique(snr_filt[~np.isnan(snr_filt)])) ** (1 / 3)
     )
     snr_bins = np.arange(
-        np.floor(df["snr_filt"].min() / delta_snr) * delta_snr,
-        np.ceil(df["snr_filt"].max() / delta_snr) * delta_snr + eps,
+        np.floor(np.nanmin(snr_filt) / delta_snr) * delta_snr,
+        np.ceil(np.nanmax(snr_filt) / delta_snr) * delta_snr + eps,
         delta_snr,
     )
 
-    # Calculate 2-D pdf
-    df["rws_bins"] = pd.cut(df["rws_filt"], rws_bins)
-    df["snr_bins"] = pd.cut(df["snr_filt"], snr_bins)
-    groups = df.groupby(["rws_bins", "snr_bins"], observed=True)
-    count = groups["rws_filt"].count()
+    # Calculate 2-D pdf (right-closed bins, as pd.cut)
+    rws_index = utilities.cut_index(rws_filt, rws_bins)
+    snr_index = utilities.cut_index(snr_filt, snr_bins)
+    valid = (rws_index >= 0) & (snr_index >= 0)
+    bin_code = rws_index * (len(snr_bins) - 1) + snr_index
+    count = np.bincount(bin_code[valid], minlength=(len(rws_bins) - 1) * (len(snr_bins) - 1))
 
-    temp = df.set_index(["rws_bins", "snr_bins"]).copy()
-    temp["probability"] = count / count.max()
-    df["probability"] = temp["probability"].reset_index(drop=True)
+    probability = np.full(len(rws_filt), np.nan, dtype=rws_filt.dtype)
+    probability[valid] = count[bin_code[valid]] / count.max()
+    df["probability"] = probability
 
     # Identify probability threshold that excludes data with large scattering
     probability_bins = np.linspace(
-        np.log10(df["probability"].min() + eps) - 1,
-        np.log10(df["probability"].max()),
+        np.log10(np.nanmin(probability) + eps) - 1,
+        np.log10(np.nanmax(probability)),
         config.N_probability_bins,
     )
-    df["probability_bins"] = pd.cut(np.log10(df["probability"]), probability_bins)
-    groups = df.groupby(["probability_bins"], observed=True)
-    rws_range = groups["rws_norm"].apply(
-        lambda x: np.nanpercentile(x, config.max_percentile)
-        - np.nanpercentile(x, config.min_percentile)
+    probability_index = utilities.cut_index(np.log10(probability), probability_bins)
+    valid = probability_index >= 0
+    observed, percentiles = utilities.grouped_percentile(
+        probability_index[valid],
+        np.asarray(df["rws_norm"])[valid],
+        [config.max_percentile, config.min_percentile],
+    )
+    intervals = pd.cut([], probability_bins).categories  # interval labels as formatted by pd.cut
+    rws_range = pd.Series(
+        data=percentiles[0] - percentiles[1],
+        index=pd.CategoricalIndex(
+            intervals[observed], categories=intervals, ordered=True, name="probability_bins"
+        ),
+        name="rws_norm",
     )
     max_rws_range = rws_range.min() + config.rws_norm_increase_limit * (
         rws_range.max() - rws_range.min()
@@ -1109,7 +1158,7 @@ def local_probability(df, config):
     if probability_threshold > config.max_probability_range:
         probability_threshold = config.max_probability_range
 
-    filt = df["probability"] > probability_threshold
+    filt = probability > probability_threshold
 
     return filt, df, rws_range, probability_threshold
 
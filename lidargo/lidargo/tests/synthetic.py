@@ -0,0 +1,149 @@
+"""
+Synthetic lidar data for the tests (no measured data are shipped with the package)
+"""
+import os
+import numpy as np
+
+CONFIG_FORMAT = {"model": "halo", "site": "sc1", "instrument_id": 1}
+
+CONFIG_STAND = {
+    "project": "test",
+    "name": "ppi",
+    "range_min": 30.0,
+    "range_max": 2000.0,
+    "data_level_in": "a0",
+    "data_level_out": "b0",
+    "azimuth_offset": 0,
+    "rename_vars": "{}",
+    "rename_attrs": "{}",
+}
+
+
+def write_hpl(
+    path, n_scans=10, n_beams=20, n_gates=50, start=1.0341667, date="20240301", user=5, seed=0, outliers=0.1,
+    ray_time=0.5, extra_gate_fields=0,
+):
+    """
+    Write a Halo .hpl file of PPI scans (n_beams beams 1 degree apart followed by 3 back-swipe rays), with RWS
+    around 5 m/s plus a fraction of outliers uniform over the bandwidth. Times past midnight wrap to 0 as in the
+    instrument files.
+
+    Inputs:
+    ------
+    path: str
+        directory of the file, named after the instrument convention (e.g. User5_257_20240301_010203.hpl)
+    start: float
+        decimal hour of the first ray
+    ray_time: float
+        seconds between rays
+    extra_gate_fields: int
+        number of additional columns per gate (as written by some firmware versions)
+
+    Outputs:
+    -------
+    filename: str
+        name of the file
+    """
+    rng = np.random.default_rng(seed)
+    hours = int(start)
+    minutes = int((start - hours) * 60)
+    seconds = int(round(((start - hours) * 60 - minutes) * 60))
+    name = f"User{user}_257_{date}_{hours:02d}{minutes:02d}{seconds:02d}"
+    n_rays = n_scans * (n_beams + 3)
+    gate_format = "i3,1x,f6.4,1x,f8.6,1x,e12.6" + ",1x,f6.4" * extra_gate_fields
+    lines = [
+        f"Filename:\t{name}",
+        "System ID:\t257",
+        f"Number of gates:\t{n_gates}",
+        "Range gate length (m):\t30.0",
+        "Gate length (pts):\t10",
+        "Pulses/ray:\t10000",
+        f"No. of rays in file:\t{n_rays}",
+        f"Scan type:\tUser file {user} - csm",
+        "Focus range:\t65535",
+        f"Start time:\t{date} {hours:02d}:{minutes:02d}:{seconds:02d}.00",
+        "Resolution (m/s):\t0.0382",
+        "Altitude of measurement (center of gate) = (range gate + 0.5) * Gate length",
+        "Data line 1: Decimal time (hours)  Azimuth (degrees)  Elevation (degrees) Pitch (degrees) Roll (degrees)",
+        "f9.6,1x,f6.2,1x,f6.2",
+        "Data line 2: Range Gate  Doppler (m/s)  Intensity (SNR + 1)  Beta (m-1 sr-1)"
+        + "  Spectral width (m/s)" * extra_gate_fields,
+        f"{gate_format} - repeat for no. gates",
+        "****",
+    ]
+    out = [line + "\r\n" for line in lines]
+    for i in range(n_rays):
+        t = (start + i * ray_time / 3600) % 24
+        b = i % (n_beams + 3)
+        if b < n_beams:
+            azimuth = 200 + b + rng.normal(0, 0.01)
+        else:
+            azimuth = 200 + (n_beams - 1) * (1 - (b - n_beams + 1) / 3)
+        out.append(" %9.6f %6.2f %6.2f %5.2f %5.2f\r\n" % (t, azimuth % 360, 3.0, 0.1, -0.2))
+        for g in range(n_gates):
+            ws = rng.normal(5, 1) if rng.random() > outliers else rng.uniform(-19, 19)
+            intensity = 1 + 10 ** rng.normal(-1.5, 0.5)
+            extra = "".join(" %6.4f" % rng.uniform(0, 2) for _ in range(extra_gate_fields))
+            out.append("%3d %7.4f %8.6f %12.6E%s\r\n" % (g, ws, intensity, rng.uniform(1e-7, 1e-5), extra))
+
+    filename = os.path.join(path, name + ".hpl")
+    with open(filename, "w", newline="") as f:
+        f.write("".join(out))
+    return filename
+
+
+def format_hpl(filename, save_path, **config):
+    """
+    Format a raw file into an a0-level file in save_path and return its name
+    """
+    import lidargo as lg
+
+    lproc = lg.Format(filename, config=dict(CONFIG_FORMAT, **config), verbose=False)
+    lproc.process_scan(save_path=save_path, make_figures=False)
+    return lproc.save_filename
+
+
+def write_windcube(path, n_sweeps=3, n_times=40, n_ranges=30, range_step=None, seed=0):
+    """
+    Write a WindCube 200S file of PPI sweeps, one group per sweep as in the instrument files
+
+    Inputs:
+    ------
+    range_step: list
+        range gate length in meters of each sweep (optional, defaults to 25 m for all sweeps)
+
+    Outputs:
+    -------
+    filename: str
+        name of the file
+    """
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    range_step = [25.0] * n_sweeps if range_step is None else range_step
+    filename = os.path.join(path, "WLS200s-197_2024-03-01_01-00-00_ppi_34_50m.nc")
+    names = [f"sweep_{i}" for i in range(n_sweeps)]
+    xr.Dataset({"sweep_group_name": (("sweep",), np.array(names, dtype=object))}).to_netcdf(filename, mode="w")
+    shape = (n_times, n_ranges)
+    for k, name in enumerate(names):
+        sweep = xr.Dataset(
+            {
+                "radial_wind_speed": (("time", "range"), rng.normal(5, 2, shape).astype("float32")),
+                "cnr": (("time", "range"), rng.normal(-20, 5, shape).astype("float32")),
+                "atmospherical_structures_type": (("time", "range"), rng.integers(0, 3, shape).astype("int8")),
+                "doppler_spectrum_mean_error": (("time", "range"), rng.random(shape).astype("float32")),
+                "doppler_spectrum_width": (("time", "range"), rng.random(shape).astype("float32")),
+                "radial_wind_speed_ci": (("time", "range"), rng.random(shape).astype("float32")),
+                "radial_wind_speed_status": (("time", "range"), rng.integers(0, 2, shape).astype("int8")),
+                "gate_index": (("range",), np.arange(n_ranges).astype("int32")),
+                "azimuth": (("time",), (200 + np.arange(n_times) % 20).astype("float32")),
+                "elevation": (("time",), np.full(n_times, 3.0, dtype="float32")),
+                "time_reference": ((), "1970-01-01T00:00:00Z"),
+            },
+            coords={
+                "time": ("time", 1.7093e9 + (k * n_times + np.arange(n_times)) * 0.5, {"units": "seconds since 1970-01-01T00:00:00Z"}),
+                "range": ("range", 50 + np.arange(n_ranges) * range_step[k], {"units": "m"}),
+            },
+        )
+        sweep.to_netcdf(filename, mode="a", group=name)
+    return filename
@@ -0,0 +1,42 @@
+"""
+ParseCache of parsed raw files against parsing without cache
+"""
+import os
+import xarray as xr
+import lidargo as lg
+from lidargo.cache import ParseCache
+from synthetic import write_hpl, write_windcube, CONFIG_FORMAT
+
+
+def test_cached_halo(tmp_path):
+    source = write_hpl(tmp_path, n_scans=2)
+    cache = ParseCache(os.path.join(tmp_path, "cache"))
+    reference = lg.Format(source, config=CONFIG_FORMAT, verbose=False).read_halo_xr(source)
+
+    lproc = lg.Format(source, config=CONFIG_FORMAT, verbose=False, cache=cache)
+    parsed = lproc.read_halo_xr(source)
+    assert len(cache._entries()) == 1
+    cached = lproc.read_halo_xr(source)
+    xr.testing.assert_identical(parsed, reference)
+    xr.testing.assert_identical(cached, reference)
+
+    # a modified file is parsed again
+    write_hpl(tmp_path, n_scans=3)
+    assert lproc.read_halo_xr(source).sizes["time"] == 3 * 23
+    assert len(cache._entries()) == 2
+
+
+def test_cached_windcube(tmp_path):
+    source = write_windcube(tmp_path)
+    config = dict(CONFIG_FORMAT, model="windcube")
+    reference = lg.Format(source, config=config, verbose=False).read_windcube_200s(source)
+    lproc = lg.Format(source, config=config, verbose=False, cache=os.path.join(tmp_path, "cache"))
+    lproc.read_windcube_200s(source)
+    xr.testing.assert_identical(lproc.read_windcube_200s(source), reference)
+
+
+def test_cache_size_cap(tmp_path):
+    cache = ParseCache(os.path.join(tmp_path, "cache"), max_size=0)
+    source = write_hpl(tmp_path, n_scans=1)
+    lg.Format(source, config=CONFIG_FORMAT, verbose=False, cache=cache).read_halo_xr(source)
+    assert cache.size() == 0
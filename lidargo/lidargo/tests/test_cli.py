@@ -0,0 +1,45 @@
+"""
+Batch processing of the lidargo command against processing the files one by one
+"""
+import os
+import json
+import xarray as xr
+from lidargo import cli
+from synthetic import write_hpl, format_hpl, CONFIG_FORMAT, CONFIG_STAND
+
+
+def test_select_files(tmp_path):
+    sources = [write_hpl(tmp_path, n_scans=1, start=start, date=date) for date in ["20240301", "20240302"] for start in [1.0, 2.0]]
+    stare = os.path.join(tmp_path, "Stare_194_20240301_01.hpl")
+    os.rename(write_hpl(tmp_path, n_scans=1, start=1.5), stare)
+    pattern = [os.path.join(tmp_path, "*.hpl")]
+    assert cli.select_files(pattern) == sorted(sources + [stare])
+    assert cli.select_files(pattern, start="20240302") == sorted(sources[2:])
+    assert cli.select_files(pattern, start="20240301.013000", end="20240302.013000") == sorted(sources[1:3])
+    assert cli.select_files(pattern, start="20240301.010000", end="20240301.015959") == sorted([sources[0], stare])
+
+
+def test_batch_format_and_standardize(tmp_path):
+    sources = [write_hpl(tmp_path, n_scans=2, start=start) for start in [1.0, 2.0, 3.0]]
+    pattern = [os.path.join(tmp_path, "*.hpl")]
+    manifest = os.path.join(tmp_path, "format.json")
+    entries = cli.run("format", pattern, CONFIG_FORMAT, save_path=os.path.join(tmp_path, "00"), jobs=2, manifest=manifest)
+    assert [e["status"] for e in entries] == ["done"] * 3
+    with open(manifest) as f:
+        assert [e["output"] for e in json.load(f)["files"]] == [e["output"] for e in entries]
+
+    # outputs against formatting the files one by one
+    for source, entry in zip(sources, entries):
+        reference = format_hpl(source, os.path.join(tmp_path, "reference"))
+        xr.testing.assert_identical(xr.load_dataset(entry["output"]), xr.load_dataset(reference))
+
+    # existing outputs are skipped without opening the inputs
+    entries = cli.run("format", pattern, CONFIG_FORMAT, save_path=os.path.join(tmp_path, "00"), manifest=manifest)
+    assert [e["status"] for e in entries] == ["skipped"] * 3
+
+    entries = cli.run(
+        "standardize", [os.path.join(tmp_path, "00", "*.a0.*.nc")], CONFIG_STAND,
+        save_path=os.path.join(tmp_path, "b0"), jobs=2, manifest=os.path.join(tmp_path, "standardize.json"),
+    )
+    assert [e["status"] for e in entries] == ["done"] * 3
+    assert all(os.path.isfile(e["output"]) for e in entries)
@@ -0,0 +1,16 @@
+"""
+Validation of the output settings of the configurations
+"""
+import pytest
+from lidargo.config import LidarConfigFormat, LidarConfigStand
+from synthetic import CONFIG_FORMAT, CONFIG_STAND
+
+
+@pytest.mark.parametrize("config_class, config", [(LidarConfigFormat, CONFIG_FORMAT), (LidarConfigStand, CONFIG_STAND)])
+@pytest.mark.parametrize(
+    "setting",
+    [{"encoding_profile": "zlbi"}, {"precision": "float16"}, {"output_format": "hdf"}, {"zarr_grouping": "hourly"}],
+)
+def test_invalid_output_settings(config_class, config, setting):
+    with pytest.raises(ValueError, match=list(setting)[0]):
+        config_class(**dict(config, **setting)).validate()
@@ -0,0 +1,156 @@
+"""
+Formatting of synthetic Halo files: streamed output against the in-memory path
+"""
+import os
+import re
+import numpy as np
+import pytest
+import xarray as xr
+import lidargo as lg
+from lidargo.format import index_halo, save_halo_index
+from synthetic import write_hpl, write_windcube, CONFIG_FORMAT
+
+
+def format_file(source, save_path, chunk_size=None, config=CONFIG_FORMAT):
+    lproc = lg.Format(source, config=config, verbose=False)
+    lproc.process_scan(save_path=save_path, make_figures=False, chunk_size=chunk_size)
+    return xr.load_dataset(lproc.save_filename)
+
+
+def swap_ray_times(source, i, j, n_gates=50):
+    """
+    Swap the time stamps of two rays of a raw file, so that the rays are no longer in time order
+    """
+    with open(source, "r", newline="") as f:
+        lines = f.readlines()
+    first = lines.index("****\r\n") + 1
+    rows = [first + k * (n_gates + 1) for k in (i, j)]
+    times = [lines[r][:11] for r in rows]
+    lines[rows[0]], lines[rows[1]] = times[1] + lines[rows[0]][11:], times[0] + lines[rows[1]][11:]
+    with open(source, "w", newline="") as f:
+        f.writelines(lines)
+
+
+def test_stream_matches_memory(tmp_path):
+    source = write_hpl(tmp_path, n_scans=4)
+    memory = format_file(source, os.path.join(tmp_path, "memory"))
+    stream = format_file(source, os.path.join(tmp_path, "stream"), chunk_size=7)
+    xr.testing.assert_identical(stream, memory)
+
+
+@pytest.mark.parametrize("profile", ["default", "zlib", "packed"])
+def test_stream_chunks(tmp_path, profile):
+    source = write_hpl(tmp_path, n_scans=4)
+    config = dict(CONFIG_FORMAT, encoding_profile=profile)
+    memory = format_file(source, os.path.join(tmp_path, "memory"), config=config)
+    stream = format_file(source, os.path.join(tmp_path, "stream"), chunk_size=7, config=config)
+    for v in stream.data_vars:
+        if "time" not in stream[v].dims:
+            continue
+        if profile == "default":
+            # contiguous in memory, chunk_size rays per chunk when streamed
+            assert memory[v].encoding.get("contiguous", False)
+            assert stream[v].encoding["chunksizes"] == (7,) + stream[v].shape[1:]
+        else:
+            assert stream[v].encoding["chunksizes"] == memory[v].encoding["chunksizes"]
+
+
+def test_stream_across_midnight(tmp_path):
+    source = write_hpl(tmp_path, n_scans=4, start=23.99)
+    memory = format_file(source, os.path.join(tmp_path, "memory"))
+    stream = format_file(source, os.path.join(tmp_path, "stream"), chunk_size=7)
+    assert memory.time.to_index().is_monotonic_increasing
+    xr.testing.assert_identical(stream, memory)
+
+
+def test_stream_rays_out_of_order(tmp_path):
+    source = write_hpl(tmp_path, n_scans=4)
+    swap_ray_times(source, 3, 40)
+    memory = format_file(source, os.path.join(tmp_path, "memory"))
+    stream = format_file(source, os.path.join(tmp_path, "stream"), chunk_size=7)
+    assert memory.time.to_index().is_monotonic_increasing
+    xr.testing.assert_identical(stream, memory)
+
+
+def reference_rays(source, n_gates=50):
+    """
+    Ray and gate fields of a raw file read line by line (first 5 and 4 fields)
+    """
+    with open(source, "rb") as f:
+        lines = f.read().splitlines()
+    lines = lines[lines.index(b"****") + 1 :]
+    info = np.array([line.split()[:5] for line in lines[:: n_gates + 1]], dtype=float)
+    gates = np.array(
+        [[line.split()[:4] for line in lines[i + 1 : i + n_gates + 1]] for i in range(0, len(lines), n_gates + 1)],
+        dtype=float,
+    )
+    return info, gates
+
+
+@pytest.mark.parametrize("ragged", [False, True])
+def test_parse_extra_gate_fields(tmp_path, ragged):
+    source = write_hpl(tmp_path, n_scans=2, extra_gate_fields=1)
+    if ragged:
+        # one gate line without the additional field
+        with open(source, "rb") as f:
+            data = f.read()
+        with open(source, "wb") as f:
+            f.write(re.sub(rb"( 0 +\S+ +\S+ +\S+) +\S+\r\n", rb"\1\r\n", data, count=1))
+    info, gates = reference_rays(source)
+
+    lproc = lg.Format(source, config=CONFIG_FORMAT, verbose=False)
+    data = lproc.read_halo_xr(source)
+    np.testing.assert_allclose(data.azimuth.values, info[:, 1])
+    np.testing.assert_allclose(data.wind_speed.values, gates[:, :, 1], rtol=1e-6)
+    np.testing.assert_allclose(data.beta.values, gates[:, :, 3], rtol=1e-6)
+
+    # indexed reading of a subset of the rays
+    subset = lproc.read_halo_rays_xr(source, time_range=(data.time.values[5], data.time.values[20]))
+    xr.testing.assert_identical(subset.drop_attrs(), data.isel(time=slice(5, 21)).drop_attrs())
+
+
+def test_windcube_sweeps(tmp_path):
+    source = write_windcube(tmp_path)
+    lproc = lg.Format(source, config=dict(CONFIG_FORMAT, model="windcube"), verbose=False)
+    data = lproc.read_windcube_200s(source)
+    sweeps = [xr.load_dataset(source, group=f"sweep_{i}") for i in range(3)]
+    assert data.sizes["time"] == sum(s.sizes["time"] for s in sweeps)
+    np.testing.assert_array_equal(
+        data.wind_speed.values, np.concatenate([s.radial_wind_speed.values for s in sweeps])
+    )
+    np.testing.assert_array_equal(data.distance.values, sweeps[0].range.values)
+
+
+def test_windcube_sweeps_different_range(tmp_path):
+    source = write_windcube(tmp_path, range_step=[25.0, 25.0, 50.0])
+    lproc = lg.Format(source, config=dict(CONFIG_FORMAT, model="windcube"), verbose=False)
+    with pytest.raises(ValueError, match="sweep_2"):
+        lproc.read_windcube_200s(source)
+
+
+def test_sidecar_index(tmp_path):
+    source = write_hpl(tmp_path, n_scans=3)
+    index = index_halo(source)
+    assert os.path.isfile(source + ".idx.npz")
+    assert len(index["time"]) == 3 * 23
+
+    # the saved index is reused until the file changes
+    stamp = os.stat(source + ".idx.npz").st_mtime_ns
+    index_halo(source)
+    assert os.stat(source + ".idx.npz").st_mtime_ns == stamp
+    write_hpl(tmp_path, n_scans=4)
+    assert len(index_halo(source)["time"]) == 4 * 23
+
+    # an index built with other ray header fields (e.g. by halo_suite) is rebuilt
+    save_halo_index(source, "", 50, 17, [0, 2, 1], index_halo(source)["offset"], np.zeros((4 * 23, 3)))
+    index = index_halo(source)
+    np.testing.assert_array_equal(index["fields"], [0, 1, 2])
+    assert index["azimuth"][0] > 199
+
+    # rays of one beam against the whole file
+    lproc = lg.Format(source, config=CONFIG_FORMAT, verbose=False)
+    data = lproc.read_halo_xr(source)
+    beam = lproc.read_halo_rays_xr(source, beams=[(205, 3)])
+    sel = np.abs(data.azimuth.values - 205) <= 0.25
+    assert beam.sizes["time"] == sel.sum() == 4
+    xr.testing.assert_identical(beam.drop_attrs(), data.isel(time=sel).drop_attrs())
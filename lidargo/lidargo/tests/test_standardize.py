@@ -0,0 +1,51 @@
+"""
+Standardization of synthetic Halo files: QC bitmask and block mode against the in-memory path
+"""
+import os
+import netCDF4
+import numpy as np
+import pytest
+import xarray as xr
+import lidargo as lg
+from synthetic import write_hpl, format_hpl, CONFIG_STAND
+
+PREFILTER = ["range_limit", "ground_limit", "snr_limit", "rws_max", "rws_min"]
+
+
+@pytest.mark.parametrize("profile", ["default", "zlib", "compact", "packed"])
+def test_qc_bitmask(tmp_path, profile):
+    a0 = format_hpl(write_hpl(tmp_path, n_scans=3), os.path.join(tmp_path, "00"))
+    lproc = lg.Standardize(a0, config=dict(CONFIG_STAND, encoding_profile=profile), verbose=False)
+    lproc.process_scan(save_path=os.path.join(tmp_path, "b0"), make_figures=False)
+
+    with netCDF4.Dataset(lproc.save_filename) as nc:
+        assert nc["qc_wind_speed"].dtype == np.uint16
+        assert nc["qc_wind_speed"]._FillValue == 65535
+
+    data = xr.load_dataset(lproc.save_filename)
+    qc = data.qc_wind_speed.values
+    qc = qc[~np.isnan(qc)].astype(np.uint16)
+    for name, bit in lproc.qc_flag.items():
+        assert data.qc_wind_speed.attrs[f"bit_{bit}_description"] == f"Value rejected due to {name} criterion."
+
+    # dynamic criteria only flag data retained by the pre-filter
+    prefilter = sum(1 << (lproc.qc_flag[name] - 1) for name in PREFILTER)
+    prefiltered = qc & prefilter != 0
+    assert prefiltered.any() and (qc[~prefiltered] != 0).any()
+    np.testing.assert_array_equal(qc[prefiltered] & ~np.uint16(prefilter), 0)
+
+
+def test_block_mode_matches_memory(tmp_path):
+    a0 = format_hpl(write_hpl(tmp_path, n_scans=8), os.path.join(tmp_path, "00"))
+    config = dict(CONFIG_STAND, dtime=20.0)
+    memory = lg.Standardize(a0, config=config, verbose=False)
+    memory.process_scan(save_file=False, make_figures=False)
+    block = lg.Standardize(a0, config=dict(config, block_duration=20.0), verbose=False)
+    assert len(block.time_blocks(np.arange(0, 8 * 23 * 0.5))) > 1
+    block.process_scan(save_file=False, make_figures=False)
+
+    assert block.qc_flag == memory.qc_flag
+    assert (memory.outputData.qc_wind_speed >= 1 << len(PREFILTER)).any()
+    assert block.rws_min == memory.rws_min
+    assert block.qc_probability_threshold == memory.qc_probability_threshold
+    xr.testing.assert_identical(block.outputData.drop_attrs(), memory.outputData.drop_attrs())
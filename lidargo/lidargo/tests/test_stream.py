@@ -0,0 +1,71 @@
+"""
+StandardizeStream on a file split mid-scan against the standardization of the whole file
+"""
+import os
+import re
+import numpy as np
+import xarray as xr
+import lidargo as lg
+from synthetic import write_hpl, format_hpl, CONFIG_STAND
+
+
+def split_file(source, path, index):
+    """
+    Split an input-level file at a time index into two files named after their first time stamp
+    """
+    os.makedirs(path, exist_ok=True)
+    data = xr.load_dataset(source)
+    files = []
+    for part in [data.isel(time=slice(None, index)), data.isel(time=slice(index, None))]:
+        stamp = np.datetime_as_string(part.time.values[0], unit="s").replace("-", "").replace("T", ".").replace(":", "")
+        files.append(os.path.join(path, re.sub(r"\d{8}\.\d{6}", stamp, os.path.basename(source))))
+        part.to_netcdf(files[-1])
+    return files
+
+
+def beams_per_scan(ds):
+    return ds.wind_speed.notnull().any("range").sum("beamID").values
+
+
+def test_stream_emits_all_scans(tmp_path):
+    n_scans, n_beams = 6, 20
+    a0 = format_hpl(write_hpl(tmp_path, n_scans=n_scans, n_beams=n_beams), os.path.join(tmp_path, "00"))
+
+    whole = lg.Standardize(a0, config=CONFIG_STAND, verbose=False)
+    whole.process_scan(save_file=False, make_figures=False)
+
+    # split in the middle of the fourth scan
+    files = split_file(a0, os.path.join(tmp_path, "split"), int((n_beams + 3) * 3.5))
+    stream = lg.StandardizeStream(CONFIG_STAND, verbose=False)
+    outputs = [stream.process_file(f, save_file=False) for f in files]
+    outputs.append(stream.close(save_file=False))
+
+    assert outputs[-1] is not None, "close() must emit the scan held at the end of the stream"
+    emitted = [o for o in outputs if o is not None]
+    scanID = np.concatenate([o.scanID.values for o in emitted])
+    np.testing.assert_array_equal(scanID, whole.outputData.scanID.values)
+    np.testing.assert_array_equal(np.concatenate([beams_per_scan(o) for o in emitted]), beams_per_scan(whole.outputData))
+    assert stream.scan_counter == n_scans
+
+
+def test_stream_saves_files(tmp_path):
+    a0 = format_hpl(write_hpl(tmp_path, n_scans=4), os.path.join(tmp_path, "00"))
+    files = split_file(a0, os.path.join(tmp_path, "split"), 50)
+    stream = lg.StandardizeStream(CONFIG_STAND, verbose=False)
+    for f in files:
+        stream.process_file(f, save_path=os.path.join(tmp_path, "b0"))
+    stream.close(save_path=os.path.join(tmp_path, "b0"))
+
+    saved = sorted(os.listdir(os.path.join(tmp_path, "b0")))
+    assert len(saved) == 3
+    scanID = np.concatenate([xr.open_dataset(os.path.join(tmp_path, "b0", f)).scanID.values for f in saved])
+    np.testing.assert_array_equal(scanID, np.arange(4))
+
+
+def test_resonance_on_short_histogram(tmp_path):
+    a0 = format_hpl(write_hpl(tmp_path, n_scans=1), os.path.join(tmp_path, "00"))
+    lproc = lg.Standardize(a0, config=CONFIG_STAND, verbose=False, load=False)
+    count = np.zeros(CONFIG_STAND.get("N_resonance_bins", 50) - 1, dtype=int)
+    count[[10, 20, 30]] = 1
+    assert lproc.fit_resonance(count, 10.0) == 0
+    assert lproc.fit_resonance(np.zeros_like(count), np.nan) == 0
@@ -0,0 +1,159 @@
+"""
+Watch mode on a directory of synthetic Halo files, against the formatting and standardization of each file
+"""
+import os
+import time
+import calendar
+import json
+import glob
+import pytest
+import xarray as xr
+import lidargo as lg
+from concurrent.futures import ThreadPoolExecutor
+from lidargo.watch import Watcher
+from synthetic import write_hpl, format_hpl, CONFIG_FORMAT, CONFIG_STAND
+
+
+def poll_until_idle(watcher, pool, timeout=60):
+    start = time.time()
+    watcher.poll(pool)
+    while (len(watcher.candidates) > 0 or len(watcher.running) > 0) and time.time() - start < timeout:
+        time.sleep(0.05)
+        watcher.poll(pool)
+
+
+def make_watcher(tmp_path, **kwargs):
+    return Watcher(
+        os.path.join(tmp_path, "raw"),
+        CONFIG_FORMAT,
+        CONFIG_STAND,
+        format_path=os.path.join(tmp_path, "00"),
+        standardize_path=os.path.join(tmp_path, "b0"),
+        **dict(dict(settle=0, interval=0, verbose=False), **kwargs),
+    )
+
+
+def test_watch_new_subdirectories(tmp_path):
+    raw = os.path.join(tmp_path, "raw")
+    os.makedirs(os.path.join(raw, "20240301"))
+    first = write_hpl(os.path.join(raw, "20240301"), n_scans=2)
+    watcher = make_watcher(tmp_path)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        poll_until_idle(watcher, pool)
+        # file landing in a new date subdirectory
+        os.makedirs(os.path.join(raw, "20240302"))
+        second = write_hpl(os.path.join(raw, "20240302"), n_scans=2, date="20240302")
+        poll_until_idle(watcher, pool)
+
+    assert sorted(watcher.processed) == sorted([first, second])
+    assert all(p["status"] == "done" for p in watcher.processed.values())
+
+    # standardized output against the formatting and standardization of the file
+    a0 = format_hpl(first, os.path.join(tmp_path, "reference"))
+    lproc = lg.Standardize(a0, config=CONFIG_STAND, verbose=False)
+    lproc.process_scan(save_file=False, make_figures=False)
+    output = xr.load_dataset(watcher.processed[first]["output"])
+    xr.testing.assert_allclose(output.wind_speed, lproc.outputData.wind_speed)
+
+    # a restarted watcher does not reprocess the files in the cursor
+    with open(watcher.cursor) as f:
+        assert sorted(json.load(f)) == sorted([first, second])
+    restarted = make_watcher(tmp_path)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        poll_until_idle(restarted, pool)
+    assert restarted.counts["done"] == 0
+
+
+def test_watch_lists_modified_directories_only(tmp_path, monkeypatch):
+    raw = os.path.join(tmp_path, "raw")
+    for day in ["20240301", "20240302"]:
+        os.makedirs(os.path.join(raw, day))
+    write_hpl(os.path.join(raw, "20240301"), n_scans=1)
+    watcher = make_watcher(tmp_path)
+    assert len(watcher.scan()) == 1
+
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(path) or scandir(path))
+    time.sleep(1.1)
+    watcher.scan()
+    watcher.scan()
+    listed.clear()
+    assert watcher.scan() == set()
+    assert listed == []
+
+    new = write_hpl(os.path.join(raw, "20240302"), n_scans=1, date="20240302")
+    assert watcher.scan() == {new}
+    assert listed == [os.path.join(raw, "20240302")]
+
+
+def test_watch_retries_failed_files(tmp_path):
+    os.makedirs(os.path.join(tmp_path, "raw"))
+    source = os.path.join(tmp_path, "raw", "User5_257_20240301_010203.hpl")
+    with open(source, "w") as f:
+        f.write("not a Halo file\n")
+    watcher = make_watcher(tmp_path, retries=2)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        poll_until_idle(watcher, pool)
+
+    assert watcher.processed[source]["status"] == "failed"
+    assert watcher.processed[source]["attempts"] == 3
+    assert watcher.counts["retried"] == 2
+    assert watcher.counts["failed"] == 1
+
+
+def test_watch_zarr_output(tmp_path):
+    os.makedirs(os.path.join(tmp_path, "raw"))
+    source = write_hpl(os.path.join(tmp_path, "raw"), n_scans=2)
+    watcher = Watcher(
+        os.path.join(tmp_path, "raw"),
+        CONFIG_FORMAT,
+        dict(CONFIG_STAND, output_format="zarr"),
+        format_path=os.path.join(tmp_path, "00"),
+        standardize_path=os.path.join(tmp_path, "b0"),
+        settle=0,
+        verbose=False,
+    )
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        poll_until_idle(watcher, pool)
+    assert watcher.processed[source]["status"] == "done"
+    assert len(glob.glob(os.path.join(tmp_path, "b0", "*.zarr"))) == 1
+
+    with pytest.raises(ValueError, match="output_format"):
+        Watcher(os.path.join(tmp_path, "raw"), dict(CONFIG_FORMAT, output_format="zarr"), CONFIG_STAND, verbose=False)
+
+
+def test_watch_modified_files(tmp_path):
+    os.makedirs(os.path.join(tmp_path, "raw"))
+    source = write_hpl(os.path.join(tmp_path, "raw"), n_scans=2)
+    watcher = make_watcher(tmp_path)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        poll_until_idle(watcher, pool)
+        first = xr.load_dataset(watcher.processed[source]["output"]).sizes["scanID"]
+
+        # the file grows after being processed
+        write_hpl(os.path.join(tmp_path, "raw"), n_scans=4)
+        poll_until_idle(watcher, pool)
+        poll_until_idle(watcher, pool)
+
+    assert watcher.counts["done"] == 2
+    assert (first, xr.load_dataset(watcher.processed[source]["output"]).sizes["scanID"]) == (2, 4)
+
+
+def test_watch_hourly_files(tmp_path):
+    watcher = make_watcher(tmp_path, settle=2)
+    end = calendar.timegm((2024, 3, 1, 2, 0, 0))
+    assert not watcher.closed("Stare_194_20240301_01.hpl", end)
+    assert watcher.closed("Stare_194_20240301_01.hpl", end + 2)
+    assert watcher.closed("User5_257_20240301_010203.hpl", end - 3600)
+
+    # the file of the current hour waits for its end
+    os.makedirs(os.path.join(tmp_path, "raw"))
+    stamp = time.strftime("%Y%m%d_%H", time.gmtime())
+    with open(os.path.join(tmp_path, "raw", f"Stare_194_{stamp}.hpl"), "w") as f:
+        f.write("")
+    watcher = make_watcher(tmp_path)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for _ in range(3):
+            watcher.poll(pool)
+    assert len(watcher.candidates) == 1 and len(watcher.running) == 0
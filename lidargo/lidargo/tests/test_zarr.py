@@ -0,0 +1,47 @@
+"""
+Zarr output appended file by file against the netCDF outputs of the same files
+"""
+import os
+import glob
+import numpy as np
+import xarray as xr
+import lidargo as lg
+from lidargo.utilities import zarr_store_name
+from synthetic import write_hpl, format_hpl, CONFIG_FORMAT, CONFIG_STAND
+
+
+def test_zarr_format_append(tmp_path):
+    sources = [write_hpl(tmp_path, n_scans=2, start=start) for start in [1.0, 2.0]]
+    netcdf = [xr.load_dataset(format_hpl(s, os.path.join(tmp_path, "nc"))) for s in sources]
+    for _ in range(2):
+        for s in sources:
+            lproc = lg.Format(s, config=dict(CONFIG_FORMAT, output_format="zarr"), verbose=False)
+            lproc.process_scan(save_path=os.path.join(tmp_path, "zarr"), make_figures=False)
+
+    # one daily store, with each file appended once
+    store = zarr_store_name(lproc.save_filename, "daily")
+    assert glob.glob(os.path.join(tmp_path, "zarr", "*.zarr")) == [store]
+    data = xr.open_zarr(store).load()
+    expected = xr.concat(netcdf, dim="time", data_vars="minimal")
+    assert data.sizes["time"] == expected.sizes["time"]
+    for v in ["wind_speed", "intensity", "azimuth", "time"]:
+        np.testing.assert_array_equal(data[v].values, expected[v].values)
+
+
+def test_zarr_standardize_append(tmp_path):
+    sources = [write_hpl(tmp_path, n_scans=2, start=start) for start in [1.0, 2.0]]
+    a0 = [format_hpl(s, os.path.join(tmp_path, "00")) for s in sources]
+    netcdf, save_filename = [], None
+    for f in a0:
+        lproc = lg.Standardize(f, config=CONFIG_STAND, verbose=False)
+        lproc.process_scan(save_path=os.path.join(tmp_path, "nc"), make_figures=False)
+        netcdf.append(xr.load_dataset(lproc.save_filename))
+        lproc = lg.Standardize(f, config=dict(CONFIG_STAND, output_format="zarr"), verbose=False)
+        lproc.process_scan(save_path=os.path.join(tmp_path, "zarr"), make_figures=False)
+        save_filename = lproc.save_filename
+
+    # scanID continues across files
+    data = xr.open_zarr(zarr_store_name(save_filename, "daily")).load()
+    np.testing.assert_array_equal(data.scanID.values, np.arange(4))
+    expected = np.concatenate([d.wind_speed.values for d in netcdf], axis=-1)
+    np.testing.assert_array_equal(data.wind_speed.values, expected)
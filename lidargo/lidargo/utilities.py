@@ -11,7 +11,7 @@ from .logger import SingletonLogger
 from functools import wraps
 from dataclasses import is_dataclass, fields, asdict
 import matplotlib.pyplot as plt
-from lidargo.config import LidarConfigFormat,LidarConfigStand
+from lidargo.config import LidarConfigFormat,LidarConfigStand,ENCODING_PROFILES
 import re
 
 def get_logger(
@@ -58,12 +58,35 @@ def lidar_xyz(r, ele, azi):
     Convert spherical to Cartesian coordinates
     """
     R = r
+    cos_ele, sin_ele, cos_azi, sin_azi = direction_cosines(ele, azi)
+
+    X = R * cos_ele * cos_azi
+    Y = R * cos_ele * sin_azi
+    Z = R * sin_ele
+
+    return X, Y, Z
+
+
+def direction_cosines(ele, azi):
+    """
+    Trigonometric table of beams used by lidar_xyz: cos and sin of the elevation and of the azimuth 
+    measured counterclockwise from x
+    """
     A = np.pi / 2 - np.radians(azi)
     E = np.radians(ele)
+    return np.cos(E), np.sin(E), np.cos(A), np.sin(A)
+
+
+def beam_xyz(r, beam, table):
+    """
+    Cartesian coordinates of samples at range r along the beams of index beam in a table of direction_cosines 
+    (same result as lidar_xyz, with trigonometric functions evaluated once per beam)
+    """
+    cos_ele, sin_ele, cos_azi, sin_azi = (t[beam] for t in table)
 
-    X = R * np.cos(E) * np.cos(A)
-    Y = R * np.cos(E) * np.sin(A)
-    Z = R * np.sin(E)
+    X = r * cos_ele * cos_azi
+    Y = r * cos_ele * sin_azi
+    Z = r * sin_ele
 
     return X, Y, Z
 
@@ -71,7 +94,7 @@ def lidar_xyz(r, ele, azi):
 def dropDuplicatedCoords(ds, varsToClean=["x", "y", "z"]):
     """drop duplicated Cartesian coordinate info"""
     dupcoord = []
-    for coord in ds.coords:
+    for coord in ds.x.dims:
         tmp = ds.x.std(dim=coord).mean()
         if tmp < 1e-10:
             dupcoord.append(coord)
@@ -80,32 +103,236 @@ def dropDuplicatedCoords(ds, varsToClean=["x", "y", "z"]):
     return ds.assign(cleanCoords)
 
 
+def get_encoding(ds, profile: str = "default", engine: str = "netcdf", sizes: dict = None) -> dict:
+    """
+    netCDF encoding of the variables of a dataset for a named profile of config.ENCODING_PROFILES, 
+    to be passed to to_netcdf. The default profile keeps the xarray defaults, except for the QC bitmask
+    qc_wind_speed, which is stored as uint16 (fill value 65535) in every profile.
+    With engine="zarr" the encoding is meant for to_zarr: chunks are kept, while the netCDF compression
+    keys are dropped (Zarr stores are compressed by default). Chunks are capped by the dimension sizes of the
+    dataset, or by sizes where given (e.g. the size of the whole file when writing it chunk by chunk).
+    """
+    sizes = {} if sizes is None else sizes
+    settings = ENCODING_PROFILES[profile]
+    integers = {"qc_wind_speed": "uint16", **settings.get("integers", {})}
+    packing = settings.get("packing", {})
+
+    encoding = {}
+    for v in list(ds.data_vars) + [c for c in integers if c in ds.coords]:
+        enc = {}
+        if v in packing:
+            enc.update(packing[v])
+        elif v in integers:
+            enc["dtype"] = integers[v]
+            if v not in ds.coords:
+                enc["_FillValue"] = -1 if np.dtype(integers[v]).kind == "i" else np.iinfo(integers[v]).max
+        elif settings.get("float32", False) and ds[v].dtype.kind == "f":
+            enc["dtype"] = "float32"
+
+        if "compression" in settings and ds[v].ndim > 0:
+            chunks = tuple(
+                max(1, min(settings["chunks"].get(d, size), sizes.get(d, size)))
+                for d, size in zip(ds[v].dims, ds[v].shape)
+            )
+            if engine == "zarr":
+                enc["chunks"] = chunks
+            else:
+                enc.update(settings["compression"])
+                enc["chunksizes"] = chunks
+        if enc:
+            encoding[v] = enc
+
+    return encoding
+
+
+def set_precision(ds, precision: str = "float64"):
+    """
+    Cast the floating-point data variables spanning more than one dimension (e.g. time and range) to the 
+    given precision. One-dimensional variables such as angles and time are kept as they are.
+    """
+    for v in ds.data_vars:
+        if ds[v].ndim > 1 and ds[v].dtype.kind == "f" and ds[v].dtype != precision:
+            ds[v] = ds[v].astype(precision)
+            ds[v].encoding.pop("dtype", None)  # do not cast back when saving
+    return ds
+
+
+def zarr_store_name(save_filename: str, grouping: str = "daily") -> str:
+    """
+    Name of the Zarr store a netCDF output file is appended to. With daily grouping all the files of 
+    the same day share a store (time stamp dropped), with instrument grouping all the files of the 
+    instrument and data level share a store (date and time stamp dropped).
+    """
+    path, name = os.path.split(save_filename)
+    name = re.sub(r"\.nc$", "", name)
+    if grouping == "daily":
+        name = re.sub(r"\.(\d{8})\.\d{6}\.", r".\1.", name, count=1)
+    else:
+        name = re.sub(r"\.\d{8}\.\d{6}\.", ".", name, count=1)
+    return os.path.join(path, name + ".zarr")
+
+
+def append_to_zarr(ds, store: str, dim: str, source: str, encoding: dict = None) -> bool:
+    """
+    Append a dataset to a Zarr store along dim, creating the store on the first write. 
+    Sources already in the store (listed in the appended_sources attribute) are skipped, so 
+    reprocessing a file does not duplicate its data. Numeric coordinates along dim that restart 
+    in every file (e.g. scanID) are offset to continue those already in the store.
+
+    Inputs:
+    ------
+    ds: xarray.Dataset
+        data to append
+    store: str
+        path of the Zarr store
+    dim: str
+        dimension to append along
+    source: str
+        name of the file the data come from
+    encoding: dict
+        encoding used when the store is created (ignored on append)
+
+    Outputs:
+    -------
+    bool
+        True if the data were written, False if the source was already in the store
+    """
+    try:
+        import zarr  # noqa: F401
+    except ImportError:
+        raise ImportError("output_format='zarr' requires the zarr package (pip install zarr)")
+    import json
+    import xarray as xr
+
+    source = os.path.basename(source)
+    ds = ds.copy()
+    for name, value in ds.attrs.items():
+        if isinstance(value, np.generic):
+            ds.attrs[name] = value.item()
+        elif value is None:
+            ds.attrs[name] = ""
+
+    if not os.path.exists(store):
+        ds.attrs["appended_sources"] = json.dumps([source])
+        ds.to_zarr(store, mode="w-", encoding=encoding or {}, consolidated=True)
+        return True
+
+    existing = xr.open_zarr(store, consolidated=True)
+    sources = json.loads(existing.attrs.get("appended_sources", "[]"))
+    if source in sources:
+        existing.close()
+        return False
+
+    if dim in ds.coords and dim in existing.coords and ds[dim].dtype.kind in "iuf":
+        ds = ds.assign_coords({dim: ds[dim] + existing[dim].values.max() + 1})
+    existing.close()
+
+    ds.attrs["appended_sources"] = json.dumps(sources + [source])
+    for v in ds.variables.values():
+        v.encoding = {}
+    ds.to_zarr(store, append_dim=dim, consolidated=True)
+    return True
+
+
+def output_exists(save_filename: str, output_format: str = "netcdf", grouping: str = "daily") -> bool:
+    """
+    Whether an output was already written: the netCDF file exists, or the file is listed among the appended
+    sources of its Zarr store. Only the output (or the store metadata) is accessed, never the input.
+    """
+    if output_format != "zarr":
+        return os.path.isfile(save_filename)
+
+    store = zarr_store_name(save_filename, grouping)
+    if not os.path.exists(store):
+        return False
+    import json
+    import xarray as xr
+
+    with xr.open_zarr(store, consolidated=True) as existing:
+        sources = json.loads(existing.attrs.get("appended_sources", "[]"))
+    return os.path.basename(save_filename) in sources
+
+
 def defineLocalBins(df, config):
     """
     Helper function for making tidy bins based on ranges and bin sizes
     """
 
-    def bins(coord, delta):
-        return np.arange(
-            np.floor(coord.min()) - delta / 2,
-            np.ceil(coord.max()) + delta,
-            delta,
-        )
-
     keys = [field.name for field in fields(config)]
 
     if "dx" in keys:
-        df["xbins"] = pd.cut(df.x, bins(df.x, config.dx))
+        df["xbins"] = pd.cut(df.x, _local_bin_edges(df.x, config.dx))
     if "dy" in keys:
-        df["ybins"] = pd.cut(df.y, bins(df.y, config.dy))
+        df["ybins"] = pd.cut(df.y, _local_bin_edges(df.y, config.dy))
     if "dz" in keys:
-        df["zbins"] = pd.cut(df.z, bins(df.z, config.dz))
+        df["zbins"] = pd.cut(df.z, _local_bin_edges(df.z, config.dz))
     if "dtime" in keys:
-        df["timebins"] = pd.cut(df.deltaTime, bins(df.deltaTime, config.dtime))
+        df["timebins"] = pd.cut(df.deltaTime, _local_bin_edges(df.deltaTime, config.dtime))
 
     return df
 
 
+def _local_bin_edges(coord, delta):
+    """
+    Edges of tidy bins of size delta covering coord
+    """
+    return np.arange(
+        np.floor(np.nanmin(coord)) - delta / 2,
+        np.ceil(np.nanmax(coord)) + delta,
+        delta,
+    )
+
+
+def local_bin_edges(df, config):
+    """
+    Edges of the x, y, z and time bins of the dynamic filter covering the samples (dataframe or dict of column arrays)
+    """
+    columns = [("x", config.dx), ("y", config.dy), ("z", config.dz), ("deltaTime", config.dtime)]
+    return [_local_bin_edges(np.asarray(df[c]), delta) for c, delta in columns]
+
+
+def cut_index(values, edges):
+    """
+    Index of the right-closed bin (as in pd.cut) each value falls in, -1 if NaN or outside the edges
+    """
+    index = np.searchsorted(edges, values, side="left") - 1
+    index[np.isnan(values) | (index < 0) | (index >= len(edges) - 1)] = -1
+    return index
+
+
+def local_bin_id(df, config, edges=None):
+    """
+    Integer id (0 to number of non-empty bins - 1) of the x, y, z, time bin of each sample (dataframe or dict of 
+    column arrays), with the same bins as defineLocalBins. Samples outside the bins (or with NaN coordinates) get -1.
+    The bin edges of x, y, z and time can be given (e.g. from local_bin_edges of the limits of a larger dataset).
+    """
+    if edges is None:
+        edges = local_bin_edges(df, config)
+    columns = ["x", "y", "z", "deltaTime"]
+    index = [cut_index(np.asarray(df[c]), e) for c, e in zip(columns, edges)]
+
+    valid = np.all([i >= 0 for i in index], axis=0)
+    code = np.ravel_multi_index([i[valid] for i in index], [i.max() + 1 for i in index])
+    group = np.zeros(len(valid), dtype=int) - 1
+    group[valid] = np.unique(code, return_inverse=True)[1]
+    return group
+
+
+def grouped_std(group, values, n_groups):
+    """
+    Count, mean and standard deviation (ddof=1) of non-NaN values grouped by integer ids from 0 to n_groups-1 
+    (negative ids excluded), computed with bincount
+    """
+    values = np.asarray(values)
+    sel = (group >= 0) & ~np.isnan(values)
+    count = np.bincount(group[sel], minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(group[sel], weights=values[sel], minlength=n_groups) / count
+        var = np.bincount(group[sel], weights=(values[sel] - mean[group[sel]]) ** 2, minlength=n_groups) / (count - 1)
+    var[count < 2] = np.nan
+    return count, mean, np.sqrt(var)
+
+
 def mid(x):
     """
     Mid point in vector
@@ -127,6 +354,44 @@ def gaussian(x, sigma):
     return np.exp(-(x**2) / (2 * sigma**2))
 
 
+def fit_gaussian(x, y, sigma_max=1, max_iter=50, tol=10**-10):
+    """
+    Least-squares width of a unit-height Gaussian fitted to (x, y), bounded in (0, sigma_max]: log-linear
+    estimate refined by Newton iterations on the squared error. Returns None if the iterations do not converge.
+    """
+    # log-linear estimate (ln y = -x^2 / (2 sigma^2) on the positive samples)
+    pos = (y > 0) & (x != 0)
+    a = -np.sum(x[pos] ** 2 * np.log(y[pos])) / np.sum(x[pos] ** 4)
+    sigma = (1 / (2 * a)) ** 0.5 if a > 0 else sigma_max
+    sigma = min(max(sigma, tol), sigma_max)
+
+    # Newton iterations (Gauss-Newton where the curvature is negative), step halved until the error decreases
+    g = gaussian(x, sigma)
+    error = np.sum((g - y) ** 2)
+    for _ in range(max_iter):
+        residual = g - y
+        jacobian = g * x**2 / sigma**3
+        hessian = g * (x**4 / sigma**6 - 3 * x**2 / sigma**4)
+        curvature = np.sum(jacobian**2 + residual * hessian)
+        if curvature <= 0:
+            curvature = np.sum(jacobian**2)
+        step = -np.sum(residual * jacobian) / curvature
+        if not np.isfinite(step):
+            return None
+        step = min(max(step, -sigma / 2), sigma)  # sigma at most halved or doubled per iteration
+        while True:
+            sigma_new = min(max(sigma + step, tol), sigma_max)
+            g_new = gaussian(x, sigma_new)
+            error_new = np.sum((g_new - y) ** 2)
+            if error_new <= error or abs(sigma_new - sigma) <= tol * sigma:
+                break
+            step /= 2
+        if abs(sigma_new - sigma) <= tol * sigma:
+            return sigma_new
+        sigma, g, error = sigma_new, g_new, error_new
+    return None
+
+
 def datestr(num, format="%Y-%m-%d %H:%M:%S.%f"):
     """
     Unix time to string of custom format
@@ -158,6 +423,88 @@ def ceil(value, step):
     """
     return np.ceil(value / step) * step
 
+
+def bin_index(values, edges):
+    """
+    Index of the bin each value falls in (-1 if NaN or outside the edges), using the edge convention 
+    of scipy.stats.binned_statistic (bins closed on the left, last bin also closed on the right)
+    """
+    index = np.digitize(values, edges) - 1
+    decimal = int(-np.log10(np.diff(edges).min())) + 6
+    on_edge = (values >= edges[-1]) & (np.around(values, decimal) == np.around(edges[-1], decimal))
+    index[on_edge] -= 1
+    index[(index < 0) | (index >= len(edges) - 1)] = -1
+    return index
+
+
+def grouped_median(codes, values):
+    """
+    Median of values grouped by integer codes, computed with a single sort
+    
+    Outputs:
+    -------
+    unique codes (sorted), number of values and median of each group
+    """
+    order = np.lexsort((values, codes))
+    codes_sorted = codes[order]
+    values_sorted = values[order]
+    starts = np.flatnonzero(np.concatenate(([len(codes_sorted) > 0], codes_sorted[1:] != codes_sorted[:-1])))
+    counts = np.diff(np.append(starts, len(codes_sorted)))
+    median = (values_sorted[starts + (counts - 1) // 2] + values_sorted[starts + counts // 2]) / 2
+    return codes_sorted[starts], counts, median
+
+
+def grouped_percentile(codes, values, q):
+    """
+    Percentiles q (linear interpolation, as np.percentile) of values grouped by integer codes, computed with a single sort
+    
+    Outputs:
+    -------
+    unique codes (sorted), percentiles of each group (one row per percentile)
+    """
+    order = np.lexsort((values, codes))
+    codes_sorted = codes[order]
+    values_sorted = values[order]
+    starts = np.flatnonzero(np.concatenate(([len(codes_sorted) > 0], codes_sorted[1:] != codes_sorted[:-1])))
+    counts = np.diff(np.append(starts, len(codes_sorted)))
+
+    percentiles = []
+    for quantile in np.atleast_1d(q) / 100:
+        virtual_index = (counts - 1) * quantile
+        previous_index = np.floor(virtual_index)
+        gamma = virtual_index - previous_index
+        previous_index = np.minimum(previous_index.astype(int), counts - 1)
+        next_index = np.minimum(previous_index + 1, counts - 1)
+        a = values_sorted[starts + previous_index]
+        b = values_sorted[starts + next_index]
+        percentiles.append(np.where(gamma >= 0.5, b - (b - a) * (1 - gamma), a + (b - a) * gamma))
+    return codes_sorted[starts], np.array(percentiles)
+
+
+def set_block(grid, times, mask, values):
+    """
+    Set the values of the samples selected by mask in the columns times of a 2-D grid (in place)
+    """
+    block = grid[:, times]
+    block[mask] = values
+    grid[:, times] = block
+
+
+def nullable_dtype(dtype):
+    """
+    Data type and fill value able to hold missing values for the given data type (integers are promoted 
+    to float as in xarray.where and unstack)
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return dtype, np.nan
+    if dtype.kind in "mM":
+        return dtype, dtype.type("NaT")
+    if dtype.kind in "iu":
+        return np.dtype(np.float32 if dtype.itemsize <= 2 else np.float64), np.nan
+    return np.dtype(object), np.nan
+
+
 def nanmin_time(value,_format='%Y-%m-%d %H:%M:%S'):
     min_time=np.min(value[value>np.datetime64('1970-01-01T00:00:00')])
     return min_time.dt.strftime(_format).values
@@ -301,7 +648,7 @@ def add_qc_attrs(ds, qcAttrDict: dict):
     qc_attrs = {
         "units": "int",
         "long_name": "Wind speed QC flag",
-        "description": "This variable contains bit-packed integer values, where each bit represents a QC test on the data. Non-zero bits indicate the QC condition given in the description for those bits.",
+        "description": "This variable contains bit-packed integer values, where each bit represents a QC test on the data (bit k has value 2**(k-1)). Non-zero bits indicate the QC condition given in the description for those bits, 0 indicates good data.",
         "bit_0_description": "Value retained.",
         "bit_0_assessment": "Good",
     }
@@ -0,0 +1,359 @@
+'''
+Watch a directory and format and standardize raw lidar files as they land.
+
+New files are detected by polling the modification time of the directories, so that only the directories where
+files were added (including new date subdirectories) are listed. Hourly files are processed once their hour is
+over, and files modified after being processed are processed again. A cursor of the processed files is persisted as
+JSON, so a restarted watcher neither misses the files that landed while it was down nor reprocesses old ones. Files
+are formatted and standardized in a pool of worker processes, failed files are retried a limited number of times,
+and the queue depth and per-file latency are exposed as metrics.
+'''
+import os
+import re
+import time
+import calendar
+import json
+import fnmatch
+import argparse
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Union, Optional
+from lidargo.format import Format
+from lidargo.standardize import Standardize
+from lidargo.config import LidarConfigFormat, LidarConfigStand
+from lidargo.utilities import get_logger, output_exists
+
+
+def process_raw(source, config_format, config_stand, format_path=None, standardize_path=None):
+    """
+    Format and standardize a raw file (run in the worker processes)
+
+    Outputs:
+    -------
+    save_filename: str
+        name of the standardized file (or of its record in the Zarr store), or None if it was not produced
+    """
+    lformat = Format(source, config=config_format, verbose=False)
+    if "config" in dir(lformat):
+        check_format_output(lformat.config)
+    lformat.process_scan(save_path=format_path, make_figures=False)
+    if "save_filename" not in dir(lformat) or not os.path.isfile(lformat.save_filename):
+        return None
+
+    lproc = Standardize(lformat.save_filename, config=config_stand, verbose=False)
+    lproc.process_scan(save_path=standardize_path, make_figures=False)
+    if "save_filename" not in dir(lproc) or not output_exists(
+        lproc.save_filename, lproc.config.output_format, lproc.config.zarr_grouping
+    ):
+        return None
+    return lproc.save_filename
+
+
+def check_format_output(config):
+    """
+    Raise a ValueError if the formatting writes to Zarr stores, since the watcher standardizes each formatted file
+    """
+    if getattr(config, "output_format", "netcdf") == "zarr" or (isinstance(config, dict) and config.get("output_format") == "zarr"):
+        raise ValueError(
+            "The watcher standardizes each formatted file, so the Format step requires output_format='netcdf' "
+            + "(Zarr output is supported for the Standardize step)"
+        )
+
+
+class Watcher:
+    def __init__(
+        self,
+        path: str,
+        config_format: Union[str, dict, LidarConfigFormat],
+        config_stand: Union[str, dict, LidarConfigStand],
+        patterns: list = ["**/User*.hpl", "**/Stare*.hpl"],
+        format_path: Optional[str] = None,
+        standardize_path: Optional[str] = None,
+        cursor: Optional[str] = None,
+        workers: int = 2,
+        interval: float = 1.0,
+        settle: float = 2.0,
+        retries: int = 2,
+        recheck: float = 7200.0,
+        metrics_file: Optional[str] = None,
+        verbose: bool = True,
+        logger: Optional[object] = None,
+        logfile=None,
+    ):
+        """
+        Initialize the watcher of a directory of raw lidar files.
+
+        Args:
+            path (str): Directory watched for new raw files
+            config_format (str, dict, or LidarConfigFormat): Configuration of the formatting (Excel file, dictionary or LidarConfigFormat object)
+            config_stand (str, dict, or LidarConfigStand): Configuration of the standardization (Excel file, dictionary or LidarConfigStand object)
+            patterns (list, optional): Glob patterns of the raw files, relative to path (**/ matches any subdirectory, including none). Defaults to Halo user and stare files in any subdirectory.
+            format_path (str, optional): Directory of the formatted files. Defaults to None (next to the raw files).
+            standardize_path (str, optional): Directory of the standardized files. Defaults to None (next to the formatted files).
+            cursor (str, optional): JSON file of the processed files, loaded at start and updated as files are processed. Defaults to .lidargo_cursor.json in path.
+            workers (int, optional): Number of worker processes. Defaults to 2.
+            interval (float, optional): Polling interval in seconds. Defaults to 1.
+            settle (float, optional): Time in seconds a file must stay unchanged before being processed, so that files still being written are skipped. Hourly files (e.g. Stare_194_20240301_01.hpl), which are appended for the whole hour in their name, are processed settle seconds after the end of the hour. Defaults to 2.
+            retries (int, optional): Number of times a failed file is processed again (after settling again) before being recorded as failed. Defaults to 2.
+            recheck (float, optional): Time in seconds after their last modification during which processed files are checked for changes, and processed again if modified. Defaults to 7200.
+            metrics_file (str, optional): JSON file the metrics are written to at every poll. Defaults to None.
+            verbose (bool, optional): Whether to print information on the processed files. Defaults to True.
+            logger (Logger, optional): Logger instance for logging messages. Defaults to None.
+        """
+        self.logger = get_logger(verbose=verbose, logger=logger, filename=logfile)
+        check_format_output(config_format)
+        self.path = path
+        self.config_format = config_format
+        self.config_stand = config_stand
+        self.patterns = [patterns] if isinstance(patterns, str) else patterns
+        self.format_path = format_path
+        self.standardize_path = standardize_path
+        self.cursor = os.path.join(path, ".lidargo_cursor.json") if cursor is None else cursor
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self.retries = retries
+        self.recheck = recheck
+        self.metrics_file = metrics_file
+
+        # processed files (status, modification time, size, output), recently modified processed files checked for
+        # changes, candidates waiting to settle, running jobs, failed attempts of the files to retry, and
+        # modification time of the directories when last listed
+        self.processed = {}
+        if os.path.isfile(self.cursor):
+            with open(self.cursor, "r") as f:
+                self.processed = json.load(f)
+        self.recent = {s for s, p in self.processed.items() if time.time() - p["mtime"] < self.recheck}
+        self.candidates = {}
+        self.running = {}
+        self.attempts = {}
+        self.directories = {}
+        self.latency = deque(maxlen=1000)
+        self.counts = {"done": 0, "skipped": 0, "failed": 0, "retried": 0}
+
+        self.logger.log(
+            f"Watching {self.path} ({len(self.processed)} files already processed)"
+        )
+
+    def run(self, duration: Optional[float] = None):
+        """
+        Poll the directory until interrupted (or for duration seconds), then wait for the running jobs and save the cursor.
+        """
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while duration is None or time.time() - start < duration:
+                    self.poll(pool)
+                    time.sleep(self.interval)
+            except KeyboardInterrupt:
+                self.logger.log("Stopping watcher, waiting for the running jobs")
+            wait(list(self.running))
+            self.collect()
+            self.save_cursor()
+
+    def poll(self, pool):
+        """
+        Collect the finished jobs, then submit the new (or modified) raw files that stayed unchanged for settle seconds.
+        """
+        self.collect()
+
+        now = time.time()
+        running = {source for source, *_ in self.running.values()}
+        for source in sorted(self.scan() | set(self.candidates) | self.recent):
+            if source in running:
+                continue
+            try:
+                stat = os.stat(source)
+            except OSError:
+                self.candidates.pop(source, None)
+                self.recent.discard(source)
+                continue
+            key = [stat.st_size, stat.st_mtime_ns]
+            if source in self.processed:
+                if self.processed[source].get("key", key) == key:
+                    if now - stat.st_mtime >= self.recheck:
+                        self.recent.discard(source)
+                    continue
+                self.logger.log(f"{os.path.basename(source)} was modified after being processed, processing it again")
+                del self.processed[source]
+                self.recent.discard(source)
+
+            if source not in self.candidates or self.candidates[source][0] != key:
+                self.candidates[source] = (key, now)
+            elif now - self.candidates[source][1] >= self.settle and self.closed(source, now):
+                del self.candidates[source]
+                future = pool.submit(
+                    process_raw, source, self.config_format, self.config_stand, self.format_path, self.standardize_path
+                )
+                self.running[future] = (source, stat.st_mtime, now, key)
+                running.add(source)
+
+        if self.metrics_file is not None:
+            temp = self.metrics_file + ".tmp"
+            with open(temp, "w") as f:
+                json.dump(self.metrics(), f, indent=1)
+            os.replace(temp, self.metrics_file)
+
+    def scan(self) -> set:
+        """
+        Raw files in the directories modified since they were last listed. Only the modification time of the known
+        directories is checked at every poll, and new subdirectories are listed as they appear. Directories modified
+        less than a second before being listed are listed again at the next poll, so that files added within the
+        resolution of the modification time are not missed.
+        """
+        files = set()
+        queue = [self.path] + [d for d in self.directories if d != self.path]
+        while len(queue) > 0:
+            directory = queue.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self.directories.pop(directory, None)
+                continue
+            if directory in self.directories and self.directories[directory] == mtime:
+                continue
+
+            listed = time.time_ns()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            self.directories[directory] = mtime if listed - mtime >= 10**9 else None
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.path not in self.directories:
+                        queue.append(entry.path)
+                elif self.match(os.path.relpath(entry.path, self.path)):
+                    files.add(entry.path)
+        return files
+
+    def closed(self, source: str, now: float) -> bool:
+        """
+        Whether a raw file is no longer written. Hourly files (named after their hour, e.g. Stare_194_20240301_01.hpl)
+        are appended until the end of the hour in UTC, and are closed settle seconds after it. Other files are closed
+        once they stayed unchanged for settle seconds (see poll).
+        """
+        match = re.search(r"_(\d{8})_(\d{2})\.hpl$", os.path.basename(source))
+        if match is None:
+            return True
+        end = calendar.timegm(time.strptime(match.group(1) + match.group(2), "%Y%m%d%H")) + 3600
+        return now >= end + self.settle
+
+    def match(self, relative: str) -> bool:
+        """
+        Whether a path relative to the watched directory matches the patterns of the raw files.
+        """
+        relative = relative.replace(os.sep, "/")
+        return any(
+            fnmatch.fnmatch(relative, p) or (p.startswith("**/") and fnmatch.fnmatch(relative, p[3:])) for p in self.patterns
+        )
+
+    def collect(self):
+        """
+        Record the outcome and latency of the finished jobs and update the cursor.
+        """
+        finished = [future for future in self.running if future.done()]
+        for future in finished:
+            source, mtime, _, key = self.running.pop(future)
+            try:
+                output = future.result()
+                status = "done" if output is not None else "skipped"
+            except Exception as e:
+                output = None
+                status = "failed"
+                self.logger.log(f"Error processing {os.path.basename(source)}: {str(e)}", level="error")
+
+            # process failed files again after settling, up to the number of retries
+            attempts = self.attempts.pop(source, 0) + 1
+            if status == "failed" and attempts <= self.retries:
+                self.attempts[source] = attempts
+                self.candidates[source] = (None, time.time())
+                self.counts["retried"] += 1
+                self.logger.log(f"{os.path.basename(source)}: retrying ({attempts} of {self.retries})")
+                continue
+
+            # latency from the last modification of the raw file to the publication of the standardized file
+            latency = time.time() - mtime
+            self.latency.append(latency)
+            self.counts[status] += 1
+            self.processed[source] = {
+                "status": status, "mtime": mtime, "key": key, "output": output, "latency": latency, "attempts": attempts
+            }
+            self.recent.add(source)
+            self.logger.log(
+                f"{os.path.basename(source)}: {status} in {np.round(latency, 1)} s"
+                + (f" ({os.path.basename(output)})" if output is not None else "")
+            )
+
+        if len(finished) > 0:
+            self.save_cursor()
+
+    def metrics(self) -> dict:
+        """
+        Queue depth (files waiting to settle and jobs submitted), counts of processed files, and latency statistics in seconds.
+        """
+        latency = np.array(self.latency)
+        return {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "queue_depth": len(self.candidates) + len(self.running),
+            "settling": len(self.candidates),
+            "running": len(self.running),
+            **self.counts,
+            "latency_last": float(latency[-1]) if len(latency) > 0 else None,
+            "latency_median": float(np.median(latency)) if len(latency) > 0 else None,
+            "latency_p95": float(np.percentile(latency, 95)) if len(latency) > 0 else None,
+        }
+
+    def save_cursor(self):
+        """
+        Save the processed files, replacing the cursor at once so that it is never left partially written.
+        """
+        temp = self.cursor + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.processed, f, indent=1)
+        os.replace(temp, self.cursor)
+
+
+def main(args=None):
+    """
+    Command line entry point of the watch mode.
+    """
+    parser = argparse.ArgumentParser(prog="lidargo watch", description="Format and standardize raw lidar files as they land in a directory.")
+    parser.add_argument("path", help="directory watched for new raw files")
+    parser.add_argument("--config-format", required=True, help="Excel configuration file of the formatting")
+    parser.add_argument("--config-standardize", required=True, help="Excel configuration file of the standardization")
+    parser.add_argument("--pattern", action="append", help="glob pattern of the raw files (repeatable)")
+    parser.add_argument("--format-path", help="directory of the formatted files")
+    parser.add_argument("--standardize-path", help="directory of the standardized files")
+    parser.add_argument("--cursor", help="JSON file of the processed files")
+    parser.add_argument("--jobs", type=int, default=2, help="number of worker processes")
+    parser.add_argument("--interval", type=float, default=1.0, help="polling interval in seconds")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds a file must stay unchanged before processing")
+    parser.add_argument("--retries", type=int, default=2, help="number of times a failed file is processed again")
+    parser.add_argument("--recheck", type=float, default=7200.0, help="seconds after their last modification during which processed files are checked for changes")
+    parser.add_argument("--metrics", help="JSON file of the metrics, updated at every poll")
+    parser.add_argument("--logfile", help="log file")
+    args = parser.parse_args(args)
+
+    watcher = Watcher(
+        args.path,
+        args.config_format,
+        args.config_standardize,
+        patterns=args.pattern or ["**/User*.hpl", "**/Stare*.hpl"],
+        format_path=args.format_path,
+        standardize_path=args.standardize_path,
+        cursor=args.cursor,
+        workers=args.jobs,
+        interval=args.interval,
+        settle=args.settle,
+        retries=args.retries,
+        recheck=args.recheck,
+        metrics_file=args.metrics,
+        logfile=args.logfile,
+    )
+    watcher.run()
+
+
+if __name__ == "__main__":
+    main()
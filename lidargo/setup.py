@@ -13,6 +13,11 @@ setup(
     long_description_content_type="LiDARGO (LiDAR General Operator): Fromatting, standardization, quality control, and statistics of scanning lidar data.",
     url="https://github.com/NREL/fiexta/lidargo",
     packages=find_packages(),
+    entry_points={
+        "console_scripts": [
+            "lidargo=lidargo.cli:main",
+        ],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Science/Research",